@@ -0,0 +1,62 @@
+'''
+Compare two result files written by benchmarks.run.
+
+    python -m benchmarks.compare BASE.json NEW.json [--threshold 1.10]
+
+Prints the ratio NEW / BASE for every case and stage that appears in both
+files. Exits with status 1 if any total got slower than the threshold, so it
+can be used to catch regressions between commits.
+'''
+
+import sys
+import json
+import argparse
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data['meta'], dict((r['case'], r) for r in data['results'])
+
+def compare(base, new, threshold):
+    '''
+    Returns a list of (case, stage, base seconds, new seconds, ratio) tuples
+    and the list of cases whose total regressed by more than threshold.
+    '''
+    rows = []
+    regressions = []
+    for case in sorted(set(base) & set(new)):
+        a, b = base[case]['seconds'], new[case]['seconds']
+        for stage in sorted(set(a) & set(b)):
+            ratio = b[stage] / a[stage] if a[stage] else float('inf')
+            rows.append((case, stage, a[stage], b[stage], ratio))
+            if stage == 'total' and ratio > threshold:
+                regressions.append(case)
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two unwind benchmark results')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=1.10,
+                        help='report a regression if a total is slower by more than this factor')
+    parser.add_argument('--totals', action='store_true', help='only show totals')
+    args = parser.parse_args(argv)
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print('base: %s (%s)' % (base_meta.get('commit'), base_meta.get('time')))
+    print('new:  %s (%s)' % (new_meta.get('commit'), new_meta.get('time')))
+    print('%-40s %-32s %10s %10s %7s' % ('case', 'stage', 'base', 'new', 'ratio'))
+
+    rows, regressions = compare(base, new, args.threshold)
+    for case, stage, a, b, ratio in rows:
+        if args.totals and stage != 'total':
+            continue
+        print('%-40s %-32s %10.4f %10.4f %6.2fx' % (case, stage, a, b, ratio))
+
+    for case in regressions:
+        print('regression: %s' % case)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
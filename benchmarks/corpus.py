@@ -0,0 +1,351 @@
+'''
+Deterministic generator of synthetic *.pyc files for benchmarking.
+
+corpus.MAGICS
+    Map of Python version to the magic number of the final release of that
+    version. These are the default targets of the generator.
+
+corpus.SHAPES
+    Map of shape name to a function(assembler, size, rng) that returns the
+    top-level code object of a synthetic module. The shapes stress different
+    parts of unwind:
+
+        many_functions = many small function definitions
+        deep_nesting = functions nested inside each other
+        huge_constants = one constant table with more than 65536 entries,
+                         of which every 20th and the ones above 65535
+                         (which need EXTENDED_ARG) are used
+        straight_line = one long basic block of assignments
+        wide_branching = a long chain of if/else statements, producing a
+                         control flow graph with many basic blocks
+        huge_longs = a table of integers with size 15-bit digits each, like
+                     the generated lookup tables of numeric code
+
+corpus.generate(shape, magic, size, seed=0)
+    Returns the contents of a *.pyc file as bytes. The same arguments
+    always produce the same bytes.
+
+corpus.write_corpus(directory, magics=None, shapes=None, scale=1.0, seed=0)
+    Generate one file per shape and magic number in directory and return a
+    list of (shape, magic, path) tuples.
+'''
+
+import os
+import random
+import struct
+import unwind.op as op
+
+MAGICS = {
+    '2.5': 62131 | (ord('\r') << 16) | (ord('\n') << 24),
+    '2.6': 62161 | (ord('\r') << 16) | (ord('\n') << 24),
+    '2.7': 62211 | (ord('\r') << 16) | (ord('\n') << 24),
+    '3.1': 3150 | (ord('\r') << 16) | (ord('\n') << 24),
+    '3.2': 3180 | (ord('\r') << 16) | (ord('\n') << 24),
+}
+
+# Default size of each shape, multiplied by the scale passed to write_corpus()
+SIZES = {
+    'many_functions': 1000,
+    'deep_nesting': 60,
+    'huge_constants': 70000,
+    'straight_line': 2000,
+    'wide_branching': 80,
+    'huge_longs': 20000,
+}
+
+# Fixed timestamp so that the output is byte-for-byte reproducible
+_TIMESTAMP = 1300000000
+
+# Marshal type codes, see disasm._TYPE_*
+_TYPE_NONE = b'N'
+_TYPE_INT = b'i'
+_TYPE_BINARY_FLOAT = b'g'
+_TYPE_LONG = b'l'
+_TYPE_STRING = b's'
+_TYPE_UNICODE = b'u'
+_TYPE_TUPLE = b'('
+_TYPE_CODE = b'c'
+
+_CO_OPTIMIZED = 0x1
+_CO_NEWLOCALS = 0x2
+_CO_NOFREE = 0x40
+
+class _Code:
+    '''
+    A code object under construction.
+    '''
+
+    def __init__(self, name, argcount=0, flags=_CO_NOFREE):
+        self.name = name
+        self.argcount = argcount
+        self.flags = flags
+        self.code = bytearray()
+        self.consts = []
+        self.names = []
+        self.varnames = []
+        self.stacksize = 1
+        self._const_index = {}
+
+    def const(self, value):
+        # Code objects are never merged, other constants are deduplicated the
+        # same way the compiler does
+        if isinstance(value, _Code):
+            self.consts.append(value)
+            return len(self.consts) - 1
+        key = (type(value), value)
+        if key not in self._const_index:
+            self._const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self._const_index[key]
+
+    def name_index(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def varname_index(self, name):
+        if name not in self.varnames:
+            self.varnames.append(name)
+        return self.varnames.index(name)
+
+class Assembler:
+    '''
+    Emits bytecode for one magic number using the opcode table unwind has for
+    that magic number.
+    '''
+
+    def __init__(self, magic):
+        self.magic = magic
+        version = op.python_version_from_magic(magic)
+        if not version:
+            raise ValueError('Unknown magic number %d' % magic)
+        self.python3 = version.startswith('3')
+        self.bytecodes = {}
+        for b in range(256):
+            name = op.from_bytecode(b, magic)
+            if name is not None:
+                self.bytecodes.setdefault(name, b)
+
+    def has(self, opcode):
+        return opcode in self.bytecodes
+
+    def emit(self, code, opcode, argument=None):
+        '''
+        Append opcode to code and return the offset of the instruction so
+        jumps can be patched later.
+        '''
+        if opcode not in self.bytecodes:
+            raise ValueError('%s does not exist for magic %d' % (op.opcode_names[opcode], self.magic))
+        if argument is not None and argument > 0xFFFF:
+            code.code += struct.pack('<BH', self.bytecodes[op.EXTENDED_ARG], argument >> 16)
+            argument &= 0xFFFF
+        offset = len(code.code)
+        code.code.append(self.bytecodes[opcode])
+        if op.has_argument(opcode):
+            code.code += struct.pack('<H', argument or 0)
+        return offset
+
+    def patch(self, code, offset, argument):
+        code.code[offset + 1:offset + 3] = struct.pack('<H', argument)
+
+    def pop_jump_if_false(self, code):
+        '''
+        Emit a conditional jump that pops its condition and return the offset
+        to patch with the absolute target. Older revisions only have the
+        relative JUMP_IF_FALSE, which leaves the condition on the stack.
+        '''
+        if self.has(op.POP_JUMP_IF_FALSE):
+            return self.emit(code, op.POP_JUMP_IF_FALSE, 0), True
+        offset = self.emit(code, op.JUMP_IF_FALSE, 0)
+        self.emit(code, op.POP_TOP)
+        return offset, False
+
+    def make_function(self, parent, child, name):
+        self.emit(parent, op.LOAD_CONST, parent.const(child))
+        self.emit(parent, op.MAKE_FUNCTION, 0)
+        if parent.flags & _CO_NEWLOCALS:
+            self.emit(parent, op.STORE_FAST, parent.varname_index(name))
+        else:
+            self.emit(parent, op.STORE_NAME, parent.name_index(name))
+
+    def return_none(self, code):
+        self.emit(code, op.LOAD_CONST, code.const(None))
+        self.emit(code, op.RETURN_VALUE)
+
+    # Serialization in the marshal format read by unwind.disasm
+
+    def marshal_module(self, code):
+        return struct.pack('=II', self.magic, _TIMESTAMP) + self.marshal(code)
+
+    def marshal(self, value):
+        if value is None:
+            return _TYPE_NONE
+        elif isinstance(value, _Code):
+            return self.marshal_code(value)
+        elif isinstance(value, tuple):
+            return _TYPE_TUPLE + struct.pack('=i', len(value)) + b''.join(self.marshal(v) for v in value)
+        elif isinstance(value, int) and -2 ** 31 <= value < 2 ** 31:
+            return _TYPE_INT + struct.pack('=i', value)
+        elif isinstance(value, int):
+            digits = []
+            n = abs(value)
+            while n:
+                digits.append(n & 0x7FFF)
+                n >>= 15
+            count = len(digits) if value > 0 else -len(digits)
+            return _TYPE_LONG + struct.pack('=i%dh' % len(digits), count, *digits)
+        elif isinstance(value, float):
+            return _TYPE_BINARY_FLOAT + struct.pack('=d', value)
+        elif isinstance(value, str):
+            return self.marshal_text(value)
+        raise TypeError('Cannot marshal %r' % (value,))
+
+    def marshal_text(self, text):
+        data = text.encode('utf8')
+        return (_TYPE_UNICODE if self.python3 else _TYPE_STRING) + struct.pack('=i', len(data)) + data
+
+    def marshal_code(self, code):
+        fields = [code.argcount]
+        if op.has_kwonlyargcount(self.magic):
+            fields.append(0)
+        fields += [len(code.varnames), code.stacksize, code.flags]
+        result = _TYPE_CODE + struct.pack('=%di' % len(fields), *fields)
+        result += _TYPE_STRING + struct.pack('=i', len(code.code)) + bytes(code.code)
+        result += self.marshal(tuple(code.consts))
+        result += self.marshal(tuple(code.names))
+        result += self.marshal(tuple(code.varnames))
+        result += self.marshal(())
+        result += self.marshal(())
+        result += self.marshal_text('<synthetic>')
+        result += self.marshal_text(code.name)
+        result += struct.pack('=i', 1)
+        result += _TYPE_STRING + struct.pack('=i', 0)
+        return result
+
+# Shapes
+
+def _function(asm, name, rng):
+    f = _Code(name, argcount=2, flags=_CO_OPTIMIZED | _CO_NEWLOCALS | _CO_NOFREE)
+    f.varname_index('a')
+    f.varname_index('b')
+    asm.emit(f, op.LOAD_FAST, 0)
+    asm.emit(f, op.LOAD_FAST, 1)
+    asm.emit(f, op.BINARY_ADD)
+    asm.emit(f, op.LOAD_CONST, f.const(rng.randint(0, 1000)))
+    asm.emit(f, op.BINARY_MULTIPLY)
+    asm.emit(f, op.RETURN_VALUE)
+    f.stacksize = 2
+    return f
+
+def _many_functions(asm, size, rng):
+    module = _Code('<module>')
+    for i in range(size):
+        asm.make_function(module, _function(asm, 'f%d' % i, rng), 'f%d' % i)
+    asm.return_none(module)
+    return module
+
+def _deep_nesting(asm, size, rng):
+    inner = _function(asm, 'f%d' % size, rng)
+    for depth in range(size - 1, -1, -1):
+        outer = _Code('f%d' % depth, flags=_CO_OPTIMIZED | _CO_NEWLOCALS | _CO_NOFREE)
+        asm.make_function(outer, inner, inner.name)
+        asm.emit(outer, op.LOAD_FAST, outer.varname_index(inner.name))
+        asm.emit(outer, op.RETURN_VALUE)
+        inner = outer
+    module = _Code('<module>')
+    asm.make_function(module, inner, inner.name)
+    asm.return_none(module)
+    return module
+
+def _huge_constants(asm, size, rng):
+    module = _Code('<module>')
+    kinds = [
+        lambda i: i * 7919,
+        lambda i: (i * 104729) ** 3,
+        lambda i: i / 7.0,
+        lambda i: 'constant %d' % i,
+    ]
+    for i in range(size):
+        index = module.const(kinds[i % len(kinds)](i))
+        if i % 20 == 0 or index > 0xFFFF:
+            asm.emit(module, op.LOAD_CONST, index)
+            asm.emit(module, op.STORE_NAME, module.name_index('v%d' % rng.randint(0, 255)))
+    asm.return_none(module)
+    return module
+
+def _straight_line(asm, size, rng):
+    module = _Code('<module>')
+    module.stacksize = 2
+    for i in range(size):
+        asm.emit(module, op.LOAD_NAME, module.name_index('x%d' % rng.randint(0, 99)))
+        asm.emit(module, op.LOAD_CONST, module.const(rng.randint(0, 99)))
+        asm.emit(module, rng.choice([op.BINARY_ADD, op.BINARY_SUBTRACT, op.BINARY_MULTIPLY]))
+        asm.emit(module, op.STORE_NAME, module.name_index('x%d' % rng.randint(0, 99)))
+    asm.return_none(module)
+    return module
+
+def _wide_branching(asm, size, rng):
+    module = _Code('<module>')
+    module.stacksize = 2
+    for i in range(size):
+        # if c: x = 1
+        # else: x = 2
+        asm.emit(module, op.LOAD_NAME, module.name_index('c%d' % rng.randint(0, 9)))
+        jump, pops = asm.pop_jump_if_false(module)
+        asm.emit(module, op.LOAD_CONST, module.const(i))
+        asm.emit(module, op.STORE_NAME, module.name_index('x'))
+        forward = asm.emit(module, op.JUMP_FORWARD, 0)
+        else_start = len(module.code)
+        if not pops:
+            asm.emit(module, op.POP_TOP)
+        asm.emit(module, op.LOAD_CONST, module.const(-i))
+        asm.emit(module, op.STORE_NAME, module.name_index('x'))
+        end = len(module.code)
+        asm.patch(module, jump, else_start if pops else else_start - jump - 3)
+        asm.patch(module, forward, end - forward - 3)
+    asm.return_none(module)
+    return module
+
+def _huge_longs(asm, size, rng):
+    module = _Code('<module>')
+    for i in range(8):
+        value = rng.getrandbits(15 * size) | 1 << (15 * size - 1)
+        asm.emit(module, op.LOAD_CONST, module.const(value if i % 2 else -value))
+        asm.emit(module, op.STORE_NAME, module.name_index('n%d' % i))
+    asm.return_none(module)
+    return module
+
+SHAPES = {
+    'many_functions': _many_functions,
+    'deep_nesting': _deep_nesting,
+    'huge_constants': _huge_constants,
+    'straight_line': _straight_line,
+    'wide_branching': _wide_branching,
+    'huge_longs': _huge_longs,
+}
+
+def generate(shape, magic, size, seed=0):
+    '''
+    Returns the contents of a synthetic *.pyc file as bytes. The same
+    arguments always produce the same bytes.
+    '''
+    asm = Assembler(magic)
+    rng = random.Random('%s-%d-%d-%d' % (shape, magic, size, seed))
+    return asm.marshal_module(SHAPES[shape](asm, size, rng))
+
+def write_corpus(directory, magics=None, shapes=None, scale=1.0, seed=0):
+    '''
+    Generate one file per shape and magic number in directory and return a
+    list of (shape, magic, path) tuples.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    result = []
+    for shape in sorted(shapes or SHAPES):
+        size = max(1, int(SIZES[shape] * scale))
+        for magic in sorted(magics or MAGICS.values()):
+            path = os.path.join(directory, '%s-%d.pyc' % (shape, magic))
+            with open(path, 'wb') as f:
+                f.write(generate(shape, magic, size, seed))
+            result.append((shape, magic, path))
+    return result
@@ -0,0 +1,497 @@
+'''
+Reproduces the measurements of individual features over a directory of
+*.pyc files, such as a compiled standard library, or over the synthetic
+corpus from benchmarks.corpus when no directory is given.
+
+    python -m benchmarks.features [--root DIR] [--feature NAME]
+                                  [--scale 0.25] [--repeat 3]
+                                  [--output results.json]
+
+Files that can't be disassembled are left out. Every feature reports its
+own numbers and every time is the minimum over the repeats. Results are
+written as JSON:
+
+    {
+        "meta": {"python": ..., "root": ..., "files": 414, ...},
+        "results": {
+            "columnar": {"rows_seconds": 0.7, "rows_bytes": 55000000, ...},
+            ...
+        }
+    }
+
+The features are:
+
+    aio       disassembling 80 files with aio.disassemble_many() behind a
+              simulated 10ms fetch each, and how late a task that ticks
+              every 5ms got while it ran
+    archive   disassembling every file from disk, from a zip file and from
+              a gzipped tar file
+    codegen   generating source for statements nested 200 deep
+    columnar  disassembling every file with opcodes in lists and in
+              disasm.OpcodeColumns, and the memory the modules take
+    constants unmarshalling a synthetic Python 2.7 module with eight
+              300,000-bit integers and one with 200,000 number and string
+              constants, without decoding their opcodes
+    export    writing every file as NDJSON with export.write_ndjson() from
+              row and columnar modules, compared with repr() of the row
+              modules, and the memory both allocate at their peak for the
+              largest file
+    index     building an index.Index of every file, updating it when
+              nothing changed, and the mean time of name and opcode
+              sequence queries
+    magic     the mean time of op.python_version_from_magic() for the
+              magic numbers of the files
+    memory    the memory taken by up to 200 standard library modules
+              compiled by the running interpreter, disassembled into rows
+              and columns and loaded by marshal
+    select    disassembling every file eagerly and with lazy=True, and
+              decompiling a synthetic Python 2.7 module of 4000 functions
+              whole and with one function selected
+    similarity
+              adding a signature of every code object of every file to a
+              similarity.LSHIndex, finding its clusters and the mean time
+              of a query
+    store     saving every file with store.save() and loading it back
+              whole or one code object at a time, compared with
+              disassembling it, and the size of the files
+    triage    scanning a tree of 100 directories holding 100 files each
+              with triage.scan(), the files are the first bytes of the
+              files being measured
+    wordcode  decoding the opcodes of up to 200 standard library modules
+              compiled by the running interpreter in bulk, compared with a
+              loop over every opcode
+
+The codegen and constants features don't use the files. Neither do the
+memory and wordcode features, since only the running interpreter's own
+wordcode can be read.
+'''
+
+import os
+import sys
+import asyncio
+import json
+import time
+import shutil
+import marshal
+import argparse
+import py_compile
+import platform
+import tempfile
+import tracemalloc
+
+import unwind.op as op
+import unwind.aio as aio
+import unwind.ast as ast
+import unwind.disasm as disasm
+import unwind.codegen as codegen
+import unwind.index as index
+import unwind.export as export
+import unwind.similarity as similarity
+import unwind.decomp as decomp
+import unwind.store as store
+import unwind.triage as triage
+from benchmarks import corpus
+
+# Returns the minimum number of seconds function() takes over repeat calls
+def _best(repeat, function):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+# Returns the number of bytes allocated by function() that are still in use
+# when it returns, along with its result
+def _traced(function):
+    tracemalloc.start()
+    try:
+        result = function()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+async def _aio_run(blobs):
+    lateness = []
+    async def ticker():
+        while True:
+            start = time.time()
+            await asyncio.sleep(0.005)
+            lateness.append(time.time() - start - 0.005)
+
+    async def fetch(blob):
+        await asyncio.sleep(0.01)
+        return blob
+
+    task = asyncio.ensure_future(ticker())
+    start = time.time()
+    count = 0
+    async for index, module in aio.disassemble_many([fetch(blob) for blob in blobs]):
+        count += 1
+    seconds = time.time() - start
+    task.cancel()
+    assert count == len(blobs)
+    return seconds, max(lateness or [0.0])
+
+def _aio(paths, repeat):
+    blobs = []
+    for i in range(80):
+        with open(paths[i % len(paths)], 'rb') as f:
+            blobs.append(f.read())
+    runs = [asyncio.run(_aio_run(blobs)) for i in range(repeat)]
+    return {'seconds': min(seconds for seconds, late in runs), 'max_tick_lateness': max(late for seconds, late in runs)}
+
+def _archive(paths, repeat):
+    import tarfile
+    import zipfile
+    directory = tempfile.mkdtemp(prefix='unwind-features-archive-')
+    try:
+        zip_path = os.path.join(directory, 'files.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as f:
+            for i, path in enumerate(paths):
+                f.write(path, '%d/%s' % (i, os.path.basename(path)))
+        tar_path = os.path.join(directory, 'files.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as f:
+            for i, path in enumerate(paths):
+                f.add(path, '%d/%s' % (i, os.path.basename(path)))
+        return {
+            'files_seconds': _best(repeat, lambda: [disasm.disassemble(path) for path in paths]),
+            'zip_seconds': _best(repeat, lambda: list(disasm.disassemble_archive(zip_path))),
+            'tar_seconds': _best(repeat, lambda: list(disasm.disassemble_archive(tar_path))),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+# Every level is an assignment followed by an if statement holding the next
+# level. Deeper trees run out of stack in the code generator.
+def _nested_tree(depth):
+    node = ast.Block(ast.Assign(ast.Ident('x'), ast.Const(0)))
+    for i in range(depth):
+        node = ast.Block(ast.Assign(ast.Ident('y%d' % i), ast.Const(i)), ast.If(ast.Ident('c%d' % i), node, None))
+    return node
+
+def _codegen(paths, repeat):
+    tree = _nested_tree(200)
+    return {'nested_seconds': _best(repeat, lambda: tree.accept(codegen.SourceCodeGenerator()))}
+
+def _columnar(paths, repeat):
+    results = {}
+    for name, columnar in [('rows', False), ('columns', True)]:
+        disassemble = lambda: [disasm.disassemble(path, columnar) for path in paths]
+        results[name + '_seconds'] = _best(repeat, disassemble)
+        results[name + '_bytes'] = _traced(disassemble)[0]
+    return results
+
+# Returns the peak number of bytes allocated by function()
+def _peak(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# A file that throws away what's written to it
+class _Discard:
+    def write(self, text):
+        pass
+
+def _constants(paths, repeat):
+    magic = corpus.MAGICS['2.7']
+    longs = corpus.generate('huge_longs', magic, corpus.SIZES['huge_longs'])
+    constants = corpus.generate('huge_constants', magic, 200000)
+    return {
+        'longs_seconds': _best(repeat, lambda: disasm.disassemble_bytes(longs, lazy=True)),
+        'constants_seconds': _best(repeat, lambda: disasm.disassemble_bytes(constants, lazy=True)),
+    }
+
+def _export(paths, repeat):
+    rows = [disasm.disassemble(path) for path in paths]
+    columns = [disasm.disassemble(path, columnar=True) for path in paths]
+    largest = max(range(len(paths)), key=lambda i: os.path.getsize(paths[i]))
+    return {
+        'repr_seconds': _best(repeat, lambda: [repr(module) for module in rows]),
+        'rows_seconds': _best(repeat, lambda: [export.write_ndjson(module, _Discard()) for module in rows]),
+        'columns_seconds': _best(repeat, lambda: [export.write_ndjson(module, _Discard()) for module in columns]),
+        'largest_file': paths[largest],
+        'largest_repr_peak_bytes': _peak(lambda: repr(rows[largest])),
+        'largest_export_peak_bytes': _peak(lambda: export.write_ndjson(columns[largest], _Discard())),
+    }
+
+# Returns the mean number of seconds of a call to function(value) for every
+# value in values
+def _mean(function, values):
+    start = time.time()
+    for value in values:
+        function(value)
+    return (time.time() - start) / max(len(values), 1)
+
+# Returns up to count (qualname, code object) pairs from the files at paths
+def _code_objects(paths, count):
+    result = []
+    for path in paths:
+        for qualname, code in disasm.walk(disasm.disassemble(path).body):
+            result.append((qualname, code))
+            if len(result) == count:
+                return result
+    return result
+
+def _index(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-index-')
+    try:
+        database = os.path.join(directory, 'index.db')
+        start = time.time()
+        with index.Index(database) as idx:
+            idx.update(paths)
+        results = {'build_seconds': time.time() - start}
+        with index.Index(database) as idx:
+            results['unchanged_seconds'] = _best(repeat, lambda: idx.update(paths))
+            codes = _code_objects(paths, 100)
+            names = sorted(set(name for qualname, code in codes for name in code.co_names or ()))[:100]
+            sequences = [[op.opcode_names[o.opcode] for o in code.opcodes[:4]]
+                         for qualname, code in codes if len(code.opcodes) >= 4]
+            results['name_query_seconds'] = _mean(idx.find_name, names)
+            results['sequence_query_seconds'] = _mean(idx.find_sequence, sequences)
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+# The whole module is only decompiled once since it takes several seconds
+def _select(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-select-')
+    try:
+        path = os.path.join(directory, 'many_functions.pyc')
+        with open(path, 'wb') as f:
+            f.write(corpus.generate('many_functions', corpus.MAGICS['2.7'], 4000))
+        return {
+            'eager_seconds': _best(repeat, lambda: [disasm.disassemble(p) for p in paths]),
+            'lazy_seconds': _best(repeat, lambda: [disasm.disassemble(p, lazy=True) for p in paths]),
+            'whole_seconds': _best(1, lambda: decomp.decompile(path)),
+            'selected_seconds': _best(repeat, lambda: decomp.decompile(path, select='f2000')),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+def _similarity(paths, repeat):
+    lsh = similarity.LSHIndex(threshold=0.9)
+    start = time.time()
+    for path in paths:
+        lsh.add_file(path)
+    results = {'add_seconds': time.time() - start, 'signatures': len(lsh)}
+    start = time.time()
+    results['clusters'] = len(lsh.clusters())
+    results['clusters_seconds'] = time.time() - start
+    results['query_seconds'] = _mean(lsh.query, list(lsh.signatures.values())[:1000])
+    return results
+
+def _store(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-store-')
+    try:
+        stored = []
+        for i, path in enumerate(paths):
+            stored.append(os.path.join(directory, '%d.unwind' % i))
+            store.save(disasm.disassemble(path, columnar=True), stored[-1])
+
+        def last_code(path):
+            with store.Reader(path, columnar=True) as reader:
+                reader.code(len(reader.qualnames()) - 1)
+
+        return {
+            'pyc_bytes': sum(os.path.getsize(path) for path in paths),
+            'store_bytes': sum(os.path.getsize(path) for path in stored),
+            'disassemble_seconds': _best(repeat, lambda: [disasm.disassemble(path, columnar=True) for path in paths]),
+            'load_seconds': _best(repeat, lambda: [store.load(path, columnar=True) for path in stored]),
+            'rows_disassemble_seconds': _best(repeat, lambda: [disasm.disassemble(path) for path in paths]),
+            'rows_load_seconds': _best(repeat, lambda: [store.load(path) for path in stored]),
+            'one_code_seconds': _best(repeat, lambda: [last_code(path) for path in stored]),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+# Only the headers are read, so the files of the tree just hold the start of
+# the files being measured
+def _triage(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-triage-')
+    try:
+        heads = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                heads.append(f.read(64))
+        for i in range(100):
+            subdirectory = os.path.join(directory, 'd%d' % i)
+            os.mkdir(subdirectory)
+            for j in range(100):
+                with open(os.path.join(subdirectory, 'f%d.pyc' % j), 'wb') as f:
+                    f.write(heads[(i * 100 + j) % len(heads)])
+        seconds = _best(repeat, lambda: list(triage.scan(directory)))
+        return {'files': 10000, 'seconds': seconds, 'microseconds_per_file': seconds / 10000 * 1e6}
+    finally:
+        shutil.rmtree(directory)
+
+# Compile up to count modules of the standard library of the running
+# interpreter into directory and return the paths of the *.pyc files
+def _host_files(directory, count):
+    paths = []
+    stdlib = os.path.dirname(os.__file__)
+    for name in sorted(os.listdir(stdlib)):
+        if name.endswith('.py') and len(paths) < count:
+            path = os.path.join(directory, name + 'c')
+            try:
+                py_compile.compile(os.path.join(stdlib, name), cfile=path, doraise=True)
+            except (py_compile.PyCompileError, OSError, UnicodeDecodeError):
+                continue
+            paths.append(path)
+    return paths
+
+def _magic(paths, repeat):
+    magics = [disasm.disassemble(path, lazy=True).magic for path in paths] * 100
+    return {'lookup_seconds': min(_mean(op.python_version_from_magic, magics) for i in range(repeat))}
+
+def _memory(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-memory-')
+    try:
+        host = _host_files(directory, 200)
+        def loads():
+            result = []
+            for path in host:
+                with open(path, 'rb') as f:
+                    result.append(marshal.loads(f.read()[16:]))
+            return result
+        return {
+            'files': len(host),
+            'rows_bytes': _traced(lambda: [disasm.disassemble(path) for path in host])[0],
+            'columns_bytes': _traced(lambda: [disasm.disassemble(path, columnar=True) for path in host])[0],
+            'marshal_bytes': _traced(loads)[0],
+        }
+    finally:
+        shutil.rmtree(directory)
+
+# Decodes wordcode one opcode at a time, the way the disassembler did before
+# it decoded whole columns
+def _decode_per_opcode(decode_ids, code):
+    offsets, sizes, ids, arguments = [], [], [], []
+    extended = 0
+    start = None
+    for i in range(0, len(code), 2):
+        opcode = decode_ids[code[i]]
+        argument = code[i + 1] | extended
+        if start is None:
+            start = i
+        if opcode == op.EXTENDED_ARG:
+            extended = argument << 8
+            continue
+        offsets.append(start)
+        sizes.append(i + 2 - start)
+        ids.append(opcode)
+        arguments.append(argument)
+        extended = 0
+        start = None
+    return offsets, sizes, ids, arguments
+
+def _wordcode(paths, repeat):
+    directory = tempfile.mkdtemp(prefix='unwind-features-wordcode-')
+    try:
+        codes = []
+        for path in _host_files(directory, 200):
+            for qualname, code in disasm.walk(disasm.disassemble(path, lazy=True).body):
+                codes.append((code.__dict__['_decoder'], code))
+        for decoder, code in codes:
+            expected = decoder.decode_wordcode(code)
+            result = _decode_per_opcode(decoder.decode_ids, bytes(code.co_code))
+            assert list(expected[0]) == result[0] and list(expected[2]) == result[2]
+        return {
+            'code_objects': len(codes),
+            'opcodes': sum(len(code.co_code) // 2 for decoder, code in codes),
+            'bulk_seconds': _best(repeat, lambda: [d.decode_wordcode(code) for d, code in codes]),
+            'per_opcode_seconds': _best(repeat, lambda: [_decode_per_opcode(d.decode_ids, bytes(code.co_code))
+                                                         for d, code in codes]),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+FEATURES = {
+    'aio': _aio,
+    'archive': _archive,
+    'codegen': _codegen,
+    'columnar': _columnar,
+    'constants': _constants,
+    'export': _export,
+    'index': _index,
+    'magic': _magic,
+    'memory': _memory,
+    'select': _select,
+    'similarity': _similarity,
+    'store': _store,
+    'triage': _triage,
+    'wordcode': _wordcode,
+}
+
+# Returns the paths of the *.pyc files under root that can be disassembled,
+# in a stable order
+def _readable(root):
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.endswith(('.pyc', '.pyo')):
+                path = os.path.join(directory, name)
+                try:
+                    disasm.disassemble(path)
+                except disasm.DisassemblerException:
+                    continue
+                paths.append(path)
+    return paths
+
+def run(paths, features, repeat, log=None):
+    results = {}
+    for feature in features:
+        results[feature] = FEATURES[feature](paths, repeat)
+        if log:
+            log.write('%s\n' % feature)
+            for key, value in sorted(results[feature].items()):
+                log.write('    %-26s %s\n' % (key, '%.6g' % value if isinstance(value, float) else value))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure individual features of unwind')
+    parser.add_argument('--root', help='directory of *.pyc files to use instead of the synthetic corpus')
+    parser.add_argument('--feature', action='append', choices=sorted(FEATURES), help='only measure this feature (repeatable)')
+    parser.add_argument('--scale', type=float, default=0.25, help='multiply the size of every synthetic shape by this')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per measurement, the minimum is reported')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    directory = None
+    try:
+        root = args.root
+        if root is None:
+            root = directory = tempfile.mkdtemp(prefix='unwind-features-')
+            corpus.write_corpus(directory, scale=args.scale)
+        paths = _readable(root)
+        results = run(paths, args.feature or sorted(FEATURES), args.repeat, sys.stderr)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    data = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'root': args.root,
+            'scale': None if args.root else args.scale,
+            'files': len(paths),
+            'repeat': args.repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Measures how long it takes a fresh interpreter to get to the entry points of
+unwind, and how many of unwind's modules that loads.
+
+    python -m benchmarks.imports [--repeat 10] [--output results.json]
+
+Every entry point is timed in its own subprocess so nothing is cached by an
+earlier import, and only the statement is timed, not interpreter startup.
+Results are written as JSON:
+
+    {
+        "meta": {"python": ..., "repeat": 10, ...},
+        "results": {
+            "package": {"seconds": 0.001, "modules": 1},
+            "disassemble": {"seconds": 0.1, "modules": 4},
+            "decompile": {"seconds": 0.12, "modules": 11}
+        }
+    }
+
+"package" only imports unwind itself, submodules are loaded the first time
+they're used.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+# The code run by every subprocess. It prints the seconds taken by the
+# statement and the number of unwind modules that are loaded afterwards.
+_TEMPLATE = '''
+import sys, time
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+print(seconds, sum(1 for name in sys.modules if name == 'unwind' or name.startswith('unwind.')))
+'''
+
+ENTRY_POINTS = {
+    'package': 'import unwind',
+    'disassemble': 'import unwind; unwind.disassemble',
+    'decompile': 'import unwind; unwind.decompile',
+}
+
+def _measure(statement):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output([sys.executable, '-c', _TEMPLATE % statement], env=env)
+    seconds, modules = output.split()
+    return float(seconds), int(modules)
+
+def run(repeat, log=None):
+    results = {}
+    for name in sorted(ENTRY_POINTS):
+        best = None
+        for i in range(repeat):
+            seconds, modules = _measure(ENTRY_POINTS[name])
+            best = seconds if best is None else min(best, seconds)
+        results[name] = {'seconds': best, 'modules': modules}
+        if log:
+            log.write('%-12s %8.1fms %4d modules\n' % (name, best * 1000, modules))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time importing the entry points of unwind')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--repeat', type=int, default=10, help='number of subprocesses per entry point, the minimum is reported')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, sys.stderr)
+    data = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
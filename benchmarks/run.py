@@ -0,0 +1,156 @@
+'''
+Benchmark runner. Generates the synthetic corpus from benchmarks.corpus and
+measures disassembly, every decompiler pass and code generation separately.
+
+    python -m benchmarks.run [--output results.json] [--scale 1.0]
+                             [--repeat 3] [--shape NAME] [--magic N]
+
+Results are written as JSON with this layout, one entry per (shape, magic):
+
+    {
+        "meta": {"commit": ..., "python": ..., "platform": ..., "time": ...},
+        "results": [{
+            "case": "straight_line-168686339",
+            "shape": "straight_line",
+            "magic": 168686339,
+            "python_version": "Python 2.7a2+",
+            "bytes": 112345,
+            "opcodes": 20002,
+            "error": null,
+            "seconds": {
+                "disassemble": 0.08,
+                "pass:CodeObjectsToNodes": 0.01,
+                ...
+                "codegen": 0.02,
+                "total": 1.23
+            }
+        }, ...]
+    }
+
+Every time is the minimum over the repeats. Use benchmarks.compare to
+compare two result files.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import unwind.op as op
+import unwind.disasm as disasm
+import unwind.passes as passes
+import unwind.codegen as codegen
+from unwind.passmanager import PassManager, PassReport
+from benchmarks import corpus
+
+def _commit():
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root,
+                                       stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(path):
+    '''
+    Disassemble and decompile the file at path once, returning a map of stage
+    name to seconds and the number of opcodes in the top-level code object.
+    Raises if decompilation fails.
+    '''
+    seconds = {}
+    start = time.time()
+    module = disasm.disassemble(path)
+    seconds['disassemble'] = time.time() - start
+    opcodes = len(module.body.opcodes)
+
+    report = PassReport()
+    context = passes.Context(report, magic=module.magic)
+    node = PassManager(passes.FRONTEND_PIPELINE, report).run(module, context)
+    node = context.decompile(node)
+    for name, s in report.seconds_by_pass().items():
+        seconds['pass:' + name] = s
+
+    start = time.time()
+    node.accept(codegen.SourceCodeGenerator())
+    seconds['codegen'] = time.time() - start
+
+    seconds['total'] = sum(seconds.values())
+    return seconds, opcodes
+
+def run(files, repeat, log=None):
+    results = []
+    for shape, magic, path in files:
+        result = {
+            'case': '%s-%d' % (shape, magic),
+            'shape': shape,
+            'magic': magic,
+            'python_version': 'Python ' + op.python_version_from_magic(magic),
+            'bytes': os.path.getsize(path),
+            'opcodes': None,
+            'error': None,
+            'seconds': {},
+        }
+        for i in range(repeat):
+            try:
+                seconds, result['opcodes'] = measure(path)
+            except Exception as e:
+                # The decompiler doesn't handle every construct yet, record the
+                # failure and still report how long disassembly took
+                result['error'] = '%s: %s' % (e.__class__.__name__, e)
+                start = time.time()
+                module = disasm.disassemble(path)
+                seconds = {'disassemble': time.time() - start}
+                result['opcodes'] = len(module.body.opcodes)
+            for name, s in seconds.items():
+                result['seconds'][name] = min(s, result['seconds'].get(name, s))
+        if log:
+            log.write('%-40s %8.3fs%s\n' % (result['case'], result['seconds'].get('total', result['seconds']['disassemble']),
+                                            '  (%s)' % result['error'] if result['error'] else ''))
+        results.append(result)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark unwind on a synthetic corpus')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the size of every shape by this')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per case, the minimum is reported')
+    parser.add_argument('--shape', action='append', choices=sorted(corpus.SHAPES), help='only run this shape (repeatable)')
+    parser.add_argument('--magic', action='append', type=int, help='only use this magic number (repeatable)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the corpus generator')
+    parser.add_argument('--keep', help='generate the corpus in this directory and keep it')
+    args = parser.parse_args(argv)
+
+    directory = args.keep or tempfile.mkdtemp(prefix='unwind-bench-')
+    try:
+        files = corpus.write_corpus(directory, args.magic, args.shape, args.scale, args.seed)
+        results = run(files, args.repeat, sys.stderr)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory)
+
+    data = {
+        'meta': {
+            'commit': _commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'scale': args.scale,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''
+Compares the throughput of disassembling the synthetic corpus from
+benchmarks.corpus in a thread pool (disasm.disassemble_batch()) and in a
+process pool, with a single thread as the baseline.
+
+    python -m benchmarks.threads [--workers 4] [--copies 8] [--scale 0.25]
+                                 [--repeat 3] [--output results.json]
+
+Every file of the corpus is disassembled copies times per run so there's
+enough work to spread over the workers. Results are written as JSON:
+
+    {
+        "meta": {"python": ..., "gil": true, "cpus": 8, "workers": 4, ...},
+        "results": {
+            "serial": {"seconds": 2.1, "files_per_second": 91.4},
+            "threads": {"seconds": 2.3, "files_per_second": 83.5},
+            "processes": {"seconds": 0.7, "files_per_second": 274.3}
+        }
+    }
+
+Threads only run bytecode in parallel on a free-threaded build of Python
+("gil": false). With the GIL they show the cost of sharing one interpreter,
+and processes pay for pickling every module back to the parent instead.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import concurrent.futures
+
+import unwind.disasm as disasm
+from benchmarks import corpus
+
+# Disassembled in the worker processes. The module is sent back like the
+# thread pool hands it to its caller.
+def _disassemble(path):
+    try:
+        return path, disasm.disassemble(path, columnar=True)
+    except disasm.DisassemblerException as e:
+        return path, e
+
+def _serial(paths, workers):
+    for path in paths:
+        _disassemble(path)
+
+def _threads(paths, workers):
+    for path, module in disasm.disassemble_batch(paths, columnar=True, workers=workers):
+        pass
+
+def _processes(paths, workers):
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for path, module in pool.map(_disassemble, paths, chunksize=max(1, len(paths) // (workers * 8))):
+            pass
+
+MODES = {
+    'serial': _serial,
+    'threads': _threads,
+    'processes': _processes,
+}
+
+def _gil_enabled():
+    is_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_enabled is None else is_enabled()
+
+def run(paths, workers, repeat, log=None):
+    results = {}
+    for mode in sorted(MODES):
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            MODES[mode](paths, workers)
+            seconds = time.time() - start
+            best = seconds if best is None else min(best, seconds)
+        results[mode] = {'seconds': best, 'files_per_second': len(paths) / best}
+        if log:
+            log.write('%-10s %8.3fs %10.1f files/s\n' % (mode, best, len(paths) / best))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare thread and process pools for disassembly')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of threads or processes')
+    parser.add_argument('--copies', type=int, default=8, help='number of times every file is disassembled per run')
+    parser.add_argument('--scale', type=float, default=0.25, help='multiply the size of every shape by this')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per mode, the minimum is reported')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='unwind-threads-')
+    try:
+        files = corpus.write_corpus(directory, scale=args.scale)
+        paths = [path for shape, magic, path in files] * args.copies
+        results = run(paths, args.workers, args.repeat, sys.stderr)
+    finally:
+        shutil.rmtree(directory)
+
+    data = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'gil': _gil_enabled(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'files': len(paths),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
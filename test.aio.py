@@ -0,0 +1,96 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import py_compile
+
+import unwind.disasm as disasm
+import unwind.aio
+
+_source = '''
+import os
+
+def helper(a, b):
+    return os.path.join(a, b)
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def _collect(sources, **kwargs):
+    return [pair async for pair in unwind.aio.disassemble_many(sources, **kwargs)]
+
+# Paths, bytes and awaitables producing either can be mixed, and sources that
+# can't be fetched or disassembled give their exception
+def test_sources(directory):
+    path = _compile(directory, 'a', _source)
+    data = _read(path)
+
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    async def fail():
+        raise IOError('not found')
+
+    sources = [path, data, fetch(data), fetch(path), b'not a pyc file', fail()]
+    results = dict(asyncio.run(_collect(sources, columnar=True)))
+    assert sorted(results) == list(range(6))
+    names = disasm.disassemble(path).body.co_names
+    for i in range(4):
+        assert results[i].body.co_names == names
+        assert isinstance(results[i].body.opcodes, disasm.OpcodeColumns)
+    assert isinstance(results[4], disasm.DisassemblerException), results[4]
+    assert isinstance(results[5], IOError) and str(results[5]) == 'not found'
+
+# A slot is only freed when the consumer takes a result, so a slow consumer
+# stops more sources from being fetched
+def test_limit(directory):
+    data = _read(_compile(directory, 'a', _source))
+    started = []
+
+    async def fetch(i):
+        started.append(i)
+        return data
+
+    async def consume():
+        seen = []
+        async for index, module in unwind.aio.disassemble_many((fetch(i) for i in range(6)), limit=2):
+            await asyncio.sleep(0.05)
+            seen.append(len(started))
+        return seen
+
+    assert asyncio.run(consume()) == [3, 4, 5, 6, 6, 6]
+
+async def _failing_sources(data):
+    yield data
+    raise ValueError('listing failed')
+
+def test_failing_iterable(directory):
+    data = _read(_compile(directory, 'a', _source))
+    try:
+        asyncio.run(_collect(_failing_sources(data)))
+        assert False
+    except ValueError as e:
+        assert str(e) == 'listing failed'
+
+def test_empty(directory):
+    assert asyncio.run(_collect([])) == []
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-aio-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,113 @@
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import py_compile
+
+import unwind
+import unwind.disasm as disasm
+
+_source = '''
+def helper(a, b):
+    return a + b
+'''
+
+def _pyc(directory):
+    path = os.path.join(directory, 'a.py')
+    with open(path, 'w') as f:
+        f.write(_source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    with open(path + 'c', 'rb') as f:
+        return f.read()
+
+def _zip(members, compression=zipfile.ZIP_STORED):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', compression) as z:
+        for name, contents in members:
+            z.writestr(name, contents)
+    return data.getvalue()
+
+def _tar(members, mode='w:gz'):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        for name, contents in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+    return data.getvalue()
+
+def _results(archive):
+    return [(name, type(module).__name__) for name, module in unwind.disassemble_archive(archive)]
+
+def test_members(directory):
+    pyc = _pyc(directory)
+    members = [('pkg/a.pyc', pyc), ('pkg/a.py', _source.encode()), ('pkg/bad.pyc', b'\0' * 32)]
+    expected = [('pkg/a.pyc', 'Module'), ('pkg/bad.pyc', 'DisassemblerException')]
+    for data in [_zip(members), _zip(members, zipfile.ZIP_DEFLATED), _tar(members), _tar(members, 'w')]:
+        assert _results(io.BytesIO(data)) == expected
+        path = os.path.join(directory, 'archive')
+        with open(path, 'wb') as f:
+            f.write(data)
+        assert _results(path) == expected
+    module = dict(unwind.disassemble_archive(io.BytesIO(_zip(members))))['pkg/a.pyc']
+    assert [name for name, code in disasm.walk(module.body)] == ['', 'helper']
+
+def test_not_an_archive(directory):
+    for data in [b'', b'hello\n', _pyc(directory)]:
+        try:
+            _results(io.BytesIO(data))
+            assert False
+        except disasm.DisassemblerException as e:
+            assert str(e) == 'Not a zip or tar archive', e
+
+# Inputs shorter than a magic number are rejected like any other bad header
+def test_short(directory):
+    path = os.path.join(directory, 'short.pyc')
+    for data in [b'', b'\x03', b'\x03\xf3\r']:
+        with open(path, 'wb') as f:
+            f.write(data)
+        for fn, source in [(unwind.disassemble_bytes, data), (unwind.disassemble, path),
+                           (disasm.disassemble_file, io.BytesIO(data))]:
+            try:
+                fn(source)
+                assert False
+            except disasm.DisassemblerException as e:
+                assert str(e) == 'File is too short for a *.pyc header', e
+    assert _results(io.BytesIO(_zip([('a.pyc', b''), ('b.pyc', b'\x03')]))) == [
+        ('a.pyc', 'DisassemblerException'), ('b.pyc', 'DisassemblerException')]
+
+# A compressed tar archive can't be read past the point where it's cut short
+def test_truncated_tar(directory):
+    pyc = _pyc(directory)
+    data = _tar([('a.pyc', pyc), ('b.pyc', os.urandom(20000))])
+    results = []
+    try:
+        for name, module in unwind.disassemble_archive(io.BytesIO(data[:len(data) // 2])):
+            results.append(name)
+        assert False
+    except disasm.DisassemblerException as e:
+        assert str(e).startswith('Cannot read the rest of the archive: '), e
+    assert results == ['a.pyc'], results
+
+# A zip member that fails its checksum doesn't stop the others
+def test_corrupt_zip_member(directory):
+    pyc = _pyc(directory)
+    data = bytearray(_zip([('a.pyc', pyc), ('b.pyc', pyc)]))
+    start = 30 + len('a.pyc')
+    data[start + 20] ^= 0xFF
+    results = list(unwind.disassemble_archive(io.BytesIO(bytes(data))))
+    assert [name for name, module in results] == ['a.pyc', 'b.pyc']
+    assert isinstance(results[0][1], disasm.DisassemblerException) and 'BadZipFile' in str(results[0][1])
+    assert isinstance(results[1][1], disasm.Module)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-archive-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,94 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import py_compile
+
+import unwind
+import unwind.disasm as disasm
+
+_source = '''
+import os
+
+class Parser%d:
+    def parse(self, text):
+        return [os.path.join(a, %r) for a in text.split()]
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def _files(directory, count):
+    return [_compile(directory, 'm%d' % i, _source % (i, 'x' * i)) for i in range(count)]
+
+def test_batch(directory):
+    paths = _files(directory, 12)
+    broken = os.path.join(directory, 'broken.pyc')
+    with open(broken, 'wb') as f:
+        f.write(b'\x03\xf3')
+    missing = os.path.join(directory, 'missing.pyc')
+    paths[3:3] = [broken, missing]
+
+    results = list(unwind.disassemble_batch(paths, workers=3))
+    assert [path for path, module in results] == paths
+    for path, module in results:
+        if path in (broken, missing):
+            assert isinstance(module, disasm.DisassemblerException), module
+        else:
+            assert repr(module) == repr(disasm.disassemble(path))
+    assert 'FileNotFoundError' in str(dict(results)[missing])
+
+    columns = dict(disasm.disassemble_batch(paths[:3], columnar=True))
+    assert all(isinstance(module.body.opcodes, disasm.OpcodeColumns) for module in columns.values())
+
+# Only a few files per thread are disassembled ahead of the consumer
+def test_bounded(directory):
+    paths = _files(directory, 12)
+    pulled = []
+    def source():
+        for path in paths:
+            pulled.append(path)
+            yield path
+    batch = disasm.disassemble_batch(source(), workers=2)
+    next(batch)
+    assert len(pulled) == 4
+    batch.close()
+    assert len(pulled) == 4
+
+# repr() of modules built in several threads at once is the same as when it's
+# built in one thread
+def test_repr_threads(directory):
+    paths = _files(directory, 4)
+    modules = [disasm.disassemble(path) for path in paths]
+    expected = [repr(module) for module in modules]
+    results = {}
+    def run(i):
+        results[i] = [repr(module) for module in modules[i % 2:] + modules[:i % 2]]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    for i in range(8):
+        assert results[i] == expected[i % 2:] + expected[:i % 2]
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-batch-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
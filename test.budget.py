@@ -0,0 +1,112 @@
+import os
+import time
+import shutil
+import tempfile
+import py_compile
+
+import unwind
+import unwind.disasm as disasm
+from unwind.budget import Budget, BudgetExceeded
+from unwind.cache import DecompileCache
+
+_source = '''
+def small(a):
+    return a + 1
+
+def big(a):
+    def inner(b):
+        return b * 2 + b * 3 + b * 4 + b * 5
+    x = a + 1
+    y = x * 2
+    z = y - x
+    return inner(z) + x + y + z
+'''
+
+_nested = '''
+def outer(a):
+    def inner(b):
+        return b * 2 + b * 3 + b * 4 + b * 5 + b * 6 + b * 7 + b * 8
+    return inner
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+# The number of opcodes of every code object in the file at path
+def _sizes(path):
+    module = disasm.disassemble(path)
+    return dict((qualname, len(code.opcodes)) for qualname, code in disasm.walk(module.body))
+
+# Only the code object that exceeded the limit falls back to __asm__() calls,
+# and inner isn't reported separately because it's emitted inside big
+def test_max_nodes(directory):
+    path = _compile(directory, 'a', _source)
+    sizes = _sizes(path)
+    budget = Budget(max_nodes=max(sizes[''], sizes['small']))
+    assert sizes['big'] > budget.max_nodes and sizes['big.inner'] > budget.max_nodes, sizes
+
+    source = unwind.decompile(path, budget=budget)
+    assert [(e.limit, e.value, e.code.co_name) for e in budget.exceeded] == [('max_nodes', sizes['big'], 'big')]
+    assert '# unwind: max_nodes exceeded by big (%d), emitted as bytecode' % sizes['big'] in source, source
+    assert source.count('emitted as bytecode') == 1
+
+    # Exceeded limits are collected over every decompile using the budget
+    unwind.decompile(path, budget=budget)
+    assert len(budget.exceeded) == 2
+
+def test_nested(directory):
+    path = _compile(directory, 'a', _nested)
+    sizes = _sizes(path)
+    budget = Budget(max_nodes=sizes['outer'])
+    source = unwind.decompile(path, budget=budget)
+    assert [e.code.co_name for e in budget.exceeded] == ['inner'], sizes
+    assert 'max_nodes exceeded by inner' in source and 'exceeded by outer' not in source
+
+# Output that fell back to bytecode isn't cached, output within the budget is
+def test_cache(directory):
+    path = _compile(directory, 'a', _source)
+    cache = DecompileCache()
+    limited = unwind.decompile(path, cache=cache, budget=Budget(max_nodes=1))
+    assert len(cache) == 0
+    source = unwind.decompile(path, cache=cache, budget=Budget(max_nodes=1000))
+    assert len(cache) == 1 and source != limited
+    assert unwind.decompile(path, cache=cache) == source and cache.hits == 1
+
+def test_meter(directory):
+    code = disasm.disassemble(_compile(directory, 'a', _source)).body
+    meter = Budget(max_iterations=3, max_seconds=0.005).meter()
+    meter.check(100)
+    with meter.measure(code):
+        meter.check(3)
+        try:
+            meter.check(4)
+            assert False
+        except BudgetExceeded as e:
+            assert (e.limit, e.value, e.code) == ('max_iterations', 4, code)
+            assert str(e) == 'max_iterations exceeded by <module> (4)'
+        time.sleep(0.01)
+        try:
+            meter.check()
+            assert False
+        except BudgetExceeded as e:
+            assert e.limit == 'max_seconds' and e.value >= 0.01
+
+    try:
+        with Budget(max_nodes=10).meter().measure(code, 11):
+            assert False
+    except BudgetExceeded as e:
+        assert (e.limit, e.value) == ('max_nodes', 11)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-budget-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,108 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import py_compile
+
+import unwind
+from unwind.cache import DecompileCache
+from unwind.passmanager import PassReport
+
+_helper = '''
+def helper(a, b):
+    c = a + b
+    return c * 2
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def test_lru(directory):
+    cache = DecompileCache(maxsize=2)
+    cache.put('a', 'x = 1')
+    cache.put('b', 'x = 2')
+    assert cache.get('a') == 'x = 1'
+    cache.put('c', 'x = 3')
+    assert cache.get('b') is None and cache.get('a') == 'x = 1' and cache.get('c') == 'x = 3'
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (3, 1)
+    cache.clear()
+    assert len(cache) == 0 and cache.get('a') is None
+
+# Lookups from many threads at once are all counted
+def test_counts_threads(directory):
+    cache = DecompileCache()
+    cache.put('a', 'x = 1')
+    def run():
+        for i in range(2000):
+            cache.get('a')
+            cache.get('b')
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert (cache.hits, cache.misses) == (16000, 16000), (cache.hits, cache.misses)
+
+def test_directory(directory):
+    folder = os.path.join(directory, 'cache')
+    DecompileCache(directory=folder).put('0123abcd', 'x = €')
+    cache = DecompileCache(directory=folder)
+    assert cache.get('0123abcd') == 'x = €' and len(cache) == 1
+    assert not [name for root, dirs, files in os.walk(folder) for name in files if name.endswith('.tmp')]
+
+# Nothing is cached unless a cache is passed
+def test_no_default_cache(directory):
+    path = _compile(directory, 'a', _helper)
+    for i in range(2):
+        report = PassReport()
+        unwind.decompile(path, report=report)
+        assert 'DecompileCache' not in [r.name for r in report.records]
+
+def test_hit_is_reported(directory):
+    a = _compile(directory, 'a', _helper)
+    b = _compile(directory, 'b', _helper + '\n')
+    cache = DecompileCache()
+    report = PassReport()
+    source = unwind.decompile(a, cache=cache, report=report)
+    assert report.records and 'DecompileCache' not in [r.name for r in report.records]
+
+    report = PassReport()
+    assert unwind.decompile(b, cache=cache, report=report) == source
+    assert [(r.name, r.skipped) for r in report.records] == [('DecompileCache', True)]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+# The same function in two different modules is only decompiled once
+def test_selected_code_objects_are_shared(directory):
+    a = _compile(directory, 'a', _helper + '\nx = helper(1, 2)\n')
+    b = _compile(directory, 'b', 'import os\n' + _helper)
+    cache = DecompileCache()
+    first = unwind.decompile(a, cache=cache, select='helper')
+    second = unwind.decompile(b, cache=cache, select='helper')
+    assert first == second and first.startswith('# helper\n')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The modules themselves differ
+    unwind.decompile(a, cache=cache)
+    unwind.decompile(b, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-cache-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
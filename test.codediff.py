@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import py_compile
+
+import unwind
+import unwind.disasm as disasm
+import unwind.codediff as codediff
+
+_before = '''
+def total(items):
+    result = 0
+    for item in items:
+        if item > 0:
+            result += item
+    return result
+
+def scale(items, factor):
+    return tuple(items) * factor
+'''
+
+# One statement added inside the loop and scale() renamed
+_after = '''
+def total(items):
+    result = 0
+    for item in items:
+        print(item)
+        if item > 0:
+            result += item
+    return result
+
+def multiply(items, factor):
+    return tuple(items) * factor
+'''
+
+# Compile source with the running interpreter and return the path of the *.pyc
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def test_identical(directory):
+    a = _compile(directory, 'a', _before)
+    b = _compile(directory, 'b', _before)
+    d = unwind.diff(a, b)
+    assert not d.changed and not d.added and not d.removed and not d.renamed
+    assert d.unchanged == 3, d.unchanged
+
+def test_statement_in_loop(directory):
+    a = _compile(directory, 'a', _before)
+    b = _compile(directory, 'b', _after)
+    d = unwind.diff(a, b)
+
+    # The module changed too since it stores the function under a new name
+    assert d.changed_names() == ['', 'total'], d.changed_names()
+    assert d.renamed == [('scale', 'multiply')], d.renamed
+
+    # Only the call is new, the jumps around it keep their normalized targets
+    code = [c for c in d.changed if c.qualname == 'total'][0]
+    changes = [(tag, old, new) for tag, old, new in code.opcodes if tag != 'equal']
+    assert [tag for tag, old, new in changes] == ['insert'], changes
+    assert all('JUMP' not in i and 'FOR_ITER' not in i for i in changes[0][2]), changes
+
+# Each file is read once, the disassembly comes from the same bytes that were
+# compared
+def test_reads_once(directory):
+    a = _compile(directory, 'a', _before)
+    b = _compile(directory, 'b', _after)
+    disassemble = disasm.disassemble
+    def fail(*args, **kwargs):
+        raise AssertionError('read again from disk')
+    disasm.disassemble = fail
+    try:
+        assert unwind.diff(a, b).renamed == [('scale', 'multiply')]
+    finally:
+        disasm.disassemble = disassemble
+
+def test_normalize_drops_cache(directory):
+    module = disasm.disassemble(_compile(directory, 'a', _after))
+    for qualname, code in disasm.walk(module.body):
+        instructions = codediff.normalize(code, module.magic)
+        assert not [i for i in instructions if i.split()[0] == 'CACHE'], instructions
+
+        # Every jump goes to a label
+        labels = set(i[:-1] for i in instructions if i.endswith(':'))
+        for instruction in instructions:
+            if 'JUMP' in instruction or instruction.startswith('FOR_ITER'):
+                assert instruction.split()[-1] in labels, (instruction, labels)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-codediff-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import py_compile
+import subprocess
+
+import unwind.op as op
+import unwind.disasm as disasm
+import unwind.export as export
+
+_source = '''
+def f(x):
+    def g():
+        return x
+    return x in {1, 2}, b'ab', 2 + 3j, 1e400, ..., (1, 'a', None, True, 1.5)
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def _ndjson(module):
+    f = io.StringIO()
+    export.write_ndjson(module, f)
+    return f.getvalue()
+
+def test_records(directory):
+    path = _compile(directory, 'a', _source)
+    module = disasm.disassemble(path)
+    records = list(export.records(module))
+    assert records[0] == {'type': 'module', 'schema': export.SCHEMA_VERSION, 'magic': module.magic,
+                          'timestamp': module.timestamp, 'python_version': module.python_version}
+    assert [(r['index'], r['parent'], r['qualname']) for r in records[1:]] == [(0, None, ''), (1, 0, 'f'), (2, 1, 'f.g')]
+
+    f = records[2]
+    assert {'code': 2} in f['co_consts'] and {'code': 1} in records[1]['co_consts']
+    for value in [{'frozenset': [1, 2]}, {'bytes': '6162'}, {'complex': [2.0, 3.0]}, {'float': 'inf'},
+                  {'constant': 'Ellipsis'}, [1, 'a', None, True, 1.5]]:
+        assert value in f['co_consts'], (value, f['co_consts'])
+
+    code = dict(disasm.walk(module.body))['f']
+    assert f['co_name'] == 'f' and f['co_code'] == code.co_code.hex()
+
+    # Opcodes have their normalized names and resolved arguments
+    assert [o[:3] for o in f['opcodes']] == [[o.offset, o.size, op.opcode_names[o.opcode]] for o in code.opcodes]
+    constants = [o[3] for o in f['opcodes'] if o[2] == 'LOAD_CONST']
+    assert {'code': 2} in constants and all(value in f['co_consts'] for value in constants), constants
+
+def test_ndjson_and_json(directory):
+    path = _compile(directory, 'a', _source)
+    module = disasm.disassemble(path)
+    records = list(export.records(module))
+    text = _ndjson(module)
+    assert text.endswith('\n') and [json.loads(line) for line in text.splitlines()] == records
+
+    f = io.StringIO()
+    export.write_json(module, f)
+    document = json.loads(f.getvalue())
+    assert document.pop('code_objects') == records[1:] and document == records[0]
+
+    # Columnar modules give the same output
+    assert _ndjson(disasm.disassemble(path, columnar=True)) == text
+
+def test_command(directory):
+    path = _compile(directory, 'a', _source)
+    output = subprocess.check_output([sys.executable, '-m', 'unwind', 'export', path])
+    assert output.decode('utf8') == _ndjson(disasm.disassemble(path, columnar=True))
+    output = subprocess.check_output([sys.executable, '-m', 'unwind', 'export', path, '--json'])
+    assert len(json.loads(output.decode('utf8'))['code_objects']) == 3
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-export-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
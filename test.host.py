@@ -0,0 +1,104 @@
+import os
+import dis
+import glob
+import shutil
+import struct
+import marshal
+import tempfile
+import py_compile
+
+import unwind
+import unwind.op as op
+import unwind.sourcemap
+import unwind.disasm as disasm
+
+# The files in tests/ compiled by the running interpreter, which is the only
+# wordcode version that can be disassembled
+def _compile_fixtures(directory):
+    paths = []
+    for source in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', '*.py'))):
+        path = os.path.join(directory, os.path.basename(source) + 'c')
+        py_compile.compile(source, cfile=path, doraise=True)
+        paths.append(path)
+    return paths
+
+# Iterate over the code objects of the real module, parents before children
+# like disasm.walk()
+def _walk(code):
+    yield code
+    for value in code.co_consts:
+        if hasattr(value, 'co_code'):
+            for child in _walk(value):
+                yield child
+
+def _load(path):
+    with open(path, 'rb') as f:
+        f.read(16)
+        return marshal.load(f)
+
+def test_jump_targets_match_dis(paths):
+    count = 0
+    for path in paths:
+        module = disasm.disassemble(path)
+        flags = op.flags_table(module.magic)
+        for (qualname, code), real in zip(disasm.walk(module.body), _walk(_load(path))):
+            expected = dict((i.offset, i.argval) for i in dis.get_instructions(real)
+                            if i.opcode in dis.hasjrel or i.opcode in dis.hasjabs)
+            targets = {}
+            for o in code.opcodes:
+                if flags[o.opcode] & op.IS_JUMP:
+                    targets[o.offset + o.size - 2] = op.jump_target(module.magic, o.opcode, o.offset, o.size, o.argument)
+            assert targets == expected, (path, qualname, targets, expected)
+            count += len(targets)
+    assert count > 0
+
+def test_line_table(paths):
+    count = 0
+    for path in paths:
+        module = disasm.disassemble(path)
+        for (qualname, code), real in zip(disasm.walk(module.body), _walk(_load(path))):
+            table = code.line_table()
+            for start, end, line in real.co_lines():
+                for offset in range(start, end, 2):
+                    if line is not None:
+                        assert table.line_for_offset(offset) == line, (path, qualname, offset, line)
+                        count += 1
+    assert count > 0
+
+def test_source_map(paths):
+    for path in paths:
+        source_map = unwind.sourcemap.SourceMap()
+        source = unwind.decompile(path, cache=None, source_map=source_map)
+        lines = set(source_map.lookup(n)[0] for n in range(1, source.count('\n') + 2) if source_map.lookup(n))
+        real = set(line for start, end, line in _load(path).co_lines() if line)
+        assert lines and lines <= real | set([0]), (path, lines - real)
+        assert len(lines) > 1, (path, lines)
+
+# Wordcode of another Python version is rejected with a clear error rather
+# than decoded with the wrong opcodes
+def test_other_wordcode(paths):
+    with open(paths[0], 'rb') as f:
+        data = bytearray(f.read())
+    version = struct.unpack('<H', data[:2])[0]
+    data[:2] = struct.pack('<H', 3439 if version != 3439 else 3495)
+    try:
+        disasm.disassemble_bytes(bytes(data))
+        assert False
+    except disasm.DisassemblerException as e:
+        assert 'only supported by the Python version that wrote it' in str(e), e
+
+def test_decompile(paths):
+    for path in paths:
+        source = unwind.decompile(path, cache=None)
+        assert source.strip(), path
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-host-')
+    try:
+        paths = _compile_fixtures(directory)
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(paths)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+# Run code in a fresh interpreter and return the names of the modules it
+# loaded that it asks for, plus whatever it adds to result
+def _run(code, modules=('unwind.disasm', 'unwind.decomp', 'unwind.passes', 'unwind.store',
+                        'concurrent.futures', 'tarfile', 'zipfile')):
+    script = 'import sys, json\nresult = {}\n%s\nresult["loaded"] = [m for m in %r if m in sys.modules]\nprint(json.dumps(result))\n'
+    root = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.check_output([sys.executable, '-c', script % (code, list(modules))], cwd=root)
+    return json.loads(output.decode('utf8'))
+
+def test_package(directory):
+    result = _run('import unwind\nresult["all"] = unwind.__all__\nresult["dir"] = dir(unwind)')
+    assert result['loaded'] == [], result
+    assert 'decompile' in result['all'] and 'store' not in result['all']
+    assert 'decompile' in result['dir'] and 'store' in result['dir']
+
+# Disassembling doesn't load the decompiler or the modules only needed for
+# archives and batches
+def test_disassemble(directory):
+    result = _run('import unwind\nunwind.disassemble_bytes\nunwind.disasm.walk')
+    assert result['loaded'] == ['unwind.disasm'], result
+
+    result = _run('from unwind import decompile\nresult["name"] = decompile.__module__')
+    assert result['name'] == 'unwind.decomp' and 'unwind.passes' in result['loaded'], result
+
+def test_submodules(directory):
+    result = _run('import unwind\nresult["same"] = unwind.store is __import__("unwind.store").store')
+    assert result['same'] and 'unwind.store' in result['loaded'], result
+
+    result = _run('import unwind\ntry:\n    unwind.missing\nexcept AttributeError as e:\n    result["error"] = str(e)')
+    assert result['error'] == "module 'unwind' has no attribute 'missing'", result
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-imports-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import py_compile
+from array import array
+
+import unwind.op as op
+import unwind.disasm as disasm
+import unwind.index
+
+_source = '''
+import os.path
+from pickle import loads
+
+def load(name):
+    with open(os.path.join('data', name), 'rb') as f:
+        return loads(f.read())
+
+class Store:
+    def get(self, key):
+        return self.items[key] * 3.5
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+# The names of the first opcodes of a code object that aren't CACHE
+def _opcode_names(path, qualname, count):
+    module = disasm.disassemble(path)
+    for name, code in disasm.walk(module.body):
+        if name == qualname:
+            names = [op.opcode_names[o.opcode] for o in code.opcodes]
+            return [n for n in names if n != 'CACHE'][:count]
+
+def test_find(directory):
+    path = _compile(directory, 'a', _source)
+    with unwind.index.Index(os.path.join(directory, 'find.db')) as index:
+        assert index.update([path]) == (1, 0, 0)
+        assert index.update([path]) == (0, 1, 0)
+        assert [(p, q, l) for p, q, l in index.find_name('os.path.join')] == [(path, 'load', 5)]
+        assert [q for p, q, l in index.find_name('pickle.loads')] == ['']
+        assert [q for p, q, l in index.find_import('os.path')] == ['']
+        assert [q for p, q, l in index.find_attribute('items')] == ['Store.get']
+        assert [q for p, q, l in index.find_constant(3.5)] == ['Store.get']
+        assert index.find_constant('3.5') == []
+        index.remove(path)
+        assert index.find_name('os.path.join') == []
+
+def test_failed(directory):
+    path = os.path.join(directory, 'broken.pyc')
+    with open(path, 'wb') as f:
+        f.write(b'not a pyc file')
+    with unwind.index.Index(os.path.join(directory, 'failed.db')) as index:
+        assert index.update([path]) == (0, 0, 1)
+        assert index.update([path]) == (0, 1, 0)
+
+# A file that can't be read is dropped from the index without losing the
+# other files of the update
+def test_unreadable(directory):
+    paths = [_compile(directory, name, _source) for name in ['a', 'gone']]
+    with unwind.index.Index(os.path.join(directory, 'unreadable.db')) as index:
+        assert index.update(paths) == (2, 0, 0)
+        os.remove(paths[1])
+        b = _compile(directory, 'b', _source)
+        assert index.update([paths[1], b, paths[0]]) == (1, 1, 1)
+        assert [p for p, q, l in index.find_name('os.path.join')] == sorted([paths[0], b])
+        assert index.db.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 2
+
+# Cell and free variables are found by name in every version, including 3.11
+# and later where LOAD_DEREF indexes the locals too
+def test_free_variables(directory):
+    path = _compile(directory, 'closure', '''
+def outer(mod, path):
+    def inner(a, b):
+        c = a + b
+        return mod.sep.join(path), c
+    return inner
+''')
+    with unwind.index.Index(os.path.join(directory, 'free.db')) as index:
+        assert index.update([path]) == (1, 0, 0)
+        assert [q for p, q, l in index.find_name('mod.sep.join')] == ['outer.inner']
+    inner = dict(disasm.walk(disasm.disassemble(path).body))['outer.inner']
+    names = disasm.deref_names(inner)
+    assert sorted(set(names) - set(inner.co_varnames)) == ['mod', 'path'], names
+
+def test_find_sequence(directory):
+    path = _compile(directory, 'a', _source)
+    names = _opcode_names(path, 'Store.get', 4)
+    with unwind.index.Index(os.path.join(directory, 'sequence.db')) as index:
+        index.update([path])
+        assert [q for p, q, l in index.find_sequence(names)] == ['Store.get'], names
+        ids = [op.opcode_ids[name] for name in names]
+        assert [q for p, q, l in index.find_sequence(ids)] == ['Store.get']
+        assert index.find_sequence(list(reversed(names))) == []
+
+# A database written by a version of unwind whose opcode ids were in a different
+# order still answers queries by name
+def test_stored_opcode_ids(directory):
+    path = _compile(directory, 'a', _source)
+    db_path = os.path.join(directory, 'reversed.db')
+    db = sqlite3.connect(db_path)
+    db.execute('PRAGMA user_version = %d' % unwind.index._VERSION)
+    db.execute('CREATE TABLE opcodes (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)')
+    db.executemany('INSERT INTO opcodes (name) VALUES (?)', [(name,) for name in reversed(op.opcode_names)])
+    db.commit()
+    db.close()
+
+    names = _opcode_names(path, 'load', 5)
+    with unwind.index.Index(db_path) as index:
+        index.update([path])
+        assert [q for p, q, l in index.find_sequence(names)] == ['load'], names
+
+        # The stored opcodes are the ids of the opcodes table
+        stored = dict(index.db.execute('SELECT id, name FROM opcodes'))
+        blob = index.db.execute("SELECT opcodes FROM code WHERE qualname = 'load'").fetchone()[0]
+        ids = array(unwind.index._STORED_TYPECODE, bytes(blob))
+        assert [stored[i] for i in ids][:5] == names
+
+def test_old_database_is_rebuilt(directory):
+    db_path = os.path.join(directory, 'old.db')
+    db = sqlite3.connect(db_path)
+    db.execute('CREATE TABLE code (id INTEGER PRIMARY KEY, file INTEGER NOT NULL, qualname TEXT NOT NULL, '
+               'line INTEGER, opcodes BLOB NOT NULL)')
+    db.execute("INSERT INTO code (file, qualname, opcodes) VALUES (1, 'f', X'0102')")
+    db.commit()
+    db.close()
+    with unwind.index.Index(db_path) as index:
+        assert index.db.execute('SELECT COUNT(*) FROM code').fetchone()[0] == 0
+        path = _compile(directory, 'a', _source)
+        assert index.update([path]) == (1, 0, 0)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-index-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,94 @@
+import os
+import json
+import pstats
+import shutil
+import tempfile
+import threading
+import py_compile
+
+import unwind
+import unwind.ast as ast
+import unwind.instrument as instrument
+
+_source = '''
+def helper(a, b):
+    c = a + b
+    if c > 2:
+        c = c * 2
+    return c
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def test_profile(directory):
+    path = _compile(directory, 'a', _source)
+    accept = ast.Node.__dict__['accept']
+    assert instrument.current() is None
+    with unwind.profile() as p:
+        assert instrument.current() is p
+        assert ast.Node.__dict__['accept'] is accept
+        unwind.decompile(path, select='helper')
+    assert instrument.current() is None
+
+    assert p.counters['code_objects'] == 2 and p.counters['opcodes_decoded'] > 0, p.counters
+    assert p.phases['decompile'].calls == 1 and p.phases['disassemble'].calls == 1
+    assert p.phases['StackBasedOpcodeRemover'].callers == {'decompile': [1, p.phases['StackBasedOpcodeRemover'].seconds]}
+    assert p.visits['StackBasedOpcodeRemover'] > 0 and p.visits['MakeIdentifiersValid'] > 0, p.visits
+    assert p.seconds >= p.phases['decompile'].seconds
+
+def test_dump(directory):
+    path = _compile(directory, 'a', _source)
+    with unwind.profile(cprofile=True) as p:
+        unwind.decompile(path)
+    p.dump_json(os.path.join(directory, 'profile.json'))
+    with open(os.path.join(directory, 'profile.json')) as f:
+        assert json.load(f)['counters'] == p.counters
+    p.dump_stats(os.path.join(directory, 'profile.prof'))
+    stats = pstats.Stats(os.path.join(directory, 'profile.prof')).stats
+    assert ('unwind', 0, 'decompile') in stats
+    assert any(key[0] != 'unwind' for key in stats)
+
+# Every thread has its own active profile, and work done in other threads
+# doesn't end up in it
+def test_threads(directory):
+    path = _compile(directory, 'a', _source)
+    with unwind.profile() as expected:
+        unwind.decompile(path)
+
+    started = threading.Event()
+    done = threading.Event()
+    seen = []
+    def other():
+        seen.append(instrument.current())
+        with unwind.profile() as p:
+            started.set()
+            for i in range(5):
+                unwind.decompile(path)
+            done.wait()
+        seen.append(p)
+
+    thread = threading.Thread(target=other)
+    with unwind.profile() as p:
+        thread.start()
+        started.wait()
+        unwind.decompile(path)
+        done.set()
+        thread.join()
+    assert seen[0] is None
+    assert p.counters == expected.counters and p.visits == expected.visits, (p.counters, expected.counters)
+    assert seen[1].counters['code_objects'] == 5 * expected.counters['code_objects']
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-instrument-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
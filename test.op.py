@@ -0,0 +1,40 @@
+import unwind.op as op
+from unwind.ast import Block, Const, Opcode
+from unwind.passes import ComputeBasicBlocks
+
+# The jumps that ComputeBasicBlocks has always split basic blocks at
+_branches = ['JUMP_ABSOLUTE', 'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP',
+             'JUMP_IF_TRUE_OR_POP', 'JUMP_FORWARD', 'JUMP_IF_FALSE', 'JUMP_IF_TRUE']
+
+def test_branches_before_wordcode():
+    names = set(name for name in op.opcode_names if op.opcode_flags[op.opcode_ids[name]] & op.IS_BRANCH)
+    assert names == set(_branches), names
+    for name in ['SETUP_LOOP', 'SETUP_EXCEPT', 'SETUP_FINALLY', 'SETUP_WITH', 'FOR_ITER', 'CONTINUE_LOOP']:
+        flags = op.opcode_flags[op.opcode_ids[name]]
+        assert flags & op.IS_JUMP and not flags & op.IS_BRANCH, name
+
+# for x in y: z()
+def test_loop_setup_does_not_split_basic_blocks():
+    block = Block(
+        Opcode(0, 3, 'SETUP_LOOP', Const(21)),
+        Opcode(3, 3, 'LOAD_GLOBAL', Const('y')),
+        Opcode(6, 1, 'GET_ITER', None),
+        Opcode(7, 3, 'FOR_ITER', Const(13)),
+        Opcode(10, 3, 'STORE_FAST', Const('x')),
+        Opcode(13, 3, 'LOAD_GLOBAL', Const('z')),
+        Opcode(16, 3, 'CALL_FUNCTION', Const(0)),
+        Opcode(19, 1, 'POP_TOP', None),
+        Opcode(20, 3, 'JUMP_ABSOLUTE', Const(7)),
+        Opcode(23, 1, 'POP_BLOCK', None),
+        Opcode(24, 3, 'LOAD_CONST', Const(None)),
+        Opcode(27, 1, 'RETURN_VALUE', None),
+    )
+    blocks = ComputeBasicBlocks().create_basic_blocks(block.nodes)
+    assert [b.start for b in blocks] == [0, 7, 23], [b.start for b in blocks]
+    assert [[n.start for n in b.next] for b in blocks] == [[7], [7, 23], []]
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('ok ' + name)
@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+import tempfile
+import py_compile
+
+import unwind
+import unwind.ast as ast
+from unwind.passmanager import Pass, Fixpoint, PassManager, PassReport, count_nodes
+
+_source = '''
+def helper(a, b):
+    c = a + b
+    if c > 2:
+        print(c)
+    return {'c': c}
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+# Folds the first addition of two constants it finds, so a tree with n of them
+# takes n rounds of a Fixpoint
+class _FoldOne(ast.CloneVisitor):
+    def __init__(self):
+        self.changed = False
+
+    def visit_Binary(self, node):
+        if not self.changed and node.op == '+' and isinstance(node.left, ast.Const) and isinstance(node.right, ast.Const):
+            self.changed = True
+            return ast.Const(node.left.value + node.right.value)
+        return ast.CloneVisitor.visit_Binary(self, node)
+
+# Never changes anything
+class _Nothing:
+    changed = False
+
+    def run(self, node):
+        return node
+
+def _tree():
+    one_plus_two = ast.Binary('+', ast.Const(1), ast.Const(2))
+    return ast.Block(ast.Return(ast.Binary('+', one_plus_two, ast.Const(3))))
+
+def test_count_nodes(directory):
+    assert count_nodes(_tree()) == 7
+    assert count_nodes('not a node') is None
+
+def test_fixpoint(directory):
+    manager = PassManager([
+        Pass('Before', lambda node, context: _Nothing()),
+        Fixpoint('Fold', [
+            Pass('FoldOne', lambda node, context: _FoldOne()),
+            Pass('Nothing', lambda node, context: _Nothing()),
+        ]),
+    ])
+    result = manager.run(_tree())
+    assert result == ast.Block(ast.Return(ast.Const(6))), result
+
+    # The third round changes nothing, so it's the last. Nothing gets the same
+    # tree in the third round as in the second, so it's skipped.
+    report = manager.report
+    assert report.iterations == {'Fold': 3}
+    assert [(r.name, r.group, r.iteration, r.changed, r.skipped) for r in report.records] == [
+        ('Before', None, 1, False, False),
+        ('FoldOne', 'Fold', 1, True, False),
+        ('Nothing', 'Fold', 1, False, False),
+        ('FoldOne', 'Fold', 2, True, False),
+        ('Nothing', 'Fold', 2, False, False),
+        ('FoldOne', 'Fold', 3, False, False),
+        ('Nothing', 'Fold', 3, None, True),
+    ]
+    assert [(r.nodes_before, r.nodes_after) for r in report.records[1:4]] == [(7, 5), (5, 5), (5, 3)]
+
+def test_max_iterations(directory):
+    manager = PassManager([Fixpoint('Fold', [Pass('FoldOne', lambda node, context: _FoldOne())], max_iterations=1)])
+    result = manager.run(_tree())
+    assert result == ast.Block(ast.Return(ast.Binary('+', ast.Const(3), ast.Const(3)))), result
+    assert manager.report.iterations == {'Fold': 1}
+
+# A pass that returns an equal tree without saying whether it changed anything
+# didn't change it, and the tree it was given is kept
+def test_changed_by_comparison(directory):
+    tree = _tree()
+    manager = PassManager([
+        Pass('Clone', lambda node, context: ast.CloneVisitor()),
+        Pass('InPlace', lambda node, context: ast.ReplacementVisitor()),
+    ])
+    assert manager.run(tree) is tree
+    assert [r.changed for r in manager.report.records] == [False, None]
+
+def test_context_and_allocations(directory):
+    contexts = []
+    def create(node, context):
+        contexts.append(context)
+        return _Nothing()
+    manager = PassManager([Pass('Nothing', create)], trace_allocations=True)
+    manager.run(_tree(), 'context')
+    assert contexts == ['context']
+    record = manager.report.records[0]
+    assert record.allocated is not None and record.peak is not None
+
+def test_decompile_report(directory):
+    path = _compile(directory, 'a', _source)
+    report = PassReport()
+    unwind.decompile(path, report=report)
+    names = [r.name for r in report.records]
+    for name in ['CodeObjectsToNodes', 'ComputeBasicBlocks', 'StackBasedOpcodeRemover', 'MakeIdentifiersValid']:
+        assert name in names, names
+    assert report.iterations['InlineAndReconstruct'] >= 1
+    assert sorted(report.seconds_by_pass()) == sorted(set(names))
+
+    report = json.loads(json.dumps(report.as_dict()))
+    assert [p['name'] for p in report['passes']] == names
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-passmanager-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
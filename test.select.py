@@ -0,0 +1,99 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import py_compile
+
+import unwind
+import unwind.decomp as decomp
+import unwind.disasm as disasm
+
+_source = '''
+def helper(a, b):
+    c = a + b
+    return c * 2
+
+def outer():
+    x = 1
+    def inner():
+        return x
+    return inner
+
+class Point:
+    def norm(self):
+        return self.x * self.x
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def _decoded(code):
+    return '_decoder' not in code.__dict__
+
+def test_select(directory):
+    path = _compile(directory, 'a', _source)
+    module = disasm.disassemble(path, lazy=True)
+    assert [name for name, code in decomp._select(module.body, 'Point.*')] == ['Point.norm']
+    assert [name for name, code in decomp._select(module.body, ['helper', 'outer*'])] == ['helper', 'outer']
+    assert [name for name, code in decomp._select(module.body, lambda co: co.co_name == 'inner')] == ['outer.inner']
+
+    # Only co_consts was looked at
+    assert not [name for name, code in disasm.walk(module.body) if _decoded(code)]
+
+    source = unwind.decompile(path, select=['helper', 'Point.norm'])
+    assert source.startswith('# helper\n') and '\n\n# Point.norm\n' in source, source
+
+# A code object the decompiler can't handle is emitted as bytecode without
+# failing the others
+def test_fallback(directory):
+    path = _compile(directory, 'a', _source)
+    source = unwind.decompile(path, select=['outer.inner', 'helper'])
+    helper, inner = source.split('\n\n')
+    assert inner.startswith('# outer.inner\n# unwind: cannot decompile (IndexError: '), inner
+    assert "'LOAD_DEREF', Const(0))" in inner, inner
+    assert helper == unwind.decompile(path, select='helper')
+
+# Decoding a large code object gives other threads time to ask for it too
+def test_lazy_threads(directory):
+    path = _compile(directory, 'a', _source + 'def large(a):\n' + '    a = a + 1\n' * 5000)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        _lazy_threads(path)
+    finally:
+        sys.setswitchinterval(interval)
+
+def _lazy_threads(path):
+    for attempt in range(20):
+        module = disasm.disassemble(path, lazy=True)
+        # Python 3.13 closures can't be disassembled yet
+        codes = [code for name, code in disasm.walk(module.body) if not name.startswith('outer')]
+        results = []
+        start = threading.Barrier(8)
+        def decode():
+            start.wait()
+            results.append([code.opcodes for code in codes])
+        threads = [threading.Thread(target=decode) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 8
+        for opcodes in results:
+            assert all(a is b for a, b in zip(opcodes, results[0]))
+        assert all(_decoded(code) for code in codes)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-select-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,174 @@
+import os
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import py_compile
+
+import unwind
+import unwind.disasm as disasm
+import unwind.server as server
+
+_source = '''
+def helper(a, b):
+    c = a + b
+    return c * 2
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+# Run a server in a thread for the duration of a with statement
+class _Running:
+    def __init__(self, path):
+        self.server = server.Server(path, workers=1, batch_delay=0)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        return self.server
+
+    def __exit__(self, type, value, traceback):
+        self.server.shutdown()
+        self.thread.join()
+        return False
+
+def test_requests(directory):
+    path = _compile(directory, 'a', _source)
+    broken = os.path.join(directory, 'broken.pyc')
+    with open(broken, 'wb') as f:
+        f.write(b'\0' * 32)
+    address = os.path.join(directory, 'requests.sock')
+    with _Running(address):
+        with server.Client(address) as client:
+            client.ping()
+            assert client.decompile(path) == unwind.decompile(path)
+            try:
+                client.decompile(broken)
+                assert False
+            except disasm.DisassemblerException:
+                pass
+            try:
+                client.decompile(os.path.join(directory, 'missing.pyc'))
+                assert False
+            except server.RemoteError as e:
+                assert 'FileNotFoundError' in str(e), e
+            stats = client.stats()
+            assert stats['requests'] == 4 and stats['max'] >= stats['p50'] > 0, stats
+    assert not os.path.exists(address)
+
+def test_stale_socket(directory):
+    address = os.path.join(directory, 'stale.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(address)
+    stale.close()
+    assert os.path.exists(address)
+    with _Running(address):
+        with server.Client(address) as client:
+            client.ping()
+
+def test_other_files_are_kept(directory):
+    address = os.path.join(directory, 'file.sock')
+    with open(address, 'w') as f:
+        f.write('data')
+    try:
+        server.Server(address)
+        assert False
+    except OSError:
+        pass
+    with open(address) as f:
+        assert f.read() == 'data'
+
+    # A socket another server is listening on
+    address = os.path.join(directory, 'live.sock')
+    live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    live.bind(address)
+    live.listen(1)
+    try:
+        server.Server(address)
+        assert False
+    except OSError:
+        pass
+    finally:
+        live.close()
+    assert os.path.exists(address)
+
+# The server keeps working after its worker process is killed
+def test_worker_killed(directory):
+    path = _compile(directory, 'a', _source)
+    address = os.path.join(directory, 'killed.sock')
+    with _Running(address) as running:
+        with server.Client(address) as client:
+            expected = client.decompile(path)
+            for pid in list(running._pool._processes):
+                os.kill(pid, signal.SIGKILL)
+            errors = 0
+            for attempt in range(10):
+                try:
+                    assert client.decompile(path) == expected
+                    break
+                except server.RemoteError as e:
+                    assert 'BrokenProcessPool' in str(e), e
+                    errors += 1
+                    time.sleep(0.1)
+            assert errors < 10
+            assert client.decompile(path) == expected
+
+# Threads sharing a client each get their own responses
+def test_shared_client(directory):
+    paths = [_compile(directory, 'shared%d' % i, _source.replace('helper', 'helper%d' % i)) for i in range(4)]
+    address = os.path.join(directory, 'shared.sock')
+    results = {}
+    def run(i):
+        results[i] = [client.decompile(paths[(i + j) % 4]) for j in range(5)]
+    with _Running(address):
+        with server.Client(address) as client:
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert not client._responses and not client._reading
+    for i in range(8):
+        assert results[i] == [unwind.decompile(paths[(i + j) % 4]) for j in range(5)]
+
+# Requests that aren't objects and batches the pool refuses get error responses
+def test_errors(directory):
+    class Refusing:
+        def submit(self, fn, *args):
+            raise RuntimeError('no workers')
+
+    path = _compile(directory, 'a', _source)
+    address = os.path.join(directory, 'errors.sock')
+    with _Running(address) as running:
+        with server.Client(address) as client:
+            server._send(client._socket, [1, 2])
+            response = server._receive(client._socket)
+            assert response == {'id': None, 'ok': False, 'type': 'ValueError',
+                                'error': 'request is not a JSON object'}, response
+
+            pool, running._pool = running._pool, Refusing()
+            try:
+                client.decompile(path)
+                assert False
+            except server.RemoteError as e:
+                assert str(e) == 'RuntimeError: no workers', e
+            finally:
+                running._pool = pool
+            assert client.decompile(path) == unwind.decompile(path)
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-server-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import py_compile
+from array import array
+
+import unwind.op as op
+import unwind.disasm as disasm
+import unwind.similarity as similarity
+
+_source = '''
+def parse(lines):
+    result = {}
+    for line in lines:
+        key, value = line.split('=', 1)
+        result[key.strip()] = value.strip()
+    return result
+
+def parse_config(lines):
+    result = {}
+    for line in lines:
+        key, value = line.split('=', 1)
+        result[key.strip()] = value.strip()
+    return result
+
+def render(items, width):
+    text = []
+    while items:
+        text.append(str(items.pop()).rjust(width))
+    return '\\n'.join(text)
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def _codes(path, columnar=False):
+    module = disasm.disassemble(path, columnar=columnar)
+    return dict(disasm.walk(module.body))
+
+# A signature made of the given MinHash values
+def _signature(values):
+    signature = similarity.Signature.__new__(similarity.Signature)
+    signature.minhash = array('Q', values)
+    return signature
+
+def test_signature(directory):
+    codes = _codes(_compile(directory, 'a', _source))
+    parse, parse_config, render = [similarity.Signature(codes[name]) for name in ['parse', 'parse_config', 'render']]
+    assert parse.similarity(parse_config) == 1.0 and parse.distance(parse_config) == 0
+    assert parse.similarity(render) < 0.5, parse.similarity(render)
+
+    # Columnar opcodes give the same signature
+    columns = _codes(_compile(directory, 'a', _source), columnar=True)
+    assert similarity.Signature(columns['parse']).minhash == parse.minhash
+
+# CACHE and EXTENDED_ARG entries don't change the shingles, so the signatures
+# only depend on the code and not on the Python version reading it
+def test_shingles_ignore_cache(directory):
+    code = _codes(_compile(directory, 'a', _source))['render']
+    names = similarity._opcode_names(code)
+    assert 'CACHE' not in names and 'EXTENDED_ARG' not in names
+    hashes = similarity._feature_hashes(code)
+    if 'CACHE' in op.opcode_ids:
+        code.opcodes = [o for o in code.opcodes if op.opcode_names[o.opcode] != 'CACHE']
+    assert similarity._feature_hashes(code) == hashes
+
+def test_query_and_clusters(directory):
+    path = _compile(directory, 'a', _source)
+    index = similarity.LSHIndex(threshold=0.9)
+    assert index.add_file(path, min_opcodes=8) == 4
+    parse = index.signatures[(path, 'parse')]
+    assert sorted(key for key, value in index.query(parse)) == [(path, 'parse'), (path, 'parse_config')]
+    assert index.clusters() == [[(path, 'parse'), (path, 'parse_config')]]
+
+# b is similar to both a and c, which aren't similar to each other, and they
+# all share one bucket, so the three of them are one cluster
+def test_clusters_merge_every_similar_group():
+    index = similarity.LSHIndex(threshold=0.5, num_perm=4)
+    assert (index.bands, index.rows) == (4, 1)
+    index.add('a', _signature([1, 2, 3, 4]))
+    index.add('c', _signature([1, 5, 6, 7]))
+    index.add('b', _signature([1, 2, 6, 8]))
+    index.add('d', _signature([9, 10, 11, 12]))
+    index.add('e', _signature([9, 13, 14, 15]))
+    assert index.clusters() == [['a', 'b', 'c']], index.clusters()
+
+# Thresholds below 1 / num_perm still give an index, with one row per band
+def test_low_threshold():
+    for threshold in [0, 0.1]:
+        index = similarity.LSHIndex(threshold=threshold, num_perm=8)
+        assert (index.bands, index.rows) == (8, 1)
+
+# Adding a key again replaces its signature, buckets included
+def test_replace():
+    index = similarity.LSHIndex(threshold=0.5, num_perm=4)
+    index.add('a', _signature([1, 2, 3, 4]))
+    index.add('b', _signature([1, 2, 3, 5]))
+    index.add('a', _signature([6, 7, 8, 9]))
+    assert len(index) == 2
+    assert [key for key, value in index.query(_signature([1, 2, 3, 4]))] == ['b']
+    assert index.candidates(_signature([6, 7, 8, 9])) == {'a'}
+    assert index.clusters() == []
+    index.add('a', _signature([1, 2, 3, 4]))
+    assert index.clusters() == [['a', 'b']]
+    assert sum(len(keys) for buckets in index._buckets for keys in buckets.values()) == 8
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-similarity-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                if test.__code__.co_argcount:
+                    test(directory)
+                else:
+                    test()
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import tempfile
+import py_compile
+
+import unwind
+import unwind.sourcemap
+
+_source = '''import os
+
+x = 1
+
+if x:
+    y = os.getcwd()
+else:
+    y = None
+print(y)
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+# Output line 2 is a statement nested in the one on lines 1 to 3, lines 5 to 7
+# are a single statement and line 4 is blank
+def _source_map():
+    source_map = unwind.sourcemap.SourceMap()
+    source_map.add(2, 2, (4, 8))
+    source_map.add(1, 3, (0, 12))
+    source_map.add(5, 7, (20, 24))
+    return source_map
+
+def test_lookup(directory):
+    source_map = _source_map()
+    assert [source_map.lookup(n) for n in range(9)] == [
+        None, (0, 0, 12), (0, 4, 8), (0, 0, 12), None, (0, 20, 24), (0, 20, 24), (0, 20, 24), None]
+
+    # Offsets outside the nested statement are on lines 1 and 3, the last of
+    # those is returned
+    assert [source_map.output_line(n) for n in [0, 4, 7, 8, 12, 19, 20, 23, 24]] == [3, 2, 2, 3, None, None, 5, 5, None]
+    assert source_map.output_lines(0) == [1, 2, 3, 5]
+    assert source_map.output_lines(1) == []
+
+    # Lines added later are found too
+    source_map.add(8, 8, (12, 16))
+    assert source_map.lookup(8) == (0, 12, 16) and source_map.output_line(12) == 8
+
+def test_as_dict(directory):
+    assert json.loads(json.dumps(_source_map().as_dict())) == {
+        'filename': None,
+        'mappings': [[1, 0, 0, 12], [2, 0, 4, 8], [3, 0, 0, 12], [5, 0, 20, 24]],
+    }
+
+# Lines of decompiled output lead back to the lines they came from
+def test_decompile(directory):
+    path = _compile(directory, 'a', _source)
+    source_map = unwind.sourcemap.SourceMap()
+    lines = unwind.decompile(path, source_map=source_map).split('\n')
+    assert source_map.code.co_filename.endswith('a.py')
+    assert source_map.as_dict()['filename'] == source_map.code.co_filename
+
+    assigned = [n for n, line in enumerate(lines, 1) if line.strip().startswith('y = ')]
+    assert [source_map.lookup(n)[0] for n in assigned] == [6, 8], lines
+    for n, original in zip(assigned, [6, 8]):
+        assert n in source_map.output_lines(original)
+        assert source_map.output_line(source_map.lookup(n)[1]) == n
+
+    try:
+        unwind.decompile(path, source_map=unwind.sourcemap.SourceMap(), select='')
+        assert False
+    except ValueError:
+        pass
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-sourcemap-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,91 @@
+import os
+import struct
+import shutil
+import tempfile
+import py_compile
+
+import unwind.disasm as disasm
+import unwind.store as store
+
+_source = '''
+import os
+
+def small(a):
+    return a + 1
+
+class Parser:
+    def parse(self, text):
+        return [os.path.join(a, 'x') for a in text.split()]
+
+    def render(self, text):
+        return [os.path.join(a, 'x') for a in text.split()]
+'''
+
+def _compile(directory, name, source):
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True)
+    return path + 'c'
+
+def test_round_trip(directory):
+    path = _compile(directory, 'a', _source)
+    module = disasm.disassemble(path)
+    stored = os.path.join(directory, 'a.unwind')
+    store.save(module, stored)
+    assert repr(store.load(stored)) == repr(module)
+    with open(stored, 'rb') as f:
+        assert f.read() == store.dumps(module)
+
+    columns = disasm.disassemble(path, columnar=True)
+    loaded = store.load(stored, columnar=True)
+    assert repr(loaded) == repr(columns)
+    assert isinstance(loaded.body.opcodes, disasm.OpcodeColumns)
+
+    # Columnar modules can be stored too
+    assert repr(store.Reader(store.dumps(columns)).module()) == repr(module)
+
+def test_reader(directory):
+    module = disasm.disassemble(_compile(directory, 'a', _source))
+    with store.Reader(store.dumps(module)) as reader:
+        assert reader.qualnames() == [qualname for qualname, code in disasm.walk(module.body)]
+        assert (reader.magic, reader.timestamp, reader.python_version) == (
+            module.magic, module.timestamp, module.python_version)
+
+        # Code objects are decoded once, on demand
+        parse = reader.code('Parser.parse')
+        assert parse.co_name == 'parse' and reader.code('Parser.parse') is parse
+        assert 0 not in reader._codes
+        assert reader.code(reader.qualnames().index('Parser.parse')) is parse
+        for key in ['missing', -1, len(reader.qualnames())]:
+            try:
+                reader.code(key)
+                assert False
+            except KeyError:
+                pass
+
+        # Constants are shared between code objects
+        assert reader.code('Parser.render').co_names is parse.co_names
+
+def test_format_error(directory):
+    data = store.dumps(disasm.disassemble(_compile(directory, 'a', _source)))
+    empty = os.path.join(directory, 'empty.unwind')
+    open(empty, 'wb').close()
+    newer = data[:4] + struct.pack('<I', store.FORMAT_VERSION + 1) + data[8:]
+    for source, message in [(b'UNWB', 'too short'), (b'x' * len(data), 'not in the unwind binary format'),
+                            (newer, 'Unsupported format version'), (empty, 'is empty')]:
+        try:
+            store.Reader(source)
+            assert False
+        except store.FormatError as e:
+            assert message in str(e), e
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-store-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import struct
+import time
+import shutil
+import tempfile
+import py_compile
+import subprocess
+import importlib.util
+
+import unwind.triage as triage
+
+_source = 'x = 1\n'
+
+def _compile(directory, name, source, **kwargs):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, name + '.py')
+    with open(path, 'w') as f:
+        f.write(source)
+    py_compile.compile(path, cfile=path + 'c', doraise=True, **kwargs)
+    return path + 'c'
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+# A tree with a timestamp-based file, a hash-based file in a subdirectory, a
+# file that's too short, one with an unknown magic number and a symbolic link
+# to a directory
+def _tree(directory):
+    root = os.path.join(directory, 'tree')
+    shutil.rmtree(root, ignore_errors=True)
+    stamped = _compile(root, 'a', _source)
+    hashed = _compile(os.path.join(root, 'sub'), 'b', _source,
+                      invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+    short = _write(os.path.join(root, 'c.pyc'), b'\x03\xf3')
+    unknown = _write(os.path.join(root, 'sub', 'd.pyo'), struct.pack('<IIII', 0x0a0dffff, 1, 2, 3))
+    _write(os.path.join(root, 'e.txt'), b'not compiled')
+    os.symlink(os.path.join(root, 'sub'), os.path.join(root, 'link'))
+    return root, stamped, hashed, short, unknown
+
+def test_records(directory):
+    root, stamped, hashed, short, unknown = _tree(directory)
+    records = dict((record.path, record) for record in triage.scan(root))
+    assert sorted(records) == sorted([stamped, hashed, short, unknown]), sorted(records)
+    magic = struct.unpack('<I', importlib.util.MAGIC_NUMBER)[0]
+    version = '%d.%d' % sys.version_info[:2]
+
+    record = records[stamped]
+    assert (record.magic, record.header_size, record.flags) == (magic, 16, 0)
+    assert record.python_version.startswith(version), record.python_version
+    assert record.timestamp == int(os.stat(stamped[:-1]).st_mtime) and record.source_size == len(_source)
+    assert record.size == os.path.getsize(stamped) and record.source_hash is None and record.error is None
+
+    record = records[hashed]
+    assert record.flags == 3 and record.timestamp is None and record.source_size is None
+    assert record.source_hash == importlib.util.source_hash(_source.encode('ascii')).hex()
+
+    assert records[short].error == 'File is too short for a *.pyc header' and records[short].magic is None
+    record = records[unknown]
+    assert record.python_version is None and record.magic == 0x0a0dffff and record.error is None
+
+    assert json.loads(json.dumps(records[stamped].to_dict()))['path'] == stamped
+
+def test_order(directory):
+    root = _tree(directory)[0]
+    paths = [record.path for record in triage.scan(root)]
+    assert [record.path for record in triage.scan(root, workers=1, batch_size=1)] == paths
+    assert [record.path for record in triage.scan(root, workers=3, batch_size=2)] == paths
+
+def test_single_file(directory):
+    stamped = _tree(directory)[1]
+    assert [record.path for record in triage.scan(stamped)] == [stamped]
+    missing = os.path.join(directory, 'missing.pyc')
+    assert [record.error for record in triage.scan(missing)] == ['FileNotFoundError: No such file or directory']
+
+def test_summary(directory):
+    root = _tree(directory)[0]
+    summary = triage.Summary()
+    for record in triage.scan(root):
+        summary.add(record)
+    assert (summary.files, summary.errors) == (4, 1)
+    assert summary.headers == {'16': 1, '16-hash': 1, '8': 1}, summary.headers
+    assert summary.versions['unknown'] == 1 and sum(summary.versions.values()) == 3
+    # The unknown magic number is read as an 8 byte header with a timestamp of 1
+    assert summary.years == {time.gmtime().tm_year: 1, 1970: 1} and summary.sizes[2] == 1
+    assert summary.format().split('\n')[0] == '4 files, %d bytes, 1 errors' % summary.bytes
+
+    output = subprocess.check_output([sys.executable, '-m', 'unwind', 'scan', root, '--json'])
+    assert json.loads(output.decode('utf8')) == json.loads(json.dumps(summary.to_dict()))
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp(prefix='unwind-triage-')
+    try:
+        for name, test in sorted(globals().items()):
+            if name.startswith('test_'):
+                test(directory)
+                print('ok ' + name)
+    finally:
+        shutil.rmtree(directory)
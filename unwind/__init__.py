@@ -1,2 +1,48 @@
-from unwind.disasm import disassemble
-from unwind.decomp import decompile
+'''
+The functions most programs need are available from the package itself:
+
+    unwind.disassemble, unwind.disassemble_file, unwind.disassemble_bytes,
+    unwind.disassemble_archive, unwind.disassemble_batch (see unwind.disasm)
+    unwind.decompile (see unwind.decomp)
+    unwind.profile (see unwind.instrument)
+    unwind.diff (see unwind.codediff)
+    unwind.scan (see unwind.triage)
+
+Each is imported from its module the first time it's used, so a program
+that only disassembles never imports the decompiler. Submodules such as
+unwind.store can be used after "import unwind" in the same way.
+'''
+
+import importlib
+
+# Where every name of the package is imported from
+_exports = {
+    'disassemble': 'unwind.disasm',
+    'disassemble_file': 'unwind.disasm',
+    'disassemble_bytes': 'unwind.disasm',
+    'disassemble_archive': 'unwind.disasm',
+    'disassemble_batch': 'unwind.disasm',
+    'decompile': 'unwind.decomp',
+    'profile': 'unwind.instrument',
+    'diff': 'unwind.codediff',
+    'scan': 'unwind.triage',
+}
+
+_submodules = ['aio', 'ast', 'budget', 'cache', 'codediff', 'codegen', 'decomp', 'disasm', 'export', 'index',
+               'instrument', 'op', 'passes', 'passmanager', 'server', 'similarity', 'sourcemap', 'store',
+               'triage']
+
+__all__ = sorted(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name]), name)
+    elif name in _submodules:
+        value = importlib.import_module('unwind.' + name)
+    else:
+        raise AttributeError("module 'unwind' has no attribute %r" % name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports) | set(_submodules))
@@ -0,0 +1,67 @@
+'''
+Command line interface.
+
+    python -m unwind serve --socket PATH [--workers N] [--batch-size N]
+        Run a decompile server on a Unix socket, see unwind.server.
+
+    python -m unwind scan ROOT [--workers N] [--records] [--json]
+        Read the headers of every *.pyc file under ROOT and print
+        histograms of versions, header layouts, timestamps and sizes, see
+        unwind.triage. With --records, every file is also written to
+        stdout as one line of JSON and the histograms go to stderr.
+
+    python -m unwind export PATH [--json]
+        Disassemble the *.pyc file at PATH and write it to stdout as
+        newline delimited JSON, or as a single JSON document with --json,
+        see unwind.export.
+'''
+
+import sys
+import json
+import argparse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m unwind')
+    commands = parser.add_subparsers(dest='command')
+
+    serve = commands.add_parser('serve', help='run a decompile server on a Unix socket')
+    serve.add_argument('--socket', required=True, help='path of the Unix socket to listen on')
+    serve.add_argument('--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    serve.add_argument('--batch-size', type=int, default=16, help='maximum number of requests per batch')
+    serve.add_argument('--batch-delay', type=float, default=0.002, help='seconds to wait for a batch to fill')
+
+    scan = commands.add_parser('scan', help='summarize the headers of the *.pyc files in a tree')
+    scan.add_argument('root', help='directory (or file) to scan')
+    scan.add_argument('--workers', type=int, default=8, help='number of threads reading headers')
+    scan.add_argument('--records', action='store_true', help='write every file to stdout as a line of JSON')
+    scan.add_argument('--json', action='store_true', help='print the histograms as JSON')
+
+    export = commands.add_parser('export', help='write the disassembly of a *.pyc file as JSON')
+    export.add_argument('path', help='*.pyc file to disassemble')
+    export.add_argument('--json', action='store_true', help='write a single JSON document instead of NDJSON')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        from unwind.server import serve as run
+        run(args.socket, args.workers, args.batch_size, args.batch_delay)
+    elif args.command == 'scan':
+        from unwind import triage
+        summary = triage.Summary()
+        for record in triage.scan(args.root, args.workers):
+            summary.add(record)
+            if args.records:
+                sys.stdout.write(json.dumps(record.to_dict(), sort_keys=True) + '\n')
+        output = sys.stderr if args.records else sys.stdout
+        output.write((json.dumps(summary.to_dict(), sort_keys=True) if args.json else summary.format()) + '\n')
+    elif args.command == 'export':
+        from unwind import disasm, export
+        module = disasm.disassemble(args.path, columnar=True)
+        if args.json:
+            export.write_json(module, sys.stdout)
+        else:
+            export.write_ndjson(module, sys.stdout)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
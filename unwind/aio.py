@@ -0,0 +1,100 @@
+'''
+aio.disassemble_many(sources, limit=8, executor=None, columnar=False)
+    An asynchronous generator that disassembles many *.pyc files and yields
+    (index, module) pairs in the order they complete, where index is the
+    position of the source in sources. sources is an iterable or an
+    asynchronous iterable whose items are paths, bytes-like objects with the
+    contents of a *.pyc file, or awaitables that produce either of those
+    (such as a coroutine fetching a blob from object storage).
+
+        async for index, module in unwind.aio.disassemble_many(blobs):
+            if isinstance(module, Exception):
+                ...
+
+    The disassembly itself runs in executor (the event loop's default
+    executor if None) so the event loop never waits on it, and awaiting the
+    sources overlaps with disassembling the ones already fetched. At most
+    limit sources are in flight at once, counting results that haven't been
+    consumed yet, so a slow consumer stops further sources from being
+    pulled. If a source can't be fetched or disassembled, the exception is
+    yielded in place of the module. Pass a concurrent.futures
+    ProcessPoolExecutor to use several cores.
+'''
+
+import asyncio
+import inspect
+
+import unwind.disasm as disasm
+
+async def disassemble_many(sources, limit=8, executor=None, columnar=False):
+    '''
+    Disassemble every source in sources in executor with at most limit in
+    flight, yielding (index, module or exception) pairs as they complete.
+    '''
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(limit)
+    results = asyncio.Queue()
+    tasks = set()
+
+    async def run(index, source):
+        try:
+            if inspect.isawaitable(source):
+                source = await source
+            if isinstance(source, str):
+                result = await loop.run_in_executor(executor, disasm.disassemble, source, columnar)
+            else:
+                result = await loop.run_in_executor(executor, disasm.disassemble_bytes, source, columnar)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = e
+        results.put_nowait((index, result))
+
+    # Pull sources only while there's room, a slot is freed when a result is
+    # taken by the consumer rather than when the work is done. When sources
+    # run out, the number of sources is queued after the last task started.
+    async def feed():
+        count = 0
+        try:
+            async for source in _iterate(sources):
+                await semaphore.acquire()
+                task = loop.create_task(run(count, source))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                count += 1
+        except Exception as e:
+            results.put_nowait((_FAILED, e))
+        else:
+            results.put_nowait((_DONE, count))
+
+    feeder = loop.create_task(feed())
+    consumed = 0
+    total = None
+    try:
+        while total is None or consumed < total:
+            index, result = await results.get()
+            if index is _DONE:
+                total = result
+            elif index is _FAILED:
+                raise result
+            else:
+                consumed += 1
+                semaphore.release()
+                yield index, result
+    finally:
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+# Markers queued by the feeder when sources run out or raise
+_DONE = object()
+_FAILED = object()
+
+# Iterate over a normal or an asynchronous iterable
+async def _iterate(sources):
+    if hasattr(sources, '__aiter__'):
+        async for source in sources:
+            yield source
+    else:
+        for source in sources:
+            yield source
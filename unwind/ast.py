@@ -1,9 +1,22 @@
+import unwind.op as _op
+
 # Helper function to indent a chunk of text
 def _indent(text, indent):
     return '\n'.join(indent + line for line in text.split('\n'))
 
-# Abstract base class for all nodes
+# Helper function that combines bytecode ranges, any of which may be None
+def merge_spans(*spans):
+    spans = [s for s in spans if s is not None]
+    if not spans:
+        return None
+    return min(s[0] for s in spans), max(s[1] for s in spans)
+
+# Abstract base class for all nodes. Statements carry a span, the range of
+# bytecode offsets (start, end) they were decompiled from, or None. The span
+# isn't a field so it doesn't take part in comparisons.
 class Node:
+    span = None
+
     def __init__(self, *args):
         assert len(self.fields) == len(args)
         for f, arg in zip(self.fields, args):
@@ -51,7 +64,15 @@ class _Collection(Node):
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.nodes == other.nodes
 
+# A list of statements. Blocks converted from a code object keep a reference
+# to the disasm.CodeObject in code, which isn't a field either.
 class Block(_Collection):
+    code = None
+
+# The opcodes of a code object that wasn't decompiled because it exceeded a
+# budget.Budget, emitted as __asm__() calls after a Comment giving the reason.
+# Visitors that transform the tree leave it alone.
+class Asm(Block):
     pass
 
 class Tuple(_Collection):
@@ -75,9 +96,17 @@ class Dict(_Collection):
 class DictItem(Node):
     fields = ['key', 'value']
 
+# An opcode that hasn't been decompiled yet. op is a value of op.OpcodeId,
+# opcode names are accepted too and converted.
 class Opcode(Node):
     fields = ['offset', 'size', 'op', 'arg']
 
+    def __init__(self, offset, size, op, arg):
+        Node.__init__(self, offset, size, _op.opcode_ids[op] if isinstance(op, str) else op, arg)
+
+    def __str__(self):
+        return 'Opcode(%s, %s, %s, %s)' % (repr(self.offset), repr(self.size), repr(_op.opcode_names[self.op]), repr(self.arg))
+
 class Const(Node):
     fields = ['value']
 
@@ -143,6 +172,7 @@ class DefaultVisitor:
             c.accept(self)
 
     def visit_Block(self, node): return self.visit_children(node)
+    def visit_Asm(self, node): return self.visit_children(node)
     def visit_Tuple(self, node): return self.visit_children(node)
     def visit_List(self, node): return self.visit_children(node)
     def visit_Print(self, node): return self.visit_children(node)
@@ -177,6 +207,7 @@ class ReplacementVisitor:
         return node
 
     def visit_Block(self, node): return self.replace_collection(node)
+    def visit_Asm(self, node): return node
     def visit_Tuple(self, node): return self.replace_collection(node)
     def visit_List(self, node): return self.replace_collection(node)
     def visit_Print(self, node): return self.replace_collection(node)
@@ -215,9 +246,17 @@ class ReplacementVisitor:
 # visitor subclasses
 class CloneVisitor:
     def clone_collection(self, node):
-        return node.__class__(*[n.accept(self) for n in node.nodes])
+        result = node.__class__(*[n.accept(self) for n in node.nodes])
+        if node.span is not None:
+            result.span = node.span
+        return result
+
+    def visit_Block(self, node):
+        result = self.clone_collection(node)
+        result.code = node.code
+        return result
 
-    def visit_Block(self, node): return self.clone_collection(node)
+    def visit_Asm(self, node): return node
     def visit_Tuple(self, node): return self.clone_collection(node)
     def visit_List(self, node): return self.clone_collection(node)
     def visit_Print(self, node): return self.clone_collection(node)
@@ -227,7 +266,10 @@ class CloneVisitor:
 
     def clone(self, node):
         fields = [getattr(node, f) for f in node.__class__.fields]
-        return node.__class__(*[f.accept(self) if isinstance(f, Node) else f for f in fields])
+        result = node.__class__(*[f.accept(self) if isinstance(f, Node) else f for f in fields])
+        if node.span is not None:
+            result.span = node.span
+        return result
 
     def visit_DictItem(self, node): return self.clone(node)
     def visit_Opcode(self, node): return self.clone(node)
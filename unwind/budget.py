@@ -0,0 +1,138 @@
+'''
+budget.Budget(max_seconds=None, max_iterations=None, max_nodes=None)
+    Limits on the work the decompiler may spend on a single code object,
+    passed to unwind.decompile(). A limit of None means no limit.
+
+        max_seconds = wall time spent on the code object, summed over every
+                      pass that is measured (building basic blocks and
+                      dominators, inlining variables)
+        max_iterations = number of rounds of a fixpoint loop inside a pass,
+                         such as refining dominators or inlining variables
+        max_nodes = number of opcodes in the code object
+
+    The passes check the limits as they go. A code object that exceeds one
+    is emitted as __asm__() calls (see ast.Asm) preceded by a comment that
+    names the limit, and the rest of the module is decompiled as usual.
+
+        self.exceeded = list of budget.BudgetExceeded, one for every code
+                        object that fell back to __asm__() calls
+
+budget.BudgetExceeded(limit, value, code)
+    Raised inside the passes when a code object exceeds its budget, and
+    caught by the pass that's working on that code object.
+
+        self.limit = 'max_seconds', 'max_iterations' or 'max_nodes'
+        self.value = amount that exceeded the limit
+        self.code = the disasm.CodeObject that exceeded it
+'''
+
+import time
+
+import unwind.disasm as disasm
+import unwind.instrument as instrument
+
+class BudgetExceeded(Exception):
+    '''
+    A code object exceeded a limit of a budget.Budget.
+    '''
+
+    def __init__(self, limit, value, code):
+        Exception.__init__(self, limit, value)
+        self.limit = limit
+        self.value = value
+        self.code = code
+
+    def __str__(self):
+        value = '%.3f' % self.value if isinstance(self.value, float) else str(self.value)
+        return '%s exceeded by %s (%s)' % (self.limit, getattr(self.code, 'co_name', None), value)
+
+class Budget:
+    '''
+    Limits on the work spent decompiling each code object. See the module
+    documentation for details.
+    '''
+
+    def __init__(self, max_seconds=None, max_iterations=None, max_nodes=None):
+        self.max_seconds = max_seconds
+        self.max_iterations = max_iterations
+        self.max_nodes = max_nodes
+        self.exceeded = []
+
+    def meter(self):
+        '''
+        Returns a new budget.Meter that tracks the work of one decompile.
+        '''
+        return Meter(self)
+
+class Meter:
+    '''
+    Tracks how much of a budget.Budget each code object has used during one
+    decompile, created by Budget.meter(). Passes wrap the work on a code
+    object in measure() and call check() from their loops.
+
+        self.budget = the budget.Budget being enforced
+        self.exceeded = list of budget.BudgetExceeded raised during this
+                        decompile, also appended to budget.exceeded
+    '''
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.exceeded = []
+        self._seconds = {}
+        self._active = []
+
+    def measure(self, code, nodes=None):
+        '''
+        Returns a context manager that charges the time spent inside it to
+        code, checking nodes (the number of opcodes) against max_nodes on
+        entry. Code objects nested in code are measured separately, with
+        their time also counting towards code.
+        '''
+        return _Measure(self, code, nodes)
+
+    def check(self, iterations=None):
+        '''
+        Raise budget.BudgetExceeded if the code object being measured has
+        used up its time, or if iterations exceeds max_iterations.
+        '''
+        if not self._active:
+            return
+        budget = self.budget
+        code, started = self._active[-1]
+        if budget.max_iterations is not None and iterations is not None and iterations > budget.max_iterations:
+            raise BudgetExceeded('max_iterations', iterations, code)
+        if budget.max_seconds is not None:
+            seconds = self._seconds.get(code, 0.0) + time.time() - started
+            if seconds > budget.max_seconds:
+                raise BudgetExceeded('max_seconds', seconds, code)
+
+    # Called by the pass that falls back to __asm__() calls for a code object.
+    # Code objects nested inside it are emitted as bytecode along with it, so
+    # any earlier entries for them are dropped.
+    def record(self, exceeded):
+        nested = set(co for qualname, co in disasm.walk(exceeded.code))
+        dropped = [e for e in self.exceeded if e.code in nested]
+        for e in dropped:
+            self.exceeded.remove(e)
+            self.budget.exceeded.remove(e)
+        self.exceeded.append(exceeded)
+        self.budget.exceeded.append(exceeded)
+        instrument.count('budgets_exceeded', 1 - len(dropped))
+
+class _Measure:
+    def __init__(self, meter, code, nodes):
+        self.meter = meter
+        self.code = code
+        self.nodes = nodes
+
+    def __enter__(self):
+        max_nodes = self.meter.budget.max_nodes
+        if max_nodes is not None and self.nodes is not None and self.nodes > max_nodes:
+            raise BudgetExceeded('max_nodes', self.nodes, self.code)
+        self.meter._active.append((self.code, time.time()))
+
+    def __exit__(self, type, value, traceback):
+        code, started = self.meter._active.pop()
+        seconds = self.meter._seconds
+        seconds[code] = seconds.get(code, 0.0) + time.time() - started
+        return False
@@ -0,0 +1,118 @@
+'''
+cache.DecompileCache(maxsize=1024, directory=None)
+    A bounded cache of decompiled source code keyed by code object
+    fingerprint (see disasm.CodeObject.fingerprint()). The least recently
+    used entries are evicted once more than maxsize are held in memory. If
+    directory is given, entries are also written there and looked up there
+    when missing from memory, so the cache can be shared between processes
+    and runs.
+
+cache.DecompileCache.get(key)
+    Returns the cached source for key or None if there is none.
+
+cache.DecompileCache.put(key, source)
+    Stores source for key.
+
+cache.DecompileCache.clear()
+    Removes all entries held in memory. Entries on disk are kept.
+'''
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+class DecompileCache:
+    '''
+    A bounded LRU cache of decompiled source code, optionally backed by a
+    directory on disk.
+
+        self.maxsize = maximum number of entries held in memory
+        self.directory = path of the on-disk cache or None
+        self.hits = number of lookups that found an entry
+        self.misses = number of lookups that didn't find an entry
+    '''
+
+    def __init__(self, maxsize=1024, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''
+        Returns the cached source for key or None if there is none.
+        '''
+        with self._lock:
+            source = self._entries.pop(key, None)
+            if source is not None:
+                self._entries[key] = source
+        if source is None and self.directory is not None:
+            source = self._read(key)
+            if source is not None:
+                self._remember(key, source)
+        with self._lock:
+            if source is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return source
+
+    def put(self, key, source):
+        '''
+        Stores source for key.
+        '''
+        self._remember(key, source)
+        if self.directory is not None:
+            self._write(key, source)
+
+    def clear(self):
+        '''
+        Removes all entries held in memory. Entries on disk are kept.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, source):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = source
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Entries are spread over subdirectories named after the first two
+    # characters of the key to keep directory listings short
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.py')
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read().decode('utf8', 'surrogatepass')
+        except (IOError, OSError):
+            return None
+
+    # Write to a temporary file first and rename it into place so that
+    # concurrent readers never see a partially written entry
+    def _write(self, key, source):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        fd, temp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(source.encode('utf8', 'surrogatepass'))
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
@@ -0,0 +1,241 @@
+'''
+codediff.diff(path_a, path_b)
+    Compare two *.pyc files code object by code object and return a
+    codediff.Diff. Also available as unwind.diff(). Code objects are
+    matched by qualified name (see disasm.walk()) and compared by the hash
+    of their normalized opcodes, and only the ones that differ get an
+    opcode level diff. The files may come from different Python versions
+    since opcodes are compared by their normalized names (see op.opcodes).
+
+        d = unwind.diff('build-1/app.pyc', 'build-2/app.pyc')
+        print(d.changed_names())
+        print(d.format())
+
+codediff.Diff
+    The differences between two files.
+
+        self.added = qualified names only found in the second file
+        self.removed = qualified names only found in the first file
+        self.renamed = list of (old name, new name) for code objects that
+                       moved without changing
+        self.changed = list of codediff.CodeDiff instances
+        self.unchanged = number of code objects that are the same
+
+codediff.CodeDiff
+    The opcode level differences of one code object. self.opcodes is a list
+    of (tag, old instructions, new instructions) tuples where tag is one of
+    'equal', 'replace', 'delete' and 'insert' as in difflib.
+
+codediff.normalize(code, magic)
+    Returns the instructions of a disasm.CodeObject from a *.pyc file with
+    the given magic number as a list of strings that don't depend on
+    bytecode offsets, line numbers or the bytecode values of a Python
+    version. Jump targets become labels such as "L2:" that are numbered in
+    the order they appear, arguments are replaced with the names and
+    constants they refer to, CACHE entries are left out, and nested code
+    objects are referred to by name so a change inside a nested function
+    doesn't show up in the function that defines it.
+'''
+
+import difflib
+import hashlib
+from bisect import bisect_left
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+def diff(path_a, path_b):
+    '''
+    Compare the *.pyc files at path_a and path_b and return a codediff.Diff.
+    '''
+    result = Diff()
+
+    # Files that only differ in their header (a timestamp or source size)
+    # only need to be disassembled once to count their code objects
+    with open(path_a, 'rb') as f:
+        data_a = f.read()
+    with open(path_b, 'rb') as f:
+        data_b = f.read()
+    a = disasm.disassemble_bytes(data_a, columnar=True)
+    start = op.header_size(a.magic)
+    if data_a[:4] == data_b[:4] and data_a[start:] == data_b[start:]:
+        result.unchanged = sum(1 for _ in disasm.walk(a.body))
+        return result
+    b = disasm.disassemble_bytes(data_b, columnar=True)
+
+    old = _Side(a.body, a.magic)
+    new = _Side(b.body, b.magic)
+    removed = [key for key in old.keys if key not in new.codes]
+    added = [key for key in new.keys if key not in old.codes]
+
+    for key in old.keys:
+        if key not in new.codes:
+            continue
+        if old.digest(key) == new.digest(key):
+            result.unchanged += 1
+        else:
+            result.changed.append(CodeDiff(_name(key), old.codes[key], new.codes[key],
+                                           old.instructions(key), new.instructions(key)))
+
+    # A code object that disappeared under one name and appeared unchanged
+    # under another was renamed (or moved into a different class)
+    by_digest = {}
+    for key in added:
+        by_digest.setdefault(new.digest(key), []).append(key)
+    for key in removed:
+        candidates = by_digest.get(old.digest(key))
+        if candidates:
+            match = candidates.pop(0)
+            result.renamed.append((_name(key), _name(match)))
+            added.remove(match)
+        else:
+            result.removed.append(_name(key))
+    result.added = [_name(key) for key in added]
+    return result
+
+# Opcodes that don't do anything. SET_LINENO only carries line numbers and
+# CACHE (Python 3.11 and later) reserves room for the interpreter's inline
+# caches after some opcodes.
+_IGNORED = frozenset(op.opcode_ids[name] for name in ['SET_LINENO', 'CACHE'] if name in op.opcode_ids)
+
+def normalize(code, magic):
+    '''
+    Returns the instructions of code, from a *.pyc file with the given magic
+    number, as a list of strings that don't depend on bytecode offsets, line
+    numbers or the Python version.
+    '''
+    opcodes = [o for o in code.opcodes if o.opcode not in _IGNORED]
+    offsets = [o.offset for o in opcodes]
+    flags_table = op.flags_table(magic)
+
+    # Parameters are compared too since they aren't part of the bytecode
+    count = (code.co_argcount or 0) + (code.co_kwonlyargcount or 0)
+    count += bool((code.co_flags or 0) & 4) + bool((code.co_flags or 0) & 8)
+    result = ['ARGUMENTS (%s)' % ', '.join(code.co_varnames[:count])]
+
+    # Jumps refer to labels numbered in the order of their targets, so code
+    # that's inserted without adding jump targets doesn't change any jump,
+    # not even the ones that jump over it
+    targets = {}
+    for i, o in enumerate(opcodes):
+        flags = flags_table[o.opcode]
+        if flags & op.IS_JUMP:
+            targets[i] = bisect_left(offsets, op.jump_target(magic, o.opcode, o.offset, o.size, o.argument))
+    labels = dict((target, 'L%d' % (n + 1)) for n, target in enumerate(sorted(set(targets.values()))))
+
+    for i, o in enumerate(opcodes):
+        flags = flags_table[o.opcode]
+        if i in labels:
+            result.append(labels[i] + ':')
+        if i in targets:
+            argument = labels[targets[i]]
+        elif isinstance(o.argument, disasm.CodeObject):
+            argument = '<code %s>' % o.argument.co_name
+        elif not flags & op.HAS_ARGUMENT:
+            result.append(op.opcode_names[o.opcode])
+            continue
+        else:
+            argument = repr(o.argument)
+        result.append('%s %s' % (op.opcode_names[o.opcode], argument))
+    if len(opcodes) in labels:
+        result.append(labels[len(opcodes)] + ':')
+    return result
+
+class Diff:
+    '''
+    The differences between two *.pyc files, see the module documentation.
+    '''
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.renamed = []
+        self.changed = []
+        self.unchanged = 0
+
+    def changed_names(self):
+        '''
+        Returns the qualified names of all code objects that were changed,
+        added or removed.
+        '''
+        return sorted(set([c.qualname for c in self.changed] + self.added + self.removed))
+
+    def format(self, context=3):
+        '''
+        Returns a readable description of all differences with context
+        instructions of context around each change.
+        '''
+        lines = []
+        lines += ['added %s' % name for name in self.added]
+        lines += ['removed %s' % name for name in self.removed]
+        lines += ['renamed %s -> %s' % pair for pair in self.renamed]
+        for c in self.changed:
+            lines.append(c.format(context))
+        return '\n'.join(lines)
+
+class CodeDiff:
+    '''
+    The opcode level differences of one code object.
+
+        self.qualname = qualified name of the code object
+        self.old_line = first line of the code object in the first file
+        self.new_line = first line of the code object in the second file
+        self.opcodes = list of (tag, old instructions, new instructions)
+                       tuples, tag is 'equal', 'replace', 'delete' or
+                       'insert' and instructions are lists of strings
+    '''
+
+    def __init__(self, qualname, old, new, old_instructions, new_instructions):
+        self.qualname = qualname
+        self.old_line = old.co_firstlineno
+        self.new_line = new.co_firstlineno
+        matcher = difflib.SequenceMatcher(None, old_instructions, new_instructions, autojunk=False)
+        self.opcodes = [(tag, old_instructions[i1:i2], new_instructions[j1:j2])
+                        for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+
+    def format(self, context=3):
+        lines = ['changed %s (line %s -> %s)' % (self.qualname or '<module>', self.old_line, self.new_line)]
+        last = len(self.opcodes) - 1
+        for index, (tag, old, new) in enumerate(self.opcodes):
+            if tag == 'equal':
+                head = old[:context] if index > 0 else []
+                tail = old[-context:] if index < last and context else []
+                if len(head) + len(tail) < len(old):
+                    lines += ['    ' + i for i in head] + ['    ...'] + ['    ' + i for i in tail]
+                else:
+                    lines += ['    ' + i for i in old]
+            else:
+                lines += ['  - ' + i for i in old] + ['  + ' + i for i in new]
+        return '\n'.join(lines)
+
+# Code objects are keyed by qualified name and how many code objects with the
+# same name came before them, since a name can be defined more than once
+def _name(key):
+    return key[0]
+
+# The code objects of one side of the comparison with their normalized
+# instructions and digests, which are computed on demand
+class _Side:
+    def __init__(self, body, magic):
+        self.magic = magic
+        self.keys = []
+        self.codes = {}
+        seen = {}
+        for qualname, co in disasm.walk(body):
+            key = (qualname, seen.get(qualname, 0))
+            seen[qualname] = key[1] + 1
+            self.keys.append(key)
+            self.codes[key] = co
+        self._instructions = {}
+        self._digests = {}
+
+    def instructions(self, key):
+        if key not in self._instructions:
+            self._instructions[key] = normalize(self.codes[key], self.magic)
+        return self._instructions[key]
+
+    def digest(self, key):
+        if key not in self._digests:
+            text = '\n'.join(self.instructions(key))
+            self._digests[key] = hashlib.sha1(text.encode('utf8', 'surrogatepass')).hexdigest()
+        return self._digests[key]
@@ -1,16 +1,109 @@
 from unwind.ast import *
+from io import StringIO
+import unwind.op as op
 
 # Helper function to indent a chunk of text
 def _indent(text, indent):
     return '\n'.join(indent + line for line in text.split('\n'))
 
-# A node visitor that generates Python source code
+# Python 3.11 and later refuse to convert ints with more than 4300 digits to
+# decimal, but hexadecimal has no limit
+def _repr_const(value):
+    try:
+        return repr(value)
+    except ValueError:
+        if isinstance(value, int):
+            return hex(value)
+        elif isinstance(value, tuple):
+            items = [_repr_const(v) for v in value]
+            return '(%s,)' % items[0] if len(items) == 1 else '(%s)' % ', '.join(items)
+        raise
+
+# A node visitor that generates Python source code. Statements (blocks, if
+# statements and comments) can also be streamed to a file-like sink with
+# write(), which emits every line once at its final indentation instead of
+# re-indenting the text of nested blocks once per nesting level. The string
+# returning visit methods for statements are thin wrappers around that.
 class SourceCodeGenerator:
     def __init__(self, indent='    '):
         self.indent = indent
+        self._source_map = None
+
+    def write(self, node, sink, source_map=None):
+        '''
+        Write the source code for node to sink, an object with a write()
+        method such as an open text file. Every line ends with a newline.
+        If source_map is a sourcemap.SourceMap, the bytecode range of every
+        statement with a span is recorded in it by output line.
+        '''
+        if source_map is None:
+            self._write(node, sink, 0, '')
+            return
+        self._source_map = source_map
+        try:
+            self._write(node, _LineCounter(sink), 0, '')
+        finally:
+            self._source_map = None
+
+    # Render a statement to a string using the streaming writer. Blocks that
+    # are rendered as part of an expression aren't part of the source map.
+    def _render(self, node):
+        sink = StringIO()
+        source_map, self._source_map = self._source_map, None
+        try:
+            self._write(node, sink, 0, '')
+        finally:
+            self._source_map = source_map
+        return sink.getvalue()[:-1]
+
+    # Write node at the given nesting depth. The prefix is inserted before
+    # the first line, which is how "elif" is formed from "el" and "if".
+    def _write(self, node, sink, depth, prefix):
+        writer = getattr(self, '_write_' + node.__class__.__name__, None)
+        if writer:
+            writer(node, sink, depth, prefix)
+        else:
+            indent = self.indent * depth
+            for line in (prefix + node.accept(self)).split('\n'):
+                sink.write(indent + line + '\n')
+
+    def _write_Block(self, node, sink, depth, prefix):
+        if not node.nodes:
+            sink.write(self.indent * depth + prefix + '\n')
+        source_map = self._source_map
+        for n in node.nodes:
+            if source_map is not None and n.span is not None:
+                first = sink.lines + 1
+                self._write(n, sink, depth, prefix)
+                source_map.add(first, sink.lines, n.span)
+            else:
+                self._write(n, sink, depth, prefix)
+            prefix = ''
+
+    def _write_Asm(self, node, sink, depth, prefix):
+        self._write_Block(node, sink, depth, prefix)
+
+    def _write_If(self, node, sink, depth, prefix):
+        sink.write('%s%sif %s:\n' % (self.indent * depth, prefix, node.cond.accept(self)))
+        self._write(node.true, sink, depth + 1, '')
+        if node.false:
+            self._write(node.false, sink, depth, 'el' if isinstance(node.false, If) else '')
+
+    def _write_Else(self, node, sink, depth, prefix):
+        sink.write('%s%selse:\n' % (self.indent * depth, prefix))
+        self._write(node.body, sink, depth + 1, '')
+
+    def _write_Comment(self, node, sink, depth, prefix):
+        indent = self.indent * depth
+        for line in node.value.split('\n'):
+            sink.write(indent + prefix + '# ' + line + '\n')
+            prefix = ''
 
     def visit_Block(self, node):
-        return '\n'.join(n.accept(self) for n in node.nodes)
+        return self._render(node)
+
+    def visit_Asm(self, node):
+        return self._render(node)
 
     def visit_Tuple(self, node):
         if len(node.nodes) == 1: return '(%s,)' % node.nodes[0].accept(self)
@@ -36,10 +129,10 @@ class SourceCodeGenerator:
         return '%s: %s' % (node.key.accept(self), node.value.accept(self))
 
     def visit_Opcode(self, node):
-        return '__asm__(%s, %s, %s, %s)' % (repr(node.offset), repr(node.size), repr(node.op), repr(node.arg))
+        return '__asm__(%s, %s, %s, %s)' % (repr(node.offset), repr(node.size), repr(op.opcode_names[node.op]), repr(node.arg))
 
     def visit_Const(self, node):
-        return repr(node.value)
+        return _repr_const(node.value)
 
     def visit_Docstr(self, node):
         return "'''%s'''" % node.value.replace("'''", r"\'\'\'")
@@ -60,17 +153,10 @@ class SourceCodeGenerator:
         return 'return ' + node.child.accept(self) if node.child else 'return'
 
     def visit_If(self, node):
-        text = 'if %s:\n%s' % (
-            node.cond.accept(self),
-            _indent(node.true.accept(self), self.indent),
-        )
-        if node.false:
-            text += '\n' + ('el' if isinstance(node.false, If) else '')
-            text += node.false.accept(self)
-        return text
+        return self._render(node)
 
     def visit_Else(self, node):
-        return 'else:\n' + _indent(node.body.accept(self), self.indent)
+        return self._render(node)
 
     def visit_Unary(self, node):
         assert node.op in Unary.ops
@@ -122,3 +208,13 @@ class SourceCodeGenerator:
             node.left.accept(self),
             node.right.value,
         )
+
+# Wraps a sink and counts the lines written to it, used for source maps
+class _LineCounter:
+    def __init__(self, sink):
+        self.sink = sink
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+        self.sink.write(text)
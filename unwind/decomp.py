@@ -1,15 +1,120 @@
-from unwind.disasm import disassemble
+from io import StringIO
+from fnmatch import fnmatchcase
+from unwind.disasm import disassemble, Module, CodeObject, DisassemblerException
+from unwind.passmanager import PassManager, PassRecord
+import unwind.instrument as instrument
 import unwind.codegen as codegen
 import unwind.passes as passes
 
-def decompile(path):
-    passes_to_run = [
-        passes.CodeObjectsToNodes(),
-        passes.ComputeBasicBlocks(),
-        passes.DecompileControlStructures(),
-    ]
-    result = disassemble(path)
-    for p in passes_to_run:
-        result = p.run(result)
-    result = passes.Context().decompile(result)
-    return result.accept(codegen.SourceCodeGenerator())
+def decompile(path, cache=None, report=None, source_map=None, budget=None, select=None):
+    '''
+    Decompile the *.pyc file at path and return the Python source code as a
+    string. If cache is a cache.DecompileCache, the source of every code
+    object that's decompiled is memoized in it by the code object's
+    fingerprint, so it's shared by every file with an identical copy of that
+    code object. Without select, that's the module's code object, whose
+    output includes the code objects nested in it. With select, each
+    selected code object is looked up on its own, so a function that's
+    selected from two files is only decompiled once. Nothing is cached
+    unless a cache is passed, and a cache can be shared by several calls
+    and threads. If report is a passmanager.PassReport, a record of every
+    pass that was run is appended to it. When the source of a code object
+    comes from the cache, no pass is run and report only gets a skipped
+    record named "DecompileCache". If source_map is a sourcemap.SourceMap,
+    it's filled in with the bytecode offsets and original line numbers of
+    the output lines (the cache is only written to in that case, since it
+    doesn't store source maps). If budget is a budget.Budget, code objects
+    that exceed it are emitted as __asm__() calls and appended to
+    budget.exceeded, and output that fell back to them isn't cached.
+
+    If select is given, only the code objects it selects are decompiled,
+    each under a comment with its qualified name (see disasm.walk()), and
+    the rest are never decoded. select is a glob matched against qualified
+    names such as "Parser.*", a list of globs, or a function that's given a
+    disasm.CodeObject and returns True to select it. A selected code object
+    is decompiled with everything nested in it, and the code objects nested
+    in one that isn't selected are tested in turn. A selected code object
+    that the decompiler can't handle is emitted as __asm__() calls under a
+    comment with the error, and the others are still decompiled. Can't be
+    combined with source_map.
+    '''
+    with instrument.phase('decompile'):
+        if select is None:
+            return _decompile(disassemble(path), cache, report, source_map, budget)
+        if source_map is not None:
+            raise ValueError('source_map cannot be combined with select')
+        module = disassemble(path, lazy=True)
+        sources = []
+        for qualname, code in _select(module.body, select):
+            selected = Module(module.magic, module.timestamp, module.python_version, code)
+            try:
+                source = _decompile(selected, cache, report, None, budget)
+            except DisassemblerException:
+                raise
+            except Exception as e:
+                source = passes.as_asm(code, 'cannot decompile (%s: %s)' % (e.__class__.__name__, e)).accept(
+                    codegen.SourceCodeGenerator())
+            sources.append('# %s\n%s' % (qualname or '<module>', source))
+        return '\n\n'.join(sources)
+
+# Decompile a module whose body is the code object to decompile, which is
+# looked up in cache by its own fingerprint. The magic number is part of the
+# key since the same bytecode means different things to different versions.
+def _decompile(module, cache, report, source_map, budget):
+    key = None
+    if cache is not None:
+        key = '%s-%08x' % (module.body.fingerprint(), module.magic)
+        source = cache.get(key) if source_map is None else None
+        if source is not None:
+            if report is not None:
+                record = PassRecord('DecompileCache', None, 1)
+                record.skipped = True
+                report.records.append(record)
+            return source
+
+    context = passes.Context(report, budget, module.magic)
+    result = PassManager(passes.FRONTEND_PIPELINE, report).run(module, context)
+    result = context.decompile(result)
+    with instrument.phase('codegen'):
+        if source_map is None:
+            source = result.accept(codegen.SourceCodeGenerator())
+        else:
+            if source_map.code is None:
+                source_map.code = module.body
+            sink = StringIO()
+            codegen.SourceCodeGenerator().write(result, sink, source_map)
+            source = sink.getvalue()[:-1]
+
+    # Output that fell back to bytecode isn't what an unlimited run returns
+    if cache is not None and not (context.meter and context.meter.exceeded):
+        cache.put(key, source)
+    return source
+
+# Returns (qualname, code object) pairs for the outermost code objects under
+# code that select matches, in the order of disasm.walk(). Only co_consts is
+# looked at on the way, so the opcodes of code objects that aren't selected
+# are never decoded.
+def _select(code, select):
+    if isinstance(select, str):
+        select = [select]
+    if not callable(select):
+        patterns = list(select)
+        select = lambda co, qualname: any(fnmatchcase(qualname, pattern) for pattern in patterns)
+    else:
+        predicate = select
+        select = lambda co, qualname: predicate(co)
+
+    result = []
+    pending = [('', code)]
+    while pending:
+        qualname, co = pending.pop()
+        if select(co, qualname):
+            result.append((qualname, co))
+            continue
+        children = []
+        for value in co.co_consts or ():
+            if isinstance(value, CodeObject):
+                name = '%s.%s' % (qualname, value.co_name) if qualname else value.co_name
+                children.append((name, value))
+        pending += reversed(children)
+    return result
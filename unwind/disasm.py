@@ -1,13 +1,85 @@
 '''
-disasm.disassemble(path)
+disasm.disassemble(path, columnar=False, lazy=False)
     Disassemble a python module from a *.pyc file. Returns a disasm.Module with
     the disassembly or raises a disasm.DisassemblerException if there was an
-    error.
+    error. If columnar is True, opcodes are stored in disasm.OpcodeColumns.
+    If lazy is True, the bytecode of a code object is only decoded into
+    opcodes the first time its opcodes attribute is used, so code objects
+    that are never looked at cost no more than unmarshalling them. Invalid
+    bytecode then raises disasm.DisassemblerException at that point.
+
+    Files from Python 2 up to Python 3.5 can be read by any version of
+    Python. Wordcode (Python 3.6 and later) can only be read by the version
+    of Python that wrote it, since its opcodes come from the running
+    interpreter's opcode module. Wordcode from another version raises
+    disasm.DisassemblerException.
+
+disasm.disassemble_file(file, columnar=False, lazy=False)
+disasm.disassemble_bytes(data, columnar=False, lazy=False)
+    The same for an open binary file object or the contents of a *.pyc file
+    in memory.
+
+disasm.disassemble_archive(archive, columnar=False)
+    Iterates over (name, module) pairs for the *.pyc files in a zip archive
+    (including wheels and eggs) or a tar archive (including container image
+    layers), without extracting them to disk. Every member shares the same
+    decode table for its magic number (see op.decode_table()).
+
+disasm.disassemble_batch(paths, columnar=False, workers=8)
+    Iterates over (path, module) pairs for many *.pyc files, disassembled
+    by a pool of threads. Nothing in the disassembler is shared between
+    files except read-only tables, so any number of files can be
+    disassembled at once. On a free-threaded build of Python (PEP 703) the
+    threads run in parallel, otherwise benchmarks.threads shows how they
+    compare with processes.
 
 disasm.Module, disasm.CodeObject, disasm.Opcode
     Used to represent the disassembled module. Constant values are
     represented using native Python objects.
 
+disasm.OpcodeColumns
+    A compact alternative to a list of disasm.Opcode instances that stores
+    offsets, sizes, opcode ids (see op.OpcodeId) and raw arguments in
+    arrays, about a dozen bytes per opcode. It behaves like a read-only
+    sequence of disasm.Opcode, which are created when they're accessed.
+
+disasm.CodeObject.fingerprint()
+    Returns a stable hex digest of a code object's bytecode, constants,
+    names and variable names, including those of nested code objects.
+    Identical code bodies have identical fingerprints across modules.
+
+disasm.CodeObject.line_table()
+    Returns the decoded co_lnotab (or co_linetable in Python 3.10 and later)
+    of a code object as a disasm.LineTable, which is built on first use and
+    then remembered.
+
+disasm.LineTable
+    Sorted arrays of the bytecode offsets where each source line starts.
+    line_for_offset(offset) finds the line of an opcode by binary search
+    and ranges() iterates over (start, end, line) tuples.
+
+disasm.walk(code)
+    Iterates over (qualname, code object) pairs for code, a disasm.CodeObject,
+    and every code object nested in its constants. Qualified names are the
+    dotted co_name of each enclosing code object below the module, so a
+    method is "Class.method" and the module itself is "".
+
+disasm.deref_names(code)
+    Returns the tuple of cell and free variable names that the argument of
+    LOAD_DEREF and the other opcodes using those variables indexes into. In
+    Python 3.11 and later this index counts the local variables too.
+
+disasm.unpack_header(data)
+    Returns (magic, flags, timestamp, source size, source hash) from the
+    header of a *.pyc file, with None for the fields it doesn't have.
+
+disasm.is_compiled(name)
+    Returns True if a file name ends in .pyc or .pyo.
+
+disasm.resolve_argument(co, opcode, argument)
+    Returns the value of a raw argument of an opcode in co, as stored in
+    disasm.OpcodeColumns, the way it appears in disasm.Opcode.argument.
+
 disasm.DisassemblerException
     Thrown by disasm.disassemble() when there was a problem with the
     disassembly. Apply str() to an exception to get a detailed description
@@ -15,17 +87,101 @@ disasm.DisassemblerException
 '''
 
 import unwind.op as op
+import unwind.instrument as instrument
+import io
 import sys
+import platform
+import collections
+import threading
 import time
 import struct
+import hashlib
+from array import array
+from bisect import bisect_right
+from itertools import compress
+
+def disassemble(path, columnar=False, lazy=False):
+    '''
+    Disassemble a python module from the *.pyc file at path. Returns a
+    disasm.Module with the disassembly or raises a
+    disasm.DisassemblerException if there was an error. If columnar is
+    True, the opcodes of every code object are stored in a
+    disasm.OpcodeColumns instead of a list. If lazy is True, opcodes are
+    decoded when they're first used.
+    '''
+    with open(path, 'rb') as file:
+        return disassemble_file(file, columnar, lazy)
 
-def disassemble(path):
+def disassemble_file(file, columnar=False, lazy=False):
     '''
-    Disassemble a python module from file_object, an open file object
-    containing a *.pyc file. Returns a disasm.Module with the disassembly
-    or raises a disasm.DisassemblerException if there was an error.
+    Like disasm.disassemble() but reads from file, a binary file object
+    positioned at the start of a *.pyc file. The file isn't closed.
     '''
-    return _Disassembler().disassemble(open(path, 'rb'))
+    with instrument.phase('disassemble'):
+        return _Disassembler(columnar, lazy).disassemble(file)
+
+def disassemble_bytes(data, columnar=False, lazy=False):
+    '''
+    Like disasm.disassemble() but reads the contents of a *.pyc file from
+    data, a bytes-like object.
+    '''
+    return disassemble_file(io.BytesIO(data), columnar, lazy)
+
+def disassemble_archive(archive, columnar=False):
+    '''
+    Iterates over (name, module) pairs for every *.pyc and *.pyo member of
+    archive, a zip file (including wheels and eggs) or a tar file that may
+    be compressed, given as a path or a binary file object. Members are
+    read into memory and disassembled without temporary files. Members that
+    can't be read or disassembled produce a disasm.DisassemblerException in
+    place of the module so one bad member doesn't stop the walk. A file
+    that isn't a zip or tar archive, or a tar archive that's cut short,
+    raises disasm.DisassemblerException.
+    '''
+    for name, data in _archive_members(archive):
+        if isinstance(data, DisassemblerException):
+            yield name, data
+        else:
+            yield name, _disassemble_or_error(disassemble_bytes, data, columnar)
+
+def disassemble_batch(paths, columnar=False, workers=8):
+    '''
+    Iterates over (path, module) pairs for the *.pyc files at paths,
+    disassembled by a pool of workers threads. Pairs come out in the order
+    of paths and only a few files per thread are disassembled ahead of the
+    consumer. Files that can't be disassembled or read produce a
+    disasm.DisassemblerException in place of the module.
+    '''
+    # Imported here, like tarfile and zipfile below, so that disassembling a
+    # single file doesn't pay for loading them
+    import concurrent.futures
+    paths = iter(paths)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        try:
+            for path in paths:
+                pending.append((path, pool.submit(_disassemble_or_error, disassemble, path, columnar)))
+                if len(pending) >= workers * 2:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+        finally:
+            for path, future in pending:
+                future.cancel()
+
+# Returns disassemble(source, columnar) or the exception that describes why
+# it failed, for the functions that disassemble many files
+def _disassemble_or_error(disassemble, source, columnar):
+    try:
+        return disassemble(source, columnar)
+    except DisassemblerException as e:
+        return e
+    except (struct.error, ValueError, IndexError, EOFError) as e:
+        return DisassemblerException('%s: %s' % (e.__class__.__name__, e))
+    except OSError as e:
+        return DisassemblerException('%s: %s' % (e.__class__.__name__, e.strerror))
 
 class DisassemblerException(Exception):
     '''
@@ -40,7 +196,7 @@ class Opcode:
 
         self.offset = number of bytes from start of code object
         self.size = number of bytes used by this opcode
-        self.opcode = string with opcode name
+        self.opcode = opcode, see op.OpcodeId
         self.argument = Python object with argument, will be None for
                         opcodes without arguments
     '''
@@ -52,18 +208,25 @@ class Opcode:
         self.argument = argument
 
     def __repr__(self):
-        return 'Opcode(offset = %s, size = %s, opcode = %s, argument = %s)' % (repr(self.offset), repr(self.size), repr(self.opcode), repr(self.argument))
+        return self._repr(0)
+
+    # The representation at a nesting depth of depth, which only matters for
+    # a code object in the argument
+    def _repr(self, depth):
+        argument = self.argument._repr(depth) if isinstance(self.argument, CodeObject) else repr(self.argument)
+        return 'Opcode(offset = %s, size = %s, opcode = %s, argument = %s)' % (repr(self.offset), repr(self.size), repr(op.opcode_names[self.opcode]), argument)
 
 class CodeObject:
     '''
     Represents a disassembled Python code object.
 
         self.co_argcount = number of arguments (not including * or ** args)
+        self.co_posonlyargcount = number of positional-only arguments
         self.co_kwonlyargcount = number of keyword arguments
         self.co_nlocals = number of local variables
         self.co_stacksize = virtual machine stack space required
         self.co_flags = bitmap: 1=optimized | 2=newlocals | 4=*arg | 8=**arg
-        self.co_code = list of raw compiled bytecode
+        self.co_code = bytes of raw compiled bytecode
         self.co_consts = tuple of constants used in the bytecode
         self.co_names = tuple of names of local variables
         self.co_varnames = tuple of names of arguments and local variables
@@ -71,16 +234,23 @@ class CodeObject:
         self.co_cellvars = tuple of names of variables used by child scopes
         self.co_filename = file in which this code object was created
         self.co_name = name with which this code object was defined
+        self.co_qualname = qualified name (Python 3.11 and later)
         self.co_firstlineno = number of first line in Python source code
         self.co_lnotab = encoded mapping of line numbers to bytecode indices
-        self.opcodes = list of disasm.Opcode instances
+        self.co_linetable = line number table that replaces co_lnotab in
+                            Python 3.10 and later, in a different format
+        self.co_exceptiontable = encoded exception handler ranges (Python
+                                 3.11 and later)
+        self.opcodes = list of disasm.Opcode instances or disasm.OpcodeColumns
     '''
 
     def __init__(self, co_argcount=None, co_kwonlyargcount=None, co_nlocals=None, co_stacksize=None,
                  co_flags=None, co_code=None, co_consts=None, co_names=None, co_varnames=None,
                  co_freevars=None, co_cellvars=None, co_filename=None, co_name=None,
-                 co_firstlineno=None, co_lnotab=None, opcodes=None):
+                 co_firstlineno=None, co_lnotab=None, opcodes=None, co_posonlyargcount=None,
+                 co_qualname=None, co_linetable=None, co_exceptiontable=None):
         self.co_argcount = co_argcount
+        self.co_posonlyargcount = co_posonlyargcount
         self.co_kwonlyargcount = co_kwonlyargcount
         self.co_nlocals = co_nlocals
         self.co_stacksize = co_stacksize
@@ -93,29 +263,382 @@ class CodeObject:
         self.co_cellvars = co_cellvars
         self.co_filename = co_filename
         self.co_name = co_name
+        self.co_qualname = co_qualname
         self.co_firstlineno = co_firstlineno
         self.co_lnotab = co_lnotab
+        self.co_linetable = co_linetable
+        self.co_exceptiontable = co_exceptiontable
         self.opcodes = opcodes if opcodes else []
+        self._fingerprint = None
+        self._line_table = None
+
+    # Only called for code objects disassembled with lazy=True, whose opcodes
+    # are decoded here the first time they're used. Threads that ask at the
+    # same time wait for the first one to finish decoding.
+    def __getattr__(self, name):
+        if name != 'opcodes':
+            raise AttributeError(name)
+        with _decode_lock:
+            decoder = self.__dict__.get('_decoder')
+            if decoder is not None:
+                decoder.decode(self)
+                del self._decoder
+        try:
+            return self.__dict__['opcodes']
+        except KeyError:
+            raise AttributeError(name)
+
+    def fingerprint(self):
+        '''
+        Returns a stable hex digest of co_code, co_consts, co_names and
+        co_varnames. Nested code objects in co_consts contribute their own
+        fingerprint, so two code objects have the same fingerprint exactly
+        when their bodies are identical. The result is computed once and
+        then remembered.
+        '''
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            h.update(bytearray(self.co_code or []))
+            for field in [self.co_consts, self.co_names, self.co_varnames]:
+                _hash_value(h, field)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def line_table(self):
+        '''
+        Returns a disasm.LineTable with the decoded co_lnotab or
+        co_linetable. The table is built the first time it's asked for and
+        then remembered.
+        '''
+        if self._line_table is None:
+            self._line_table = LineTable(self)
+        return self._line_table
 
     def __repr__(self):
-        global _indent
+        return self._repr(0)
+
+    # The representation nested depth levels deep. The depth is passed along
+    # instead of kept in a global so representations can be built in several
+    # threads at once.
+    def _repr(self, depth):
         result = 'CodeObject(\n'
-        _indent += 1
-        indent = _indent * _INDENT
+        indent = (depth + 1) * _INDENT
         for f in ['co_argcount', 'co_kwonlyargcount', 'co_nlocals', 'co_stacksize',
                   'co_flags', 'co_filename', 'co_name', 'co_firstlineno']:
             result += indent + f + ' = %s,\n' % repr(getattr(self, f))
-        _indent += 1
-        result += indent + 'opcodes = [%s])' % ','.join('\n' + _indent * _INDENT + repr(o) for o in self.opcodes)
-        _indent -= 2
+        result += indent + 'opcodes = [%s])' % ','.join('\n' + (depth + 2) * _INDENT + o._repr(depth + 2) for o in self.opcodes)
         return result + ')'
 
+# Yields (name, contents) for the compiled members of archive, with a
+# DisassemblerException as the contents of a zip member that can't be read.
+# The members of a tar archive are read one after another from a stream that
+# may be compressed, so there's no going on after one of them fails.
+def _archive_members(archive):
+    import tarfile, zipfile, zlib
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if is_compiled(info.filename):
+                    try:
+                        data = z.read(info)
+                    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError) as e:
+                        data = DisassemblerException('%s: %s' % (e.__class__.__name__, e))
+                    yield info.filename, data
+        return
+    try:
+        if not isinstance(archive, str):
+            archive.seek(0)
+            tar = tarfile.open(fileobj=archive)
+        else:
+            tar = tarfile.open(archive)
+    except tarfile.ReadError:
+        raise DisassemblerException('Not a zip or tar archive')
+    with tar:
+        try:
+            for info in tar:
+                if info.isfile() and is_compiled(info.name):
+                    yield info.name, tar.extractfile(info).read()
+        except (tarfile.TarError, zlib.error, EOFError) as e:
+            raise DisassemblerException('Cannot read the rest of the archive: %s: %s' % (e.__class__.__name__, e))
+
+def is_compiled(name):
+    '''
+    Returns True if name ends in .pyc or .pyo.
+    '''
+    return name.endswith('.pyc') or name.endswith('.pyo')
+
+def walk(code):
+    '''
+    Iterates over (qualname, code object) pairs for code and all code
+    objects nested in its constants, parents before children.
+    '''
+    pending = [('', code)]
+    while pending:
+        qualname, co = pending.pop()
+        yield qualname, co
+        children = []
+        for value in co.co_consts or ():
+            if isinstance(value, CodeObject):
+                name = '%s.%s' % (qualname, value.co_name) if qualname else value.co_name
+                children.append((name, value))
+        pending += reversed(children)
+
+def deref_names(code):
+    '''
+    Returns the names indexed by the argument of LOAD_DEREF, STORE_DEREF and
+    the other opcodes using cell and free variables in code.
+    '''
+    cellvars = tuple(code.co_cellvars or ())
+    freevars = tuple(code.co_freevars or ())
+    # Only code objects of Python 3.11 and later have an exception table.
+    # Their arguments are indices into co_localsplusnames, which
+    # _split_localsplus() split into locals, cells and free variables, with
+    # cells that are also arguments in both of the first two.
+    if code.co_exceptiontable is None:
+        return cellvars + freevars
+    varnames = tuple(code.co_varnames or ())
+    return varnames + tuple(name for name in cellvars if name not in varnames) + freevars
+
+class OpcodeColumns:
+    '''
+    The opcodes of a code object stored as columns of integers. Indexing and
+    iterating produce disasm.Opcode instances with the arguments looked up
+    in the code object.
+
+        self.code = disasm.CodeObject the opcodes belong to
+        self.offsets = array of offsets from the start of the code object
+        self.sizes = array of the number of bytes used by each opcode
+        self.ids = array of op.OpcodeId values
+        self.arguments = array of raw arguments, which are indices into
+                         co_consts, co_names or co_varnames for opcodes that
+                         refer to those and 0 for opcodes without arguments
+    '''
+
+    def __init__(self, code):
+        self.code = code
+        self.offsets = array('I')
+        self.sizes = array('B')
+        self.ids = array(_ID_TYPECODE)
+        self.arguments = array('I')
+
+    def append(self, offset, size, opcode, argument):
+        '''
+        Add an opcode given its value and raw argument (None if it has none).
+        '''
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.ids.append(opcode)
+        self.arguments.append(argument or 0)
+
+    def extend(self, offsets, sizes, ids, arguments):
+        '''
+        Add many opcodes at once given sequences of integers of equal length.
+        '''
+        self.offsets.extend(offsets)
+        self.sizes.extend(sizes)
+        self.ids.extend(ids)
+        self.arguments.extend(arguments)
+
+    def opcode(self, index):
+        '''
+        Returns the opcode at index without creating an Opcode.
+        '''
+        return self.ids[index]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        opcode = self.ids[index]
+        argument = self.arguments[index] if op.opcode_flags[opcode] & op.HAS_ARGUMENT else None
+        return Opcode(self.offsets[index], self.sizes[index], opcode, resolve_argument(self.code, opcode, argument))
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+# Held while a lazily disassembled code object decodes its opcodes
+_decode_lock = threading.RLock()
+
+# The smallest array type that can hold every opcode id
+_ID_TYPECODE = 'B' if len(op.opcode_names) <= 256 else 'H'
+
+def resolve_argument(co, opcode, argument):
+    '''
+    Returns the value of argument, the raw argument of opcode in co, which
+    is looked up in co_consts, co_names or co_varnames for opcodes that
+    refer to those. Raises disasm.DisassemblerException for an index past
+    the end of the table.
+    '''
+    if argument is None:
+        return None
+    flags = op.opcode_flags[opcode]
+    if opcode == op.LOAD_CONST:
+        table = co.co_consts
+    elif flags & op.USES_NAMES:
+        table = co.co_names
+    elif flags & op.USES_VARNAMES:
+        table = co.co_varnames
+    else:
+        return argument
+    if argument >= len(table):
+        raise DisassemblerException('Invalid argument %d for opcode %s' % (argument, op.opcode_names[opcode]))
+    return table[argument]
+
+# Returns the varint at data[i] and the index after it. Varints are stored in
+# 6-bit chunks, least significant first, with bit 6 set on every chunk but the
+# last.
+def _read_varint(data, i):
+    chunk = data[i]
+    value = chunk & 0x3F
+    shift = 0
+    while chunk & 0x40:
+        i += 1
+        chunk = data[i]
+        shift += 6
+        value |= (chunk & 0x3F) << shift
+    return value, i + 1
+
+class LineTable:
+    '''
+    The line number table of a code object, decoded into sorted arrays.
+    Bytecode that Python 3.10 and later don't give a line (code added by the
+    compiler, such as cleanup after an exception handler) belongs to the
+    line before it, as in the co_lnotab that those versions emulate.
+
+        self.offsets = array of the bytecode offsets where a line starts
+        self.lines = array of the line that starts at each of those offsets
+        self.size = number of bytes of bytecode
+    '''
+
+    def __init__(self, code):
+        self.size = len(code.co_code or [])
+        self.offsets = array('I', [0])
+        self.lines = array('I', [code.co_firstlineno or 0])
+
+        # Python 3.10 replaced co_lnotab with co_linetable, and Python 3.11
+        # changed its format again and added co_exceptiontable
+        if code.co_linetable is not None:
+            table = bytes(code.co_linetable)
+            if code.co_exceptiontable is not None:
+                self._decode_locations(table)
+            else:
+                self._decode_linetable(table)
+            return
+
+        table = code.co_lnotab or ''
+        if isinstance(table, str):
+            table = table.encode('latin-1')
+
+        # co_lnotab is a series of (offset increment, line increment) byte
+        # pairs. Line jumps of more than 255 are split over several pairs
+        # with no offset increment, so only the last line for an offset
+        # counts. Modules compiled before Python 2.3 without a table mark
+        # lines with SET_LINENO opcodes instead.
+        if table:
+            offset = 0
+            line = self.lines[0]
+            for offset_increment, line_increment in zip(table[0::2], table[1::2]):
+                offset += offset_increment
+                line += line_increment
+                self._add(offset, line)
+        else:
+            for o in code.opcodes:
+                if o.opcode == op.SET_LINENO:
+                    self._add(o.offset, o.argument)
+
+    # Decode the co_linetable of Python 3.10, a series of (offset increment,
+    # line increment) byte pairs where every pair is a range of bytecode. The
+    # line increment is signed and -128 marks a range without a line.
+    def _decode_linetable(self, table):
+        if len(table) % 2:
+            raise DisassemblerException('Line table has an odd length of %d bytes' % len(table))
+        offset = 0
+        line = self.lines[0]
+        for offset_increment, line_increment in zip(table[0::2], table[1::2]):
+            if line_increment != 0x80:
+                line += line_increment - 256 if line_increment > 0x80 else line_increment
+                if offset_increment and line != self.lines[-1]:
+                    self._add(offset, line)
+            offset += offset_increment
+
+    # Decode the location table of Python 3.11 and later. Every entry starts
+    # with a byte that has the high bit set, a 4-bit code for its form and
+    # the number of code units it covers minus one. The line increment is
+    # stored in the code for one-line forms and as a signed varint otherwise,
+    # followed by columns that aren't needed here (see Objects/locations.md
+    # in the CPython repository).
+    def _decode_locations(self, table):
+        offset = 0
+        line = self.lines[0]
+        i = 0
+        try:
+            while i < len(table):
+                first = table[i]
+                if not first & 0x80:
+                    raise DisassemblerException('Invalid location table entry at byte %d' % i)
+                form = (first >> 3) & 0x0F
+                i += 1
+                if form == 15:
+                    increment = None
+                elif form == 14 or form == 13:
+                    increment, i = _read_varint(table, i)
+                    increment = -(increment >> 1) if increment & 1 else increment >> 1
+                    if form == 14:
+                        for n in range(3):
+                            skipped, i = _read_varint(table, i)
+                elif form >= 10:
+                    increment = form - 10
+                    i += 2
+                else:
+                    increment = 0
+                    i += 1
+                if increment is not None:
+                    line += increment
+                    if line != self.lines[-1]:
+                        self._add(offset, line)
+                offset += ((first & 7) + 1) * 2
+        except IndexError:
+            raise DisassemblerException('Location table ends in the middle of an entry')
+
+    def _add(self, offset, line):
+        if offset == self.offsets[-1]:
+            self.lines[-1] = line
+        else:
+            self.offsets.append(offset)
+            self.lines.append(line)
+
+    def line_for_offset(self, offset):
+        '''
+        Returns the source line of the opcode at the given bytecode offset.
+        '''
+        return self.lines[max(bisect_right(self.offsets, offset) - 1, 0)]
+
+    def ranges(self):
+        '''
+        Iterates over (start, end, line) tuples, one for each run of
+        bytecode that belongs to a single line. end is exclusive.
+        '''
+        offsets, lines = self.offsets, self.lines
+        last = len(offsets) - 1
+        for i in range(last + 1):
+            end = offsets[i + 1] if i < last else max(self.size, offsets[i])
+            if end > offsets[i]:
+                yield offsets[i], end, lines[i]
+
 class Module:
     '''
     Represents a disassembled Python module.
 
         self.magic = 32-bit magic number from marshal format
-        self.timestamp = unix timestamp when the file was compiled
+        self.timestamp = unix timestamp when the file was compiled, None
+                         for files checked by the hash of their source
+                         (see PEP 552)
         self.python_version = interpreter version as a string
         self.body = disassembled code in a disasm.CodeObject
     '''
@@ -127,19 +650,61 @@ class Module:
         self.body = body
 
     def __repr__(self):
-        global _indent
+        indent = _INDENT
         result = 'Module(\n'
-        _indent += 1
-        indent = _indent * _INDENT
         result += indent + 'magic = %s,\n' % repr(self.magic)
         result += indent + 'timestamp = %s,\n' % repr(self.timestamp)
         result += indent + 'python_version = %s,\n' % repr(self.python_version)
-        result += indent + 'body = %s' % repr(self.body)
-        _indent -= 1
+        result += indent + 'body = %s' % self.body._repr(1)
         return result + ')'
 
+def unpack_header(data):
+    '''
+    Returns (magic, flags, timestamp, source size, source hash) from data,
+    the header of a *.pyc file (see op.header_size()). Fields that the
+    header doesn't have are None. Since Python 3.7, bit 0 of the flags means
+    the header holds a hash of the source instead of its timestamp and
+    size. Raises disasm.DisassemblerException if data is too short.
+    '''
+    if len(data) < 4:
+        raise DisassemblerException('File is too short for a *.pyc header')
+    magic = struct.unpack('=I', data[:4])[0]
+    size = op.header_size(magic)
+    if len(data) < size:
+        raise DisassemblerException('File is too short for a *.pyc header')
+    if size == 8:
+        return magic, None, struct.unpack('=I', data[4:8])[0], None, None
+    elif size == 12:
+        timestamp, source_size = struct.unpack('=II', data[4:12])
+        return magic, None, timestamp, source_size, None
+    flags = struct.unpack('=I', data[4:8])[0]
+    if flags & 1:
+        return magic, flags, None, None, bytes(data[8:16])
+    timestamp, source_size = struct.unpack('=II', data[8:16])
+    return magic, flags, timestamp, source_size, None
+
+# Feed a canonical encoding of value into the hash object h. Every value is
+# prefixed with its type name so 1, 1.0 and True hash differently, and the
+# contents of sets are sorted so the result doesn't depend on hash seeds.
+def _hash_value(h, value):
+    if isinstance(value, CodeObject):
+        h.update(b'code:' + value.fingerprint().encode('ascii'))
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        items = [_value_digest(v) for v in value]
+        if isinstance(value, (set, frozenset)):
+            items.sort()
+        h.update(('%s:%d:' % (type(value).__name__, len(items))).encode('ascii'))
+        for item in items:
+            h.update(item)
+    else:
+        h.update(('%s:%s;' % (type(value).__name__, repr(value))).encode('utf8', 'surrogatepass'))
+
+def _value_digest(value):
+    h = hashlib.sha1()
+    _hash_value(h, value)
+    return h.digest()
+
 # Used by __repr__() for disassembled objects
-_indent = 0
 _INDENT = '    '
 
 # Indicates the type of object to unmarshal
@@ -166,61 +731,300 @@ _TYPE_CODE = ord('c')
 _TYPE_UNICODE = ord('u')
 _TYPE_SET = ord('<')
 _TYPE_FROZEN_SET = ord('>')
+_TYPE_REF = ord('r')
+_TYPE_ASCII = ord('a')
+_TYPE_ASCII_INTERNED = ord('A')
+_TYPE_SHORT_ASCII = ord('z')
+_TYPE_SHORT_ASCII_INTERNED = ord('Z')
+_TYPE_SMALL_TUPLE = ord(')')
+
+# Set on the type of an object that later TYPE_REF objects refer back to
+_FLAG_REF = 0x80
+
+# Code object fields that are marshalled as plain 32-bit integers
+_INT_FIELDS = frozenset(['co_argcount', 'co_posonlyargcount', 'co_kwonlyargcount', 'co_nlocals',
+                         'co_stacksize', 'co_flags', 'co_firstlineno'])
+
+# Kinds of the names in co_localsplusnames
+_CO_FAST_LOCAL = 0x20
+_CO_FAST_CELL = 0x40
+_CO_FAST_FREE = 0x80
+
+# Python 3.11 and later marshal the names of local, cell and free variables in
+# one tuple with a byte of kind flags for each name, which are split back into
+# the fields of older versions here. A cell that's also an argument is in both
+# co_varnames and co_cellvars, like in the interpreter.
+def _split_localsplus(fields):
+    names = fields.pop('co_localsplusnames')
+    kinds = fields.pop('co_localspluskinds')
+    fields['co_varnames'] = tuple(name for name, kind in zip(names, kinds) if kind & _CO_FAST_LOCAL)
+    fields['co_cellvars'] = tuple(name for name, kind in zip(names, kinds) if kind & _CO_FAST_CELL)
+    fields['co_freevars'] = tuple(name for name, kind in zip(names, kinds) if kind & _CO_FAST_FREE)
+    fields['co_nlocals'] = len(fields['co_varnames'])
 
 # Holds intermediate state useful during disassembly. Only the disassemble()
 # method is meant to be called directly.
 class _Disassembler:
-    def __init__(self):
+    def __init__(self, columnar=False, lazy=False):
         self.magic = None
         self.string_table = None
+        self.refs = None
         self.file = None
+        self.columnar = columnar
+        self.lazy = lazy
+        self.decode_table = None
+        self.decode_ids = None
+        self.wordcode = False
+        self.marshal_refs = False
+        self.code_fields = None
+        self.argument_shifts = None
 
     def disassemble(self, file):
-        self.magic, timestamp = struct.unpack('=II', file.read(8))
+        header = file.read(4)
+        if len(header) < 4:
+            raise DisassemblerException('File is too short for a *.pyc header')
+        header += file.read(op.header_size(struct.unpack('=I', header)[0]) - 4)
+        self.magic, flags, timestamp, source_size, source_hash = unpack_header(header)
         self.string_table = []
+        self.refs = []
         self.file = file
 
         version = op.python_version_from_magic(self.magic)
         if not version:
+            if op.is_wordcode(self.magic):
+                raise DisassemblerException('Wordcode with magic number %d is only supported by the Python version '
+                                            'that wrote it, not by Python %s'
+                                            % (self.magic & 0xFFFF, platform.python_version()))
             raise DisassemblerException('Unknown magic header number %d' % self.magic)
+        self.decode_table = op.decode_table(self.magic)
+        self.decode_ids = op.decode_ids(self.magic)
+        self.wordcode = op.is_wordcode(self.magic)
+        self.marshal_refs = op.has_marshal_refs(self.magic)
+        self.code_fields = op.code_fields(self.magic)
+        self.argument_shifts = op.argument_shifts(self.magic)
 
-        return Module(self.magic, timestamp, 'Python ' + version, self.unmarshal_node())
+        module = Module(self.magic, timestamp, 'Python ' + version, self.unmarshal_node())
+        profile = instrument.current()
+        if profile:
+            try:
+                profile.count('bytes_unmarshalled', file.tell())
+            except (AttributeError, IOError):
+                pass
+
+        # Code objects that are decoded later keep the disassembler, which
+        # only needs the tables for the magic number from now on
+        self.file = None
+        self.string_table = None
+        self.refs = None
+        return module
+
+    # Decode the bytecode of co into co.opcodes
+    def decode(self, co):
+        if self.wordcode:
+            offsets, sizes, ids, arguments = self.decode_wordcode(co)
+            flags = op.opcode_flags
+            if self.columnar:
+                for opcode, argument in zip(ids, arguments):
+                    if flags[opcode] & op.HAS_ARGUMENT:
+                        resolve_argument(co, opcode, argument)
+                co.opcodes = OpcodeColumns(co)
+                co.opcodes.extend(offsets, sizes, ids, arguments)
+            else:
+                co.opcodes = [Opcode(offset, size, opcode, resolve_argument(co, opcode,
+                              argument if flags[opcode] & op.HAS_ARGUMENT else None))
+                              for offset, size, opcode, argument in zip(offsets, sizes, ids, arguments)]
+        elif self.columnar:
+            co.opcodes = OpcodeColumns(co)
+            for offset, size, opcode, argument in self.decode_opcodes(co):
+                resolve_argument(co, opcode, argument)
+                co.opcodes.append(offset, size, opcode, argument)
+        else:
+            co.opcodes = []
+            for offset, size, opcode, argument in self.decode_opcodes(co):
+                co.opcodes.append(Opcode(offset, size, opcode, resolve_argument(co, opcode, argument)))
+
+        profile = instrument.current()
+        if profile:
+            profile.count('opcodes_decoded', len(co.opcodes))
+
+    # Decode the bytecode of co, yielding (offset, size, opcode, argument)
+    # tuples where argument is the raw integer argument or None
+    def decode_opcodes(self, co):
+        code = co.co_code
+        table = self.decode_table
+        flags = op.opcode_flags
+        argument = 0
+        i = 0
+        while i < len(code):
+            offset = i
+            opcode = table[code[i]]
+            if opcode is None:
+                raise DisassemblerException('Unknown bytecode 0x%02X' % code[i])
+            i += 1
+
+            if not flags[opcode] & op.HAS_ARGUMENT:
+                yield offset, 1, opcode, None
+                continue
+            lo, hi = code[i:i + 2]
+            argument |= (lo | (hi << 8))
+            i += 2
+
+            # The upper 16 bits of 32-bit arguments are stored in a fake
+            # EXTENDED_ARG opcode that precedes the actual opcode
+            if opcode == op.EXTENDED_ARG:
+                argument <<= 16
+                continue
+
+            yield offset, i - offset, opcode, argument
+            argument = 0
+
+    # Decode the bytecode of co from wordcode, where every opcode is a bytecode
+    # followed by an 8-bit argument. Instead of walking the bytecode one opcode
+    # at a time, whole columns are decoded at once by slicing out every other
+    # byte and translating the bytecodes to opcode ids, and only EXTENDED_ARG
+    # prefixes are visited one by one. Returns sequences of the offsets,
+    # sizes, opcode ids and raw arguments.
+    def decode_wordcode(self, co):
+        code = bytes(co.co_code)
+        if len(code) % 2:
+            raise DisassemblerException('Wordcode has an odd length of %d bytes' % len(code))
+        ids = code[0::2].translate(self.decode_ids)
+        invalid = ids.find(op.INVALID_ID)
+        if invalid >= 0:
+            raise DisassemblerException('Unknown bytecode 0x%02X' % code[invalid * 2])
+        arguments = code[1::2]
+        count = len(ids)
+        prefix = ids.find(op.EXTENDED_ARG)
+        if prefix < 0:
+            offsets = range(0, len(code), 2)
+            sizes = b'\x02' * count
+        else:
+            # Each EXTENDED_ARG holds the next higher 8 bits of the argument of
+            # the opcode after it, and is folded into that opcode. Jumps to the
+            # opcode land on its first prefix, which becomes its offset.
+            offsets = list(range(0, len(code), 2))
+            sizes = bytearray(b'\x02') * count
+            arguments = list(arguments)
+            keep = bytearray(b'\x01') * count
+            while prefix >= 0:
+                end = prefix
+                argument = 0
+                while end < count and ids[end] == op.EXTENDED_ARG:
+                    argument = argument << 8 | arguments[end]
+                    keep[end] = 0
+                    end += 1
+                if end == count:
+                    raise DisassemblerException('EXTENDED_ARG at the end of the bytecode')
+                arguments[end] |= argument << 8
+                offsets[end] = prefix * 2
+                sizes[end] = (end - prefix + 1) * 2
+                prefix = ids.find(op.EXTENDED_ARG, end)
+            offsets = list(compress(offsets, keep))
+            sizes = bytes(compress(sizes, keep))
+            ids = bytes(compress(ids, keep))
+            arguments = list(compress(arguments, keep))
+
+        # Flags below the index into co_names are dropped
+        for opcode, shift in self.argument_shifts.items():
+            index = ids.find(opcode)
+            if index >= 0 and not isinstance(arguments, list):
+                arguments = list(arguments)
+            while index >= 0:
+                arguments[index] >>= shift
+                index = ids.find(opcode, index + 1)
+        return offsets, sizes, ids, arguments
 
     def unmarshal_collection(self, type):
         count = self.read_int32()
         nodes = [self.unmarshal_node() for i in range(count)]
         return type(nodes)
 
-    def read_byte_array(self):
-        count = self.read_int32()
-        return list(struct.unpack('=' + 'B' * count, self.file.read(count)))
-
+    # Python 2 strings are bytes, which are mapped one to one onto characters
     def read_string_ascii(self):
-        return ''.join(chr(c) for c in self.read_byte_array())
+        count = self.read_int32()
+        return self.file.read(count).decode('latin-1')
 
     def read_string_utf8(self):
         count = self.read_int32()
-        return self.file.read(count).decode('utf8')
+        return self.file.read(count).decode('utf8', 'surrogatepass')
+
+    def read_bytes(self):
+        count = self.read_int32()
+        return self.file.read(count)
+
+    def read_code(self):
+        if self.marshal_refs:
+            code = self.unmarshal_node()
+            if not isinstance(code, bytes):
+                raise DisassemblerException('Bytecode was not marshalled as bytes (got %s)' % type(code).__name__)
+            return code
+        type = self.read_int8()
+        if type != _TYPE_STRING:
+            raise DisassemblerException('Bytecode was not marshalled as a string (type was 0x%02X instead of 0x%02X)' % (type, _TYPE_STRING))
+        return self.read_bytes()
+
+    # Floats written by marshal before version 2 are the text of their repr()
+    # with a one byte length
+    def read_float_text(self):
+        count = self.read_uint8()
+        try:
+            return float(self.file.read(count))
+        except ValueError:
+            raise DisassemblerException('Invalid float constant')
+
+    # Longs are a signed count of 15-bit digits followed by the digits, least
+    # significant first. Neighbouring digits are combined pairwise so every
+    # round works on half as many numbers of twice the size, instead of
+    # shifting one growing number for every digit.
+    def read_long(self):
+        count = self.read_int32()
+        digits = list(struct.unpack('=%dH' % abs(count), self.file.read(2 * abs(count))))
+        shift = 15
+        while len(digits) > 1:
+            if len(digits) % 2:
+                digits.append(0)
+            digits = [lo | hi << shift for lo, hi in zip(digits[0::2], digits[1::2])]
+            shift *= 2
+        n = digits[0] if digits else 0
+        return n if count > 0 else -n
 
     def read_int8(self):
         return struct.unpack('=b', self.file.read(1))[0]
 
+    def read_uint8(self):
+        return struct.unpack('=B', self.file.read(1))[0]
+
     def read_int16(self):
         return struct.unpack('=h', self.file.read(2))[0]
 
     def read_int32(self):
         return struct.unpack('=i', self.file.read(4))[0]
 
+    # Objects written with _FLAG_REF are added to self.refs, where TYPE_REF
+    # finds them again. The slot is taken before anything nested inside the
+    # object is unmarshalled, since that's the order the indices were handed
+    # out when writing.
     def unmarshal_node(self):
-        type = self.read_int8()
+        type = self.read_uint8()
+        if type & _FLAG_REF:
+            index = len(self.refs)
+            self.refs.append(None)
+            node = self.unmarshal_type(type & ~_FLAG_REF)
+            self.refs[index] = node
+            return node
+        return self.unmarshal_type(type)
 
+    def unmarshal_type(self, type):
         # Global singletons
         if type == _TYPE_NONE: return None
         elif type == _TYPE_TRUE: return True
         elif type == _TYPE_FALSE: return False
+        elif type == _TYPE_ELLIPSIS: return Ellipsis
+        elif type == _TYPE_STOP_ITER: return StopIteration
 
         # Collections
         elif type == _TYPE_TUPLE: return self.unmarshal_collection(tuple)
+        elif type == _TYPE_SMALL_TUPLE: return tuple([self.unmarshal_node() for i in range(self.read_uint8())])
         elif type == _TYPE_LIST: return self.unmarshal_collection(list)
         elif type == _TYPE_SET: return self.unmarshal_collection(set)
         elif type == _TYPE_FROZEN_SET: return self.unmarshal_collection(frozenset)
@@ -230,23 +1034,29 @@ class _Disassembler:
         elif type == _TYPE_INT64: return struct.unpack('=q', self.file.read(8))[0]
         elif type == _TYPE_BINARY_FLOAT: return struct.unpack('=d', self.file.read(8))[0]
         elif type == _TYPE_BINARY_COMPLEX: return complex(*struct.unpack('=dd', self.file.read(16)))
-        elif type == _TYPE_LONG:
-            nbits = self.read_int32()
-            if not nbits:
-                return 0
-            n = 0
-            for i in range(abs(nbits)):
-                digit = self.read_int16()
-                n |= digit << (i * 15)
-            return n if nbits > 0 else -n
+        elif type == _TYPE_LONG: return self.read_long()
+        elif type == _TYPE_FLOAT: return self.read_float_text()
+        elif type == _TYPE_COMPLEX: return complex(self.read_float_text(), self.read_float_text())
 
         # Strings
-        elif type == _TYPE_STRING: return self.read_string_ascii()
+        elif type == _TYPE_SHORT_ASCII or type == _TYPE_SHORT_ASCII_INTERNED:
+            return self.file.read(self.read_uint8()).decode('latin-1')
+        elif type == _TYPE_ASCII or type == _TYPE_ASCII_INTERNED:
+            return self.read_bytes().decode('latin-1')
+        elif type == _TYPE_STRING:
+            return self.read_bytes() if self.marshal_refs else self.read_string_ascii()
         elif type == _TYPE_UNICODE: return self.read_string_utf8()
         elif type == _TYPE_INTERNED:
+            if self.marshal_refs:
+                return self.read_string_utf8()
             data = self.read_string_ascii()
             self.string_table.append(data)
             return data
+        elif type == _TYPE_REF:
+            index = self.read_int32()
+            if index < 0 or index >= len(self.refs):
+                raise DisassemblerException('Reference %d is outside the reference table' % index)
+            return self.refs[index]
         elif type == _TYPE_STRING_REF:
             index = self.read_int32()
             if index < 0 or index >= len(self.string_table):
@@ -255,72 +1065,26 @@ class _Disassembler:
 
         # Code objects
         elif type == _TYPE_CODE:
-            co = CodeObject()
-            co.co_argcount = self.read_int32()
-            co.co_kwonlyargcount = self.read_int32() if op.has_kwonlyargcount(self.magic) else 0
-            co.co_nlocals = self.read_int32()
-            co.co_stacksize = self.read_int32()
-            co.co_flags = self.read_int32()
-            type = self.read_int8()
-            if type != _TYPE_STRING:
-                raise DisassemblerException('Bytecode was not marshalled as a string (type was 0x%02X instead of 0x%02X)' % (type, _TYPE_STRING))
-            co.co_code = self.read_byte_array()
-            co.co_consts = self.unmarshal_node()
-            co.co_names = self.unmarshal_node()
-            co.co_varnames = self.unmarshal_node()
-            co.co_freevars = self.unmarshal_node()
-            co.co_cellvars = self.unmarshal_node()
-            co.co_filename = self.unmarshal_node()
-            co.co_name = self.unmarshal_node()
-            co.co_firstlineno = self.read_int32()
-            co.co_lnotab = self.unmarshal_node()
-
-            # Start disassembly
-            argument = 0
-            i = 0
-            while i < len(co.co_code):
-                offset = i
-                opcode = op.from_bytecode(co.co_code[i], self.magic)
-                if opcode is None:
-                    raise DisassemblerException('Unknown bytecode 0x%02X' % co.co_code[i])
-                i += 1
-
-                if op.has_argument(opcode):
-                    lo, hi = co.co_code[i:i + 2]
-                    argument |= (lo | (hi << 8))
-                    i += 2
-
-                # The upper 16 bits of 32-bit arguments are stored in a fake
-                # EXTENDED_ARG opcode that precedes the actual opcode
-                if opcode == op.EXTENDED_ARG:
-                    argument <<= 16
-                    continue
-
-                # Decode the opcode argument if present
-                arg = None
-                if op.has_argument(opcode):
-                    if opcode == op.LOAD_CONST:
-                        if argument >= len(co.co_consts):
-                            raise DisassemblerException('Invalid argument %d for opcode %s' % (argument, opcode))
-                        arg = co.co_consts[argument]
-                    elif opcode in [op.LOAD_NAME, op.STORE_NAME, op.DELETE_NAME,
-                                op.LOAD_ATTR, op.STORE_ATTR, op.DELETE_ATTR,
-                                op.LOAD_GLOBAL, op.STORE_GLOBAL, op.DELETE_GLOBAL,
-                                op.IMPORT_NAME, op.IMPORT_FROM]:
-                        if argument >= len(co.co_names):
-                            raise DisassemblerException('Invalid argument %d for opcode %s' % (argument, opcode))
-                        arg = co.co_names[argument]
-                    elif opcode in [op.LOAD_FAST, op.STORE_FAST, op.DELETE_FAST]:
-                        if argument >= len(co.co_varnames):
-                            raise DisassemblerException('Invalid argument %d for opcode %s' % (argument, opcode))
-                        arg = co.co_varnames[argument]
-                    else:
-                        arg = argument
-
-                # Record disassembled opcode
-                co.opcodes.append(Opcode(offset, i - offset, opcode, arg))
-                argument = 0
+            fields = {'co_kwonlyargcount': 0}
+            for field in self.code_fields:
+                if field in _INT_FIELDS:
+                    fields[field] = self.read_int32()
+                elif field == 'co_code':
+                    fields[field] = self.read_code()
+                else:
+                    fields[field] = self.unmarshal_node()
+            if 'co_localsplusnames' in fields:
+                _split_localsplus(fields)
+            co = CodeObject(**fields)
+            if self.lazy:
+                del co.opcodes
+                co._decoder = self
+            else:
+                self.decode(co)
 
+            profile = instrument.current()
+            if profile:
+                profile.count('code_objects')
             return co
 
         else:
@@ -0,0 +1,207 @@
+'''
+export.write_ndjson(module, file)
+    Write a disasm.Module to file, a text file object, as newline delimited
+    JSON: one line for the module followed by one line for every code
+    object in the order of disasm.walk(). Every line is written as soon as
+    it's encoded, so the memory used doesn't grow with the size of the
+    module, and nothing is shared between calls, so modules can be exported
+    from several threads at once. Also available as
+    "python -m unwind export PATH".
+
+        with open('app.ndjson', 'w') as f:
+            unwind.export.write_ndjson(unwind.disassemble('app.pyc', columnar=True), f)
+
+export.write_json(module, file)
+    The same records as a single JSON document, the module record with the
+    code records in a list under "code_objects". It's written incrementally
+    too.
+
+export.records(module)
+    Iterates over the records as dicts of JSON-compatible values, the module
+    record first.
+
+The schema is stable, a change that breaks readers increments
+export.SCHEMA_VERSION. The module record is
+
+    {"type": "module", "schema": 1, "magic": 62211, "timestamp": 1700000000,
+     "python_version": "Python 2.7a2+"}
+
+and a code record is
+
+    {"type": "code", "index": 1, "parent": 0, "qualname": "Parser.parse",
+     "co_argcount": 2, ..., "co_consts": [...], "co_names": [...],
+     "opcodes": [[0, 3, "LOAD_FAST", "self"], ...]}
+
+with every field of disasm.CodeObject, null for the fields that the Python
+version doesn't have. Code objects refer to each other by index and parent
+is null for the module's code. Every opcode is an array of its offset,
+size, normalized name (see op.opcodes) and argument, which is resolved like
+disasm.Opcode.argument and null for opcodes without one.
+Byte strings (co_code, co_lnotab, co_linetable and co_exceptiontable) are
+hex strings. Constants are JSON values where that's unambiguous: None,
+booleans, integers, finite floats, text strings and tuples, which become
+arrays. Other constants are an object with a single key that names their
+type: {"bytes": "hex"}, {"float": "nan"}, {"complex": [real, imag]},
+{"list": [...]}, {"set": [...]}, {"frozenset": [...]}, {"code": index},
+{"constant": "Ellipsis"} or {"constant": "StopIteration"}. The items of
+sets are sorted by their JSON encoding so exports are reproducible.
+'''
+
+import json
+import math
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+# Increment when the records change in a way old readers can't handle
+SCHEMA_VERSION = 1
+
+# Fields of a code record in the order they're written, apart from co_consts
+# and opcodes which are encoded separately
+_INT_FIELDS = ('co_argcount', 'co_posonlyargcount', 'co_kwonlyargcount', 'co_nlocals', 'co_stacksize',
+               'co_flags', 'co_firstlineno')
+_BYTES_FIELDS = ('co_code', 'co_lnotab', 'co_linetable', 'co_exceptiontable')
+_TEXT_FIELDS = ('co_filename', 'co_name', 'co_qualname')
+_NAMES_FIELDS = ('co_names', 'co_varnames', 'co_freevars', 'co_cellvars')
+
+# Encoders don't keep state between calls so one can be shared by every thread
+_encoder = json.JSONEncoder(ensure_ascii=True, separators=(',', ':'), allow_nan=False)
+
+# Returns value, a constant, as a JSON-compatible value. code_ids maps the id()
+# of code objects to their index.
+def _value(value, code_ids):
+    kind = type(value)
+    if value is None or kind in (bool, int, str):
+        return value
+    elif kind is float:
+        if math.isfinite(value):
+            return value
+        return {'float': repr(value)}
+    elif kind is tuple:
+        return [_value(v, code_ids) for v in value]
+    elif kind is bytes:
+        return {'bytes': value.hex()}
+    elif kind is disasm.CodeObject:
+        return {'code': code_ids[id(value)]}
+    elif kind is list:
+        return {'list': [_value(v, code_ids) for v in value]}
+    elif kind in (set, frozenset):
+        items = sorted((_value(v, code_ids) for v in value), key=_encoder.encode)
+        return {kind.__name__: items}
+    elif kind is complex:
+        return {'complex': [_value(value.real, code_ids), _value(value.imag, code_ids)]}
+    elif value is Ellipsis or value is StopIteration:
+        return {'constant': value.__name__ if value is StopIteration else 'Ellipsis'}
+    raise TypeError('Cannot export constant of type %s' % kind.__name__)
+
+# Byte strings of Python 2 modules are unmarshalled as latin-1 text
+def _hex(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    return bytes(data).hex()
+
+# What the argument of every opcode id refers to: nothing, the argument itself,
+# co_consts, co_names or co_varnames. Opcode ids are translated to these as a
+# whole column at once.
+def _gen_argument_kinds():
+    kinds = bytearray(256)
+    for opcode, flags in enumerate(op.opcode_flags):
+        if not flags & op.HAS_ARGUMENT:
+            continue
+        elif opcode == op.LOAD_CONST:
+            kinds[opcode] = 2
+        elif flags & op.USES_NAMES:
+            kinds[opcode] = 3
+        elif flags & op.USES_VARNAMES:
+            kinds[opcode] = 4
+        else:
+            kinds[opcode] = 1
+    return bytes(kinds)
+
+_ARGUMENT_KINDS = _gen_argument_kinds()
+
+# Returns the opcode records of code. Columns are read directly instead of
+# creating a disasm.Opcode for every opcode.
+def _opcodes(code, code_ids):
+    names = op.opcode_names
+    opcodes = code.opcodes
+    if not isinstance(opcodes, disasm.OpcodeColumns):
+        return [[o.offset, o.size, names[o.opcode], _value(o.argument, code_ids)] for o in opcodes]
+
+    consts = [_value(value, code_ids) for value in code.co_consts or ()]
+    tables = (None, None, consts, code.co_names or (), code.co_varnames or ())
+    kinds = opcodes.ids.tobytes().translate(_ARGUMENT_KINDS)
+    try:
+        return [[offset, size, names[opcode],
+                 tables[kind][argument] if kind > 1 else argument if kind else None]
+                for offset, size, opcode, argument, kind in zip(opcodes.offsets, opcodes.sizes, opcodes.ids,
+                                                                opcodes.arguments, kinds)]
+    except IndexError:
+        raise disasm.DisassemblerException('Invalid argument in %s' % code.co_name)
+
+def _module_record(module):
+    return {
+        'type': 'module',
+        'schema': SCHEMA_VERSION,
+        'magic': module.magic,
+        'timestamp': module.timestamp,
+        'python_version': module.python_version,
+    }
+
+def _code_record(index, parent, qualname, code, code_ids):
+    record = {'type': 'code', 'index': index, 'parent': parent, 'qualname': qualname}
+    for field in _INT_FIELDS + _TEXT_FIELDS:
+        record[field] = getattr(code, field)
+    for field in _BYTES_FIELDS:
+        record[field] = _hex(getattr(code, field))
+    for field in _NAMES_FIELDS:
+        names = getattr(code, field)
+        record[field] = None if names is None else list(names)
+    record['co_consts'] = _value(code.co_consts, code_ids)
+    record['opcodes'] = _opcodes(code, code_ids)
+    return record
+
+# Iterate over the code records. Only references to the code objects are held
+# up front, records are built one at a time.
+def _code_records(module):
+    codes = list(disasm.walk(module.body))
+    code_ids = dict((id(code), index) for index, (qualname, code) in enumerate(codes))
+    parents = {}
+    for index, (qualname, code) in enumerate(codes):
+        for value in code.co_consts or ():
+            if isinstance(value, disasm.CodeObject):
+                parents[id(value)] = index
+        yield _code_record(index, parents.get(id(code)), qualname, code, code_ids)
+
+def records(module):
+    '''
+    Iterates over the module record and the code records of module as dicts
+    of JSON-compatible values.
+    '''
+    yield _module_record(module)
+    for record in _code_records(module):
+        yield record
+
+def write_ndjson(module, file):
+    '''
+    Write module to file as one line of JSON per record.
+    '''
+    encode = _encoder.encode
+    for record in records(module):
+        file.write(encode(record))
+        file.write('\n')
+
+def write_json(module, file):
+    '''
+    Write module to file as a single JSON document.
+    '''
+    encode = _encoder.encode
+    head = encode(_module_record(module))
+    file.write(head[:-1] + ',"code_objects":[')
+    for index, record in enumerate(_code_records(module)):
+        if index:
+            file.write(',')
+        file.write(encode(record))
+    file.write(']}\n')
@@ -0,0 +1,361 @@
+'''
+index.Index(path)
+    A persistent inverted index over a corpus of *.pyc files, stored in the
+    SQLite database at path (created if missing). Every code object of an
+    indexed file is recorded with the names it imports, the global names and
+    dotted attribute chains it loads ("pickle.loads"), the attribute names
+    it uses, its string and number constants and the trigrams of its opcode
+    sequence, so queries don't need to disassemble anything.
+
+        index = unwind.index.Index('corpus.db')
+        index.update(glob.glob('deploy/**/*.pyc', recursive=True))
+        for path, qualname, line in index.find_name('pickle.loads'):
+            print(path, qualname, line)
+
+index.Index.update(paths)
+    Index every file in paths in one transaction. Files are identified by
+    path and skipped if their contents hash to the same digest as when they
+    were last indexed, so updating a corpus only disassembles files that
+    changed. Returns a tuple of (indexed, unchanged, failed) counts. Files
+    that can't be disassembled are remembered and not retried until they
+    change. Files that can't be read, such as files deleted since paths was
+    listed, are counted as failed and removed from the index.
+
+index.Index.remove(path)
+    Remove a file from the index.
+
+index.Index.find_import(module)
+index.Index.find_name(name)
+index.Index.find_attribute(name)
+index.Index.find_constant(value)
+    Return a sorted list of (path, qualname, first line) tuples for the code
+    objects that import module (or "module.name" for "from module import
+    name"), load the global name or dotted chain name ("os.path.join"), use
+    the attribute name, or contain the constant value. find_name() also
+    finds imports, so find_name('pickle.loads') includes "from pickle import
+    loads". qualname is "" for module level code (see disasm.walk()).
+
+index.Index.find_sequence(opcodes)
+    Same as above for code objects containing the given run of opcodes, as
+    names (see op.opcodes) or values (see op.OpcodeId), in order. Candidates
+    are looked up by opcode trigram and then confirmed against the opcodes
+    stored for each code object. CACHE entries aren't stored, so the same
+    query works for every Python version.
+
+The database stores opcodes by ids of its own, listed by name in its
+opcodes table, so it stays valid when the values of op.OpcodeId change
+between versions of unwind. A database written before that table existed
+is emptied and filled again by the next update().
+
+index.Index.close()
+    Close the database. An Index can also be used as a context manager.
+'''
+
+import os
+import sys
+import sqlite3
+import hashlib
+from array import array
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+# Length of the opcode n-grams stored for sequence queries
+_N = 3
+
+# Constants longer than this aren't indexed, they're rarely searched for and
+# would bloat the database
+_MAX_CONSTANT = 256
+
+# Increment when the schema changes, older databases are rebuilt
+_VERSION = 1
+
+# Opcodes and n-grams are stored with the ids of the opcodes table in 16 bits
+# each, little-endian
+_STORED_TYPECODE = 'H'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS opcodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    digest TEXT NOT NULL,
+    magic INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS code (
+    id INTEGER PRIMARY KEY,
+    file INTEGER NOT NULL,
+    qualname TEXT NOT NULL,
+    line INTEGER,
+    opcodes BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS code_file ON code (file);
+CREATE TABLE IF NOT EXISTS features (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    PRIMARY KEY (kind, value, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS features_code ON features (code);
+CREATE TABLE IF NOT EXISTS ngrams (
+    gram INTEGER NOT NULL,
+    code INTEGER NOT NULL,
+    PRIMARY KEY (gram, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ngrams_code ON ngrams (code);
+'''
+
+_DROP = '''
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS code;
+DROP TABLE IF EXISTS features;
+DROP TABLE IF EXISTS ngrams;
+DROP TABLE IF EXISTS opcodes;
+'''
+
+class Index:
+    '''
+    A persistent inverted index over *.pyc files. See the module
+    documentation for details.
+
+        self.path = path of the SQLite database
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] < _VERSION:
+            self.db.executescript(_DROP)
+            self.db.execute('PRAGMA user_version = %d' % _VERSION)
+        self.db.executescript(_SCHEMA)
+        self._load_opcodes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths):
+        '''
+        Index every file in paths that changed since it was last indexed.
+        Returns a tuple of (indexed, unchanged, failed) counts.
+        '''
+        indexed = unchanged = failed = 0
+        with self.db:
+            for path in paths:
+                path = os.path.abspath(path)
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    self._remove(path)
+                    failed += 1
+                    continue
+                digest = hashlib.sha1(data).hexdigest()
+                row = self.db.execute('SELECT digest FROM files WHERE path = ?', (path,)).fetchone()
+                if row is not None and row[0] == digest:
+                    unchanged += 1
+                    continue
+                self._remove(path)
+                if self._add(path, data, digest):
+                    indexed += 1
+                else:
+                    failed += 1
+        return indexed, unchanged, failed
+
+    def remove(self, path):
+        '''
+        Remove the file at path from the index.
+        '''
+        with self.db:
+            self._remove(os.path.abspath(path))
+
+    def find_import(self, module):
+        return self._find("kind = 'import' AND value = ?", (module,))
+
+    def find_name(self, name):
+        return self._find("kind IN ('name', 'import') AND value = ?", (name,))
+
+    def find_attribute(self, name):
+        return self._find("kind = 'attr' AND value = ?", (name,))
+
+    def find_constant(self, value):
+        return self._find("kind = 'const' AND value = ?", (_constant_key(value),))
+
+    def find_sequence(self, opcodes):
+        '''
+        Returns (path, qualname, first line) for every code object that
+        contains the opcodes in opcodes as a consecutive run.
+        '''
+        names = [o if isinstance(o, str) else op.opcode_names[o] for o in opcodes]
+        names = [name for name in names if name != 'CACHE']
+        if not names:
+            return []
+        # Opcodes that no indexed file uses can't match
+        if any(name not in self._stored_ids for name in names):
+            return []
+        ids = array(_STORED_TYPECODE, [self._stored_ids[name] for name in names])
+        # Any subset of the trigrams narrows down the candidates, and SQLite
+        # limits the number of parameters of a query
+        grams = sorted(set(_ngrams(ids)))[:64]
+        if grams:
+            query = ' INTERSECT '.join(['SELECT code FROM ngrams WHERE gram = ?'] * len(grams))
+            rows = self.db.execute(
+                'SELECT code.id, code.opcodes FROM code WHERE code.id IN (%s)' % query, grams)
+        else:
+            rows = self.db.execute('SELECT id, opcodes FROM code')
+
+        # Confirm each candidate since having all the trigrams doesn't mean
+        # they're in the right order
+        needle = _to_bytes(ids)
+        size = ids.itemsize
+        matches = []
+        for code, blob in rows:
+            blob = bytes(blob)
+            i = blob.find(needle)
+            while i >= 0 and i % size:
+                i = blob.find(needle, i + 1)
+            if i >= 0:
+                matches.append(code)
+        return self._results(matches)
+
+    # Map the names of the opcodes table to their ids and the values of
+    # op.OpcodeId to the same ids, adding the opcodes that are missing
+    def _load_opcodes(self):
+        with self.db:
+            stored = dict(self.db.execute('SELECT name, id FROM opcodes'))
+            for name in op.opcode_names:
+                if name not in stored:
+                    stored[name] = self.db.execute('INSERT INTO opcodes (name) VALUES (?)', (name,)).lastrowid
+        self._stored_ids = stored
+        self._to_stored = [stored[name] for name in op.opcode_names]
+
+    # Look up code objects by a condition on the features table
+    def _find(self, condition, args):
+        rows = self.db.execute('SELECT DISTINCT code FROM features WHERE ' + condition, args)
+        return self._results([r[0] for r in rows])
+
+    def _results(self, codes):
+        results = []
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            results += self.db.execute(
+                'SELECT files.path, code.qualname, code.line FROM code JOIN files ON files.id = code.file '
+                'WHERE code.id IN (%s)' % ', '.join('?' * len(chunk)), chunk).fetchall()
+        return sorted(results)
+
+    def _remove(self, path):
+        row = self.db.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return
+        codes = 'SELECT id FROM code WHERE file = ?'
+        self.db.execute('DELETE FROM features WHERE code IN (%s)' % codes, row)
+        self.db.execute('DELETE FROM ngrams WHERE code IN (%s)' % codes, row)
+        self.db.execute('DELETE FROM code WHERE file = ?', row)
+        self.db.execute('DELETE FROM files WHERE id = ?', row)
+
+    def _add(self, path, data, digest):
+        try:
+            module = disasm.disassemble_bytes(data, columnar=True)
+        except Exception as e:
+            self.db.execute('INSERT INTO files (path, digest, error) VALUES (?, ?, ?)',
+                            (path, digest, '%s: %s' % (e.__class__.__name__, e)))
+            return False
+
+        file = self.db.execute('INSERT INTO files (path, digest, magic) VALUES (?, ?, ?)',
+                               (path, digest, module.magic)).lastrowid
+        features = []
+        ngrams = []
+        to_stored = self._to_stored
+        for qualname, co in disasm.walk(module.body):
+            ids = array(_STORED_TYPECODE, [to_stored[i] for i in co.opcodes.ids if i != _CACHE])
+            code = self.db.execute('INSERT INTO code (file, qualname, line, opcodes) VALUES (?, ?, ?, ?)',
+                                   (file, qualname, co.co_firstlineno, _to_bytes(ids))).lastrowid
+            features += [(kind, value, code) for kind, value in _features(co)]
+            ngrams += [(gram, code) for gram in set(_ngrams(ids))]
+        self.db.executemany('INSERT OR IGNORE INTO features VALUES (?, ?, ?)', features)
+        self.db.executemany('INSERT OR IGNORE INTO ngrams VALUES (?, ?)', ngrams)
+        return True
+
+# Opcodes that only some Python versions have, None for the others
+_CACHE = op.opcode_ids.get('CACHE')
+_LOAD_METHOD = op.opcode_ids.get('LOAD_METHOD')
+
+# Constants are stored by repr() so that 1, 1.0 and '1' are told apart
+def _constant_key(value):
+    return repr(value)
+
+def _to_bytes(ids):
+    if sys.byteorder == 'big':
+        ids = array(ids.typecode, ids)
+        ids.byteswap()
+    return ids.tobytes()
+
+# Pack each run of _N opcode ids into a single integer
+def _ngrams(ids):
+    shift = 8 * ids.itemsize
+    for i in range(len(ids) - _N + 1):
+        gram = 0
+        for j in range(_N):
+            gram = (gram << shift) | ids[i + j]
+        yield gram
+
+# Returns the set of (kind, value) features of a code object whose opcodes are
+# stored in a disasm.OpcodeColumns
+def _features(co):
+    features = set()
+    columns = co.opcodes
+    names = co.co_names or ()
+    varnames = co.co_varnames or ()
+    free = disasm.deref_names(co)
+
+    # chain is the dotted name loaded so far, as in "os.path" while loading
+    # "os.path.join", or None after anything else
+    chain = None
+    module = None
+    for i in range(len(columns)):
+        opcode = columns.opcode(i)
+        argument = columns.arguments[i]
+        # The inline caches of Python 3.11 and later sit between the opcodes
+        # of a dotted name
+        if opcode == _CACHE:
+            continue
+        elif opcode == op.IMPORT_NAME:
+            module = names[argument]
+            features.add(('import', module))
+            chain = None
+        elif opcode == op.IMPORT_FROM:
+            if module is not None:
+                features.add(('import', '%s.%s' % (module, names[argument])))
+            chain = None
+        elif opcode == op.LOAD_GLOBAL or opcode == op.LOAD_NAME:
+            chain = names[argument]
+            features.add(('name', chain))
+        elif opcode == op.LOAD_FAST or opcode == op.LOAD_DEREF:
+            local = varnames if opcode == op.LOAD_FAST else free
+            chain = local[argument] if argument < len(local) else None
+        elif opcode == op.LOAD_ATTR or opcode == _LOAD_METHOD:
+            features.add(('attr', names[argument]))
+            if chain is not None:
+                chain = '%s.%s' % (chain, names[argument])
+                features.add(('name', chain))
+        else:
+            chain = None
+
+    for value in co.co_consts or ():
+        if isinstance(value, (str, bytes, int, float, complex)) and not isinstance(value, bool):
+            key = _constant_key(value)
+            if len(key) <= _MAX_CONSTANT:
+                features.add(('const', key))
+    return features
@@ -0,0 +1,250 @@
+'''
+instrument.profile(cprofile=False)
+    A context manager that collects counters and per-phase timings from the
+    disassembler, the decompiler passes and the code generator while it is
+    active. It yields an instrument.Profile. If cprofile is True, the
+    standard cProfile profiler runs at the same time and its function
+    level statistics are included by Profile.dump_stats(). Also available
+    as unwind.profile(). A profile only collects from the thread that
+    activated it, so threads can profile their own work at the same time.
+
+        with unwind.profile() as p:
+            unwind.decompile('example.pyc')
+        p.dump_json('profile.json')
+        p.dump_stats('profile.prof')   # load with pstats.Stats()
+
+instrument.Profile
+    The collected data. self.counters maps counter names to integers,
+    self.visits maps the names of decompiler passes to the number of AST
+    nodes in the trees they were given and self.phases maps phase names to
+    instrument.Phase instances.
+
+instrument.current()
+    Returns the instrument.Profile that's active in the calling thread, or
+    None.
+
+instrument.count(name, n=1)
+    Add n to the counter called name if a profile is active.
+
+instrument.phase(name)
+    A context manager that times everything inside it as the phase called
+    name if a profile is active. Phases can be nested.
+
+When no profile is active, count() and phase() return immediately, and the
+hot loops only call instrument.current() once per code object or pass, so
+the overhead is negligible.
+'''
+
+import json
+import time
+import marshal
+import threading
+
+# The Profile each thread is collecting into, None when profiling is disabled
+class _State(threading.local):
+    profile = None
+
+_state = _State()
+
+# Only one thread at a time may update a profile
+_lock = threading.Lock()
+
+def current():
+    '''
+    Returns the instrument.Profile that's active in the calling thread or
+    None.
+    '''
+    return _state.profile
+
+class Phase:
+    '''
+    Timing information for one phase.
+
+        self.name = name of the phase
+        self.calls = number of times the phase was entered
+        self.seconds = total wall time including nested phases
+        self.self_seconds = wall time excluding nested phases
+        self.callers = map of enclosing phase name (None at the top level)
+                       to a list of [calls, seconds]
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.callers = {}
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'self_seconds': self.self_seconds,
+            'callers': dict((str(k), {'calls': v[0], 'seconds': v[1]}) for k, v in self.callers.items()),
+        }
+
+class Profile:
+    '''
+    Counters and timings collected by instrument.profile().
+
+        self.counters = map of counter name to integer
+        self.visits = map of pass name to number of nodes in its input
+        self.phases = map of phase name to instrument.Phase
+        self.seconds = total wall time the profile was active
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.visits = {}
+        self.phases = {}
+        self.seconds = 0.0
+        self._local = threading.local()
+        self._cprofile = None
+
+    # Each thread keeps its own stack of open phases
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def count(self, name, n=1):
+        with _lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def visit(self, name, n):
+        with _lock:
+            self.visits[name] = self.visits.get(name, 0) + n
+
+    def enter(self, name):
+        self._stack().append([name, time.time(), 0.0])
+
+    def leave(self):
+        stack = self._stack()
+        name, start, nested = stack.pop()
+        seconds = time.time() - start
+        caller = stack[-1][0] if stack else None
+        if stack:
+            stack[-1][2] += seconds
+        with _lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = Phase(name)
+            phase.calls += 1
+            phase.seconds += seconds
+            phase.self_seconds += seconds - nested
+            edge = phase.callers.setdefault(caller, [0, 0.0])
+            edge[0] += 1
+            edge[1] += seconds
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'counters': dict(self.counters),
+            'visits': dict(self.visits),
+            'phases': dict((name, p.as_dict()) for name, p in self.phases.items()),
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.as_dict(), indent=indent, sort_keys=True)
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json(indent=2))
+
+    def pstats_dict(self):
+        '''
+        Returns the phase timings in the format used by the pstats module,
+        where each phase looks like a function in the file "unwind".
+        '''
+        def key(name):
+            return ('unwind', 0, name)
+        stats = {}
+        for name, p in self.phases.items():
+            callers = {}
+            for caller, (calls, seconds) in p.callers.items():
+                if caller is not None:
+                    callers[key(caller)] = (calls, calls, seconds, seconds)
+            stats[key(name)] = (p.calls, p.calls, p.self_seconds, p.seconds, callers)
+        return stats
+
+    def dump_stats(self, path):
+        '''
+        Write the phase timings (and the cProfile data if it was enabled) to
+        path in the format read by pstats.Stats() and tools like snakeviz.
+        '''
+        stats = {}
+        if self._cprofile is not None:
+            self._cprofile.create_stats()
+            stats.update(self._cprofile.stats)
+        stats.update(self.pstats_dict())
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
+
+class profile:
+    '''
+    Context manager that activates an instrument.Profile. See the module
+    documentation for details.
+    '''
+
+    def __init__(self, cprofile=False):
+        self.profile = Profile()
+        self.cprofile = cprofile
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        if self.cprofile:
+            import cProfile
+            self.profile._cprofile = cProfile.Profile()
+            self.profile._cprofile.enable()
+        self._previous = _state.profile
+        _state.profile = self.profile
+        self._start = time.time()
+        return self.profile
+
+    def __exit__(self, type, value, traceback):
+        self.profile.seconds += time.time() - self._start
+        _state.profile = self._previous
+        if self.profile._cprofile is not None:
+            self.profile._cprofile.disable()
+        return False
+
+def count(name, n=1):
+    '''
+    Add n to the counter called name if a profile is active.
+    '''
+    profile = _state.profile
+    if profile is not None:
+        profile.count(name, n)
+
+class _NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+_null_phase = _NullPhase()
+
+class _Phase:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.enter(self.name)
+
+    def __exit__(self, type, value, traceback):
+        self.profile.leave()
+        return False
+
+def phase(name):
+    '''
+    A context manager that times everything inside it as the phase called
+    name if a profile is active.
+    '''
+    profile = _state.profile
+    if profile is None:
+        return _null_phase
+    return _Phase(profile, name)
@@ -2,7 +2,8 @@
 op.opcodes
     A set of strings of opcode names. This set contains all opcodes from
     every revision of Python, which are extracted directly from the official
-    Python Mercurial repository.
+    Python Mercurial repository, and the opcodes of the running interpreter
+    if it uses wordcode (see op.is_wordcode()).
 
     These opcodes are normalized, which means a given opcode name will
     behave identically across all revisions but will not necessarily have
@@ -17,6 +18,60 @@ op.opcodes
     opcodes like SLICE, STORE_SLICE, and DELETE_SLICE actually represent
     four opcodes and are suffixed with _0, _1, _2, and _3.
 
+op.OpcodeId
+    An IntEnum with a member for every name in op.opcodes, whose value is a
+    small dense integer that identifies the opcode independently of the
+    bytecode values used by any particular revision. Opcodes are passed
+    around as these integers (op.LOAD_CONST == OpcodeId.LOAD_CONST), so
+    every check is an integer comparison. They are plain ints rather than
+    members since the interpreter's fast paths for comparing and indexing
+    don't apply to int subclasses. Use op.OpcodeId(opcode).name or
+    op.opcode_names[opcode] to display an opcode.
+
+op.opcode_names, op.opcode_ids
+    op.opcode_names is a tuple of every name in op.opcodes in sorted order,
+    except that names only found in wordcode come last so the ids of the
+    others are the same on every interpreter. op.opcode_ids maps each name
+    to its index in that tuple, which is the value of its op.OpcodeId.
+
+op.opcode_flags
+    A tuple indexed by opcode of bit flags describing each opcode:
+
+        op.HAS_ARGUMENT = takes an argument in bytecode
+        op.IS_JUMP = the argument is a jump target
+        op.IS_RELATIVE_JUMP = the jump target is relative to the next opcode
+                              rather than to the start of the code object
+        op.IS_BACKWARD_JUMP = a relative jump to an earlier opcode
+        op.IS_WORD_JUMP = the argument counts 2-byte words, not bytes
+        op.IS_BRANCH = a jump that ends a basic block, which leaves out the
+                       opcodes that set up loops and blocks (SETUP_*,
+                       FOR_ITER and CONTINUE_LOOP)
+        op.IS_EXIT = leaves the code object (return or raise)
+        op.USES_NAMES = the argument is an index into co_names
+        op.USES_VARNAMES = the argument is an index into co_varnames
+
+        if op.opcode_flags[opcode] & op.IS_JUMP:
+            ...
+
+    The jump flags in this table describe the bytecode from before
+    wordcode. Jumps changed in Python 3.10 and 3.11, so use
+    op.flags_table(magic) for the flags of a particular magic number.
+
+op.flags_table(magic)
+    Returns op.opcode_flags with the jump flags of the given magic number.
+    For the wordcode magic number of the running interpreter these come
+    from the interpreter's opcode module (opcode.hasjrel and opcode.hasjabs).
+
+op.jump_target(magic, opcode, offset, size, argument)
+    Returns the bytecode offset that a jump in a *.pyc file with the given
+    magic number jumps to, given the opcode, its offset and size and its
+    raw argument. Relative jumps in Python 3.12 and later skip the CACHE
+    entries after the opcode.
+
+        flags = op.flags_table(module.magic)
+        if flags[o.opcode] & op.IS_JUMP:
+            target = op.jump_target(module.magic, o.opcode, o.offset, o.size, o.argument)
+
 op.has_argument(opcode)
     Returns True if opcode takes an argument when represented in bytecode,
     otherwise returns False.
@@ -26,10 +81,56 @@ op.has_kwonlyargcount(magic)
     number will have the co_kwonlyargcount property, otherwise returns
     False.
 
+op.header_size(magic)
+    Returns the number of bytes in the header of *.pyc files with the
+    given magic number: 8 (magic number and timestamp) before Python 3.3,
+    12 (and the size of the source) before Python 3.7, and 16 (and the
+    flags of PEP 552) from then on.
+
+op.has_marshal_refs(magic)
+    Returns True if *.pyc files with the given magic number were written by
+    marshal version 3 or later (Python 3.4 and later). These share repeated
+    objects through references (FLAG_REF and TYPE_REF), have short ASCII
+    string types, and store bytes rather than text with TYPE_STRING.
+
+op.code_fields(magic)
+    Returns a tuple of the names of the fields of a marshalled code object
+    in the order they appear in *.pyc files with the given magic number,
+    such as ('co_argcount', 'co_posonlyargcount', ...). Python 3.11 and
+    later store co_localsplusnames and co_localspluskinds instead of
+    co_nlocals, co_varnames, co_freevars and co_cellvars.
+
+op.argument_shifts(magic)
+    Returns a dict mapping the opcodes that store flags in the low bits of
+    their argument (LOAD_GLOBAL in Python 3.11, for example) to the number
+    of those bits, for the given magic number. The rest of the argument is
+    the index into co_names.
+
+op.is_wordcode(magic)
+    Returns True if *.pyc files with the given magic number store bytecode
+    as wordcode (Python 3.6 and later), where every opcode takes two bytes:
+    the bytecode and an 8-bit argument. Only the wordcode magic number of
+    the running interpreter is known, since its opcodes come from the
+    interpreter's opcode module.
+
 op.from_bytecode(bytecode, magic)
     Given bytecode, an 8-bit integer, and magic, the 32-bit magic number
-    from a marshalled *.pyc file, produce a string with the name of the
-    opcode or None for an invalid bytecode.
+    from a marshalled *.pyc file, produce the opcode (see op.OpcodeId) or
+    None for an invalid bytecode.
+
+op.decode_table(magic)
+    Returns a tuple of 256 entries where entry n is the opcode (see
+    op.OpcodeId) with bytecode n for the given magic number, or None for an invalid
+    bytecode. Tables are built once per magic number and shared, so this
+    is much faster than calling op.from_bytecode() for every opcode.
+
+op.decode_ids(magic)
+    The table of op.decode_table(magic) as a bytes object for use with
+    bytes.translate(), with op.INVALID_ID for an invalid bytecode.
+
+op.INVALID_ID
+    0xFF, a byte that is no opcode id and marks invalid bytecodes in
+    op.decode_ids() and other tables of opcode ids stored as bytes.
 
 op.python_version_from_magic(magic)
     Returns a string with the Python interpreter version ("2.7b2+" for
@@ -38,14 +139,18 @@ op.python_version_from_magic(magic)
     readable interpretation of a magic number.
 
 op.LOAD_NAME, op.STORE_NAME, ...
-    All opcodes are available as global names so typos result in runtime
-    failures instead of silently failing string comparisons.
+    All opcodes are available as global names for their value in
+    op.OpcodeId.
 '''
 
 import os
 import re
+import enum
 import pickle
+import struct
+import platform
 import tempfile
+from bisect import bisect_left
 
 # Helper to run a command, also prints it for debugging
 def _run(command):
@@ -245,21 +350,175 @@ _has_kwonlyargcount = _get_cached(os.path.join(_dir, 'has_kwonlyargcount.pickle'
 _revisions = sorted([_Revision(_m, _o, _h) for _m, _o, _h in zip(_magic_info, _opcodes, _has_kwonlyargcount)], key=lambda x: x.magic)
 opcodes, _has_argument = _differentiate_opcodes_by_argument(_revisions)
 
+def is_wordcode(magic):
+    '''
+    Returns True if *.pyc files with the given magic number store bytecode
+    as wordcode, otherwise returns False.
+    '''
+    return magic >> 16 == 0x0A0D and 3370 <= magic & 0xFFFF < 20000
+
+# The revisions above end before wordcode was introduced in Python 3.6, whose
+# opcodes can't be found in Include/opcode.h of the old repository. Instead,
+# the opcode module of the running interpreter provides the opcodes for its own
+# magic number. Names are normalized the same way (see
+# _differentiate_opcodes_by_argument()).
+def _gen_host_revision():
+    try:
+        import opcode
+        import importlib.util
+    except ImportError:
+        return None
+    magic = struct.unpack('=I', importlib.util.MAGIC_NUMBER)[0]
+    if not is_wordcode(magic):
+        return None
+    names = {'HAVE_ARGUMENT': opcode.HAVE_ARGUMENT}
+    for name, value in opcode.opmap.items():
+        if value > 0xFF:
+            continue
+        has_arg = value >= opcode.HAVE_ARGUMENT
+        if name in opcodes and (name in _has_argument) != has_arg:
+            name += '_ARG' if has_arg else '_NOARG'
+        names[name] = value
+    return _Revision((None, magic, platform.python_version()), names, True)
+
+# Opcodes that only exist in wordcode are numbered after all the others, so
+# the ids of the older opcodes don't depend on the running interpreter
+_host_revision = _gen_host_revision()
+_wordcode_revisions = {}
+_wordcode_names = []
+if _host_revision:
+    _wordcode_revisions[_host_revision.magic] = _host_revision
+    _wordcode_names = sorted(set(_host_revision.opcode_to_name.values()) - opcodes)
+    _has_argument |= set(name for name in _host_revision.opcode_to_name.values() if _host_revision.has_argument(name))
+opcode_names = tuple(sorted(opcodes)) + tuple(_wordcode_names)
+opcodes |= set(_wordcode_names)
+opcode_ids = dict((_name, _id) for _id, _name in enumerate(opcode_names))
+OpcodeId = enum.IntEnum('OpcodeId', [(_name, _id) for _id, _name in enumerate(opcode_names)], module=__name__)
+
+# Flags for op.opcode_flags
+HAS_ARGUMENT = 1
+IS_JUMP = 2
+IS_RELATIVE_JUMP = 4
+IS_EXIT = 8
+USES_NAMES = 16
+USES_VARNAMES = 32
+IS_BRANCH = 64
+IS_BACKWARD_JUMP = 128
+IS_WORD_JUMP = 256
+
+_JUMP_FLAGS = IS_JUMP | IS_RELATIVE_JUMP | IS_BACKWARD_JUMP | IS_WORD_JUMP | IS_BRANCH
+
+# The jumps of the bytecode before wordcode. Branches are the jumps that end
+# basic blocks in passes.ComputeBasicBlocks.
+_flag_names = [
+    (IS_JUMP | IS_BRANCH, ['JUMP_ABSOLUTE', 'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP',
+                           'JUMP_IF_TRUE_OR_POP']),
+    (IS_JUMP | IS_RELATIVE_JUMP | IS_BRANCH, ['JUMP_FORWARD', 'JUMP_IF_FALSE', 'JUMP_IF_TRUE']),
+    (IS_JUMP, ['CONTINUE_LOOP']),
+    (IS_JUMP | IS_RELATIVE_JUMP, ['FOR_ITER', 'FOR_LOOP', 'SETUP_LOOP', 'SETUP_EXCEPT', 'SETUP_FINALLY',
+                                  'SETUP_WITH']),
+    (IS_EXIT, ['RETURN_VALUE', 'RETURN_NONE', 'RETURN_CONST', 'RAISE_EXCEPTION', 'RAISE_VARARGS', 'RERAISE']),
+    (USES_NAMES, ['LOAD_NAME', 'STORE_NAME', 'DELETE_NAME', 'LOAD_ATTR', 'STORE_ATTR', 'DELETE_ATTR',
+                  'LOAD_GLOBAL', 'STORE_GLOBAL', 'DELETE_GLOBAL', 'IMPORT_NAME', 'IMPORT_FROM']),
+    (USES_VARNAMES, ['LOAD_FAST', 'STORE_FAST', 'DELETE_FAST']),
+]
+
+def _gen_flags():
+    flags = [HAS_ARGUMENT if name in _has_argument else 0 for name in opcode_names]
+    for flag, names in _flag_names:
+        for name in names:
+            if name in opcode_ids:
+                flags[opcode_ids[name]] |= flag
+    return tuple(flags)
+
+opcode_flags = _gen_flags()
+
+# The flags of the running interpreter's wordcode, whose jumps don't match the
+# table above: Python 3.10 counts jump arguments in words instead of bytes and
+# Python 3.11 made every jump relative, with separate opcodes for jumping
+# backward. The jump opcodes come from the opcode module instead, and like
+# dis, the ones named JUMP_BACKWARD* or POP_JUMP_BACKWARD_* jump backward.
+# Relative jumps count from the end of the CACHE entries after the opcode,
+# which Python 3.12 and later have after some jumps, so their number is
+# returned too as a tuple indexed by opcode.
+def _gen_host_flags(revision):
+    import opcode
+    flags = list(opcode_flags)
+    caches = [0] * len(opcode_names)
+    relative = set(opcode.hasjrel)
+    absolute = set(opcode.hasjabs)
+    entries = getattr(opcode, '_inline_cache_entries', None) or {}
+    words = IS_WORD_JUMP if revision.magic & 0xFFFF >= 3435 else 0
+    for value, name in revision.opcode_to_name.items():
+        opcode_id = opcode_ids[name]
+        flags[opcode_id] &= ~_JUMP_FLAGS
+        branch = IS_BRANCH if 'JUMP' in name else 0
+        if value in relative:
+            flags[opcode_id] |= IS_JUMP | IS_RELATIVE_JUMP | words | branch
+            if 'JUMP_BACKWARD' in name:
+                flags[opcode_id] |= IS_BACKWARD_JUMP
+        elif value in absolute:
+            flags[opcode_id] |= IS_JUMP | words | branch
+
+        # A list indexed by bytecode until Python 3.13, then a dict by name
+        if isinstance(entries, dict):
+            caches[opcode_id] = entries.get(opcode.opname[value], 0)
+        elif value < len(entries):
+            caches[opcode_id] = entries[value]
+    return tuple(flags), tuple(caches)
+
+_flags_tables = {}
+_cache_tables = {}
+if _host_revision:
+    _flags_tables[_host_revision.magic], _cache_tables[_host_revision.magic] = _gen_host_flags(_host_revision)
+
+def flags_table(magic):
+    '''
+    Returns a tuple of the flags of every opcode like op.opcode_flags, with
+    the jump flags of *.pyc files with the given magic number.
+    '''
+    return _flags_tables.get(magic, opcode_flags)
+
+def jump_target(magic, opcode, offset, size, argument):
+    '''
+    Returns the offset that opcode, a jump at the given offset with the given
+    size and raw argument in a *.pyc file with the given magic number, jumps
+    to.
+    '''
+    flags = flags_table(magic)[opcode]
+    if flags & IS_WORD_JUMP:
+        argument *= 2
+    if flags & IS_RELATIVE_JUMP:
+        caches = _cache_tables.get(magic)
+        offset += size + (2 * caches[opcode] if caches else 0)
+        return offset - argument if flags & IS_BACKWARD_JUMP else offset + argument
+    return argument
+
+# Every opcode id fits in a byte, with 0xFF left over to mark invalid bytecodes
+# in op.decode_ids()
+INVALID_ID = 0xFF
+assert len(opcode_names) < INVALID_ID
+
 # Return the revision with the given magic number. Just in case we try to
 # disassemble a *.pyc file with a magic version that doesn't match any ever
 # committed to the official repo, we return the revision with the smallest
-# magic number above magic.
+# magic number above magic. Wordcode magic numbers must match exactly. The
+# revisions are searched by bisection, which is fast enough for reading
+# headers and leaves nothing to update after the module is imported.
+_revision_magics = [_rev.magic for _rev in _revisions]
+
 def _magic_to_revision(magic):
-    for rev in _revisions:
-        if rev.magic >= magic:
-            return rev
+    if is_wordcode(magic):
+        return _wordcode_revisions.get(magic)
+    index = bisect_left(_revision_magics, magic)
+    return _revisions[index] if index < len(_revisions) else None
 
 def has_argument(opcode):
     '''
     Returns True if opcode takes an argument when represented in bytecode,
     otherwise returns False.
     '''
-    return opcode in _has_argument
+    return bool(opcode_flags[opcode] & HAS_ARGUMENT)
 
 def has_kwonlyargcount(magic):
     '''
@@ -267,9 +526,76 @@ def has_kwonlyargcount(magic):
     number will have the co_kwonlyargcount property, otherwise returns
     False.
     '''
+    if has_marshal_refs(magic):
+        return True
     revision = _magic_to_revision(magic)
     return revision and revision.has_kwonlyargcount
 
+def header_size(magic):
+    '''
+    Returns the number of bytes in the header of *.pyc files with the given
+    magic number, 8, 12 or 16.
+    '''
+    version = magic & 0xFFFF
+    if magic >> 16 != 0x0A0D or not 3210 <= version < 20000:
+        return 8
+    return 16 if version >= 3392 else 12
+
+def has_marshal_refs(magic):
+    '''
+    Returns True if *.pyc files with the given magic number were written by
+    marshal version 3 or later (Python 3.4 and later), otherwise returns
+    False.
+    '''
+    return magic >> 16 == 0x0A0D and 3250 <= magic & 0xFFFF < 20000
+
+# Fields of a marshalled code object in the order they're written. Releases
+# after Python 3.7 added fields, and magic numbers from before a release (the
+# alphas) use the layout of that release.
+_CODE_FIELDS = ('co_argcount', 'co_nlocals', 'co_stacksize', 'co_flags', 'co_code', 'co_consts',
+                'co_names', 'co_varnames', 'co_freevars', 'co_cellvars', 'co_filename', 'co_name',
+                'co_firstlineno', 'co_lnotab')
+_CODE_FIELDS_KWONLY = _CODE_FIELDS[:1] + ('co_kwonlyargcount',) + _CODE_FIELDS[1:]
+_CODE_FIELDS_38 = _CODE_FIELDS_KWONLY[:1] + ('co_posonlyargcount',) + _CODE_FIELDS_KWONLY[1:]
+_CODE_FIELDS_310 = _CODE_FIELDS_38[:-1] + ('co_linetable',)
+_CODE_FIELDS_311 = ('co_argcount', 'co_posonlyargcount', 'co_kwonlyargcount', 'co_stacksize', 'co_flags',
+                    'co_code', 'co_consts', 'co_names', 'co_localsplusnames', 'co_localspluskinds',
+                    'co_filename', 'co_name', 'co_qualname', 'co_firstlineno', 'co_linetable',
+                    'co_exceptiontable')
+
+def code_fields(magic):
+    '''
+    Returns a tuple of the names of the fields of a code object in the order
+    they're marshalled in *.pyc files with the given magic number.
+    '''
+    version = magic & 0xFFFF
+    if not is_wordcode(magic):
+        return _CODE_FIELDS_KWONLY if has_kwonlyargcount(magic) else _CODE_FIELDS
+    elif version >= 3450:
+        return _CODE_FIELDS_311
+    elif version >= 3431:
+        return _CODE_FIELDS_310
+    elif version >= 3410:
+        return _CODE_FIELDS_38
+    return _CODE_FIELDS_KWONLY
+
+# Opcodes that pack flags into the low bits of their argument below the index
+# into co_names, with the first magic number that does so
+_argument_shifts = [
+    (3488, 'LOAD_GLOBAL', 1),  # Python 3.11 pushes NULL before the global if set
+    (3500, 'LOAD_ATTR', 1),    # Python 3.12 loads a method if set
+]
+
+def argument_shifts(magic):
+    '''
+    Returns a dict mapping opcodes to the number of flag bits stored below the
+    index into co_names in their argument, for opcodes that do that in *.pyc
+    files with the given magic number.
+    '''
+    if not is_wordcode(magic):
+        return {}
+    return dict((opcode_ids[name], shift) for first, name, shift in _argument_shifts if magic & 0xFFFF >= first)
+
 def from_bytecode(bytecode, magic):
     '''
     Given bytecode, an 8-bit integer, and magic, the 32-bit magic number
@@ -278,7 +604,37 @@ def from_bytecode(bytecode, magic):
     '''
     revision = _magic_to_revision(magic)
     if revision and bytecode in revision.opcode_to_name:
-        return revision.opcode_to_name[bytecode]
+        return opcode_ids[revision.opcode_to_name[bytecode]]
+
+# Decode tables by magic number, built on first use. Threads that build the
+# same table at once build equal tables and setdefault() makes them all use
+# the one that was stored first.
+_decode_tables = {}
+
+def decode_table(magic):
+    '''
+    Returns a tuple mapping every 8-bit bytecode to an opcode (or None
+    for an invalid bytecode) for *.pyc files with the given magic number.
+    '''
+    table = _decode_tables.get(magic)
+    if table is None:
+        revision = _magic_to_revision(magic)
+        names = revision.opcode_to_name if revision else {}
+        table = _decode_tables.setdefault(magic, tuple(opcode_ids.get(names.get(b)) for b in range(256)))
+    return table
+
+_decode_ids = {}
+
+def decode_ids(magic):
+    '''
+    Returns the same table as op.decode_table(magic) as 256 bytes, with
+    op.INVALID_ID for an invalid bytecode, to decode many bytecodes at once with
+    bytes.translate().
+    '''
+    ids = _decode_ids.get(magic)
+    if ids is None:
+        ids = _decode_ids.setdefault(magic, bytes(INVALID_ID if opcode is None else opcode for opcode in decode_table(magic)))
+    return ids
 
 def python_version_from_magic(magic):
     '''
@@ -293,4 +649,4 @@ def python_version_from_magic(magic):
 
 # Add a global name for each opcode to allow the syntax "op.OPCODE"
 for _name in opcodes:
-    globals()[_name] = _name
+    globals()[_name] = opcode_ids[_name]
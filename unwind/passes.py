@@ -1,6 +1,9 @@
 import unwind.op as op
 import unwind.disasm as disasm
+import unwind.instrument as instrument
 from unwind.ast import *
+from unwind.budget import BudgetExceeded
+from unwind.passmanager import Pass, Fixpoint, PassManager
 
 ################################################################################
 # class CodeObjectsToNodes
@@ -17,7 +20,9 @@ class CodeObjectsToNodes:
         if isinstance(value, disasm.Module):
             return self._covert(value.body)
         elif isinstance(value, disasm.CodeObject):
-            return Block(*[self._convert(x) for x in value.opcodes])
+            block = Block(*[self._convert(x) for x in value.opcodes])
+            block.code = value
+            return block
         elif isinstance(value, disasm.Opcode):
             arg = value.argument
             if isinstance(arg, list): arg = List(*[self._convert(x) for x in arg])
@@ -25,10 +30,33 @@ class CodeObjectsToNodes:
             elif isinstance(arg, set): arg = Call(Ident('set'), Tuple(*[self._convert(x) for x in arg]))
             elif isinstance(arg, frozenset): arg = Call(Ident('frozenset'), Tuple(*[self._convert(x) for x in arg]))
             else: arg = self._convert(arg)
-            return Opcode(value.offset, value.size, value.opcode, arg if op.has_argument(value.opcode) else None)
+            return Opcode(value.offset, value.size, value.opcode, arg if op.opcode_flags[value.opcode] & op.HAS_ARGUMENT else None)
         else:
             return Const(value)
 
+# Returns the undecompiled opcodes of a disasm.CodeObject as an Asm block that
+# starts with a comment saying why it wasn't decompiled
+def as_asm(code, reason):
+    asm = Asm(Comment('unwind: %s, emitted as bytecode' % reason), *CodeObjectsToNodes()._convert(code).nodes)
+    asm.code = code
+    asm.span = merge_spans(*[(o.offset, o.offset + o.size) for o in asm.nodes[1:]])
+    return asm
+
+# Run transform(node) on a block that was converted from a code object with
+# the time spent charged to that code object. If it exceeds its budget, the
+# block is replaced by the undecompiled opcodes of the code object instead.
+def _within_budget(meter, node, transform):
+    if meter is None or node.code is None:
+        return transform(node)
+    try:
+        with meter.measure(node.code, len(node.code.opcodes)):
+            return transform(node)
+    except BudgetExceeded as e:
+        if e.code is not node.code:
+            raise
+        meter.record(e)
+        return as_asm(node.code, e)
+
 ################################################################################
 # class ComputeBasicBlocks
 # 
@@ -38,22 +66,20 @@ class CodeObjectsToNodes:
 # recover control structures.
 ################################################################################
 
-_absolute_jumping_opcodes = [op.POP_JUMP_IF_TRUE, op.JUMP_IF_FALSE_OR_POP, op.POP_JUMP_IF_FALSE, op.JUMP_IF_TRUE_OR_POP, op.JUMP_ABSOLUTE]
-_relative_jumping_opcodes = [op.JUMP_IF_FALSE, op.JUMP_IF_TRUE, op.JUMP_FORWARD]
-_jumping_opcodes = _absolute_jumping_opcodes + _relative_jumping_opcodes
-_exiting_opcodes = [op.RETURN_VALUE, op.RETURN_NONE, op.RAISE_EXCEPTION, op.RAISE_VARARGS]
-
 class ComputeBasicBlocks(ReplacementVisitor):
+    def __init__(self, meter=None, magic=None):
+        self.meter = meter
+        self.magic = magic
+        self.flags = op.flags_table(magic)
+
     def run(self, node):
         return node.accept(self)
 
     def get_targets(self, o):
         targets = []
-        if o.op in _jumping_opcodes:
-            if o.op in _relative_jumping_opcodes:
-                targets.append(o.arg.value + o.offset + o.size)
-            else:
-                targets.append(o.arg.value)
+        flags = self.flags[o.op]
+        if flags & op.IS_BRANCH:
+            targets.append(op.jump_target(self.magic, o.op, o.offset, o.size, o.arg.value))
             targets.append(o.offset + o.size)
         return targets
 
@@ -65,7 +91,7 @@ class ComputeBasicBlocks(ReplacementVisitor):
             if not jump_targets:
                 jump_targets.add(o.offset)
             jump_targets |= set(self.get_targets(o))
-            if o.op in _exiting_opcodes:
+            if self.flags[o.op] & op.IS_EXIT:
                 jump_targets.add(o.offset + o.size)
 
         # Construct the basic blocks using the jump targets
@@ -87,9 +113,12 @@ class ComputeBasicBlocks(ReplacementVisitor):
         for bb in bb_list:
             last = bb.nodes[-1]
             bb.next = [start_to_bb[s] for s in self.get_targets(last)]
-            if not bb.next and last.op not in _exiting_opcodes and last.offset + last.size in start_to_bb:
+            if not bb.next and not self.flags[last.op] & op.IS_EXIT and last.offset + last.size in start_to_bb:
                 bb.next.append(start_to_bb[last.offset + last.size])
 
+        profile = instrument.current()
+        if profile:
+            profile.count('basic_blocks', len(bb_list))
         return bb_list
 
     # Compute dominators for all basic blocks in blocks starting from start.
@@ -110,9 +139,16 @@ class ComputeBasicBlocks(ReplacementVisitor):
 
         # Iteratively refine dominators until convergence
         changed = True
+        iterations = 0
+        meter = self.meter
         while changed:
+            iterations += 1
             changed = False
+            if meter:
+                meter.check(iterations)
             for b in pending:
+                if meter:
+                    meter.check()
                 dominators = set(blocks)
                 for prev in b.prev:
                     dominators &= prev.dominators
@@ -120,6 +156,9 @@ class ComputeBasicBlocks(ReplacementVisitor):
                 if dominators != b.dominators:
                     b.dominators = dominators
                     changed = True
+        profile = instrument.current()
+        if profile:
+            profile.count('dominator_iterations', iterations)
 
         # Compute the immediate dominators
         for b in blocks:
@@ -133,6 +172,9 @@ class ComputeBasicBlocks(ReplacementVisitor):
             delattr(b, 'dominators')
 
     def visit_Block(self, node):
+        return _within_budget(self.meter, node, self._visit_Block)
+
+    def _visit_Block(self, node):
         node.nodes = self.create_basic_blocks(node.nodes)
         self.compute_dominators(node.nodes, node.nodes[0])
         return node
@@ -177,6 +219,14 @@ class DecompileControlStructures(ReplacementVisitor):
     def visit_BasicBlock(self, node):
         return self.replace_collection(node)
 
+# the passes that turn a disasm.Module into an AST, run by decomp.decompile()
+# before Context.decompile()
+FRONTEND_PIPELINE = [
+    Pass('CodeObjectsToNodes', lambda node, context: CodeObjectsToNodes()),
+    Pass('ComputeBasicBlocks', lambda node, context: ComputeBasicBlocks(context.meter, context.magic) if context else ComputeBasicBlocks()),
+    Pass('DecompileControlStructures', lambda node, context: DecompileControlStructures()),
+]
+
 ################################################################################
 # Old stuff
 ################################################################################
@@ -201,6 +251,13 @@ opcode_to_binary = {
     'BINARY_XOR': '^',
 }
 
+# opcode_to_binary by op.OpcodeId, including the in-place versions
+_binary_operators = {}
+for _name, _operator in opcode_to_binary.items():
+    for _name in [_name, _name.replace('BINARY_', 'INPLACE_')]:
+        if _name in op.opcode_ids:
+            _binary_operators[op.opcode_ids[_name]] = _operator
+
 compare_to_binary = [
     '<',
     '<=',
@@ -215,10 +272,13 @@ compare_to_binary = [
 ]
 
 class Context:
-    def __init__(self):
+    def __init__(self, report=None, budget=None, magic=None):
         self.global_vars = set()
         self.local_vars = set()
         self.generated_vars = set()
+        self.report = report
+        self.meter = budget.meter() if budget is not None else None
+        self.magic = magic
 
     # TODO: what if there's a global AND a local with the same name?
     # this is possible in bytecode, should rename the local...
@@ -229,13 +289,7 @@ class Context:
         assert isinstance(node, Block)
 
         # perform all transformations (order matters)
-        node = node.accept(StackBasedOpcodeRemover(self))
-        node = node.accept(CombinePrintStatements())
-        node = node.accept(InlineVariables(self, node))
-        node = node.accept(ReconstructDictLiterals(self, node))
-        node = node.accept(InlineVariables(self, node))
-        node = node.accept(CombinePrintStatements())
-        node = node.accept(MakeIdentifiersValid(self, node))
+        node = PassManager(CONTEXT_PIPELINE, self.report).run(node, self)
 
         # add global statements
         if self.global_vars:
@@ -243,6 +297,19 @@ class Context:
 
         return node
 
+# the passes run by Context.decompile(), inlining and dict literal reconstruction
+# each expose opportunities for the other so they are repeated until stable
+CONTEXT_PIPELINE = [
+    Pass('StackBasedOpcodeRemover', lambda node, context: StackBasedOpcodeRemover(context)),
+    Pass('CombinePrintStatements', lambda node, context: CombinePrintStatements()),
+    Fixpoint('InlineAndReconstruct', [
+        Pass('InlineVariables', lambda node, context: InlineVariables(context, node)),
+        Pass('ReconstructDictLiterals', lambda node, context: ReconstructDictLiterals(context, node)),
+    ]),
+    Pass('CombinePrintStatements', lambda node, context: CombinePrintStatements()),
+    Pass('MakeIdentifiersValid', lambda node, context: MakeIdentifiersValid(context, node)),
+]
+
 # run all opcodes through a miniature virtual machine that assigns temporary results to generated variables
 class StackBasedOpcodeRemover(CloneVisitor):
     def __init__(self, context):
@@ -264,33 +331,45 @@ class StackBasedOpcodeRemover(CloneVisitor):
         self.stack.append(name)
         return Assign(Ident(name), node)
 
+    # Each statement is given the span of the opcodes that produced it.
+    # Opcodes that only shuffle the stack extend the previous statement, or
+    # the next one if they come first.
     def visit_Block(self, node):
         block = Block()
+        block.code = node.code
+        pending = None
         for n in node.nodes:
             new_n = n.accept(self)
+            span = (n.offset, n.offset + n.size) if isinstance(n, Opcode) else n.span
             if new_n:
+                new_n.span = merge_spans(pending, span)
+                pending = None
                 block.nodes.append(new_n)
+            elif block.nodes:
+                block.nodes[-1].span = merge_spans(block.nodes[-1].span, span)
+            else:
+                pending = merge_spans(pending, span)
         return block
 
     def visit_Opcode(self, node):
         if node.op == op.LOAD_CONST:
             return self.assign(node.arg)
-        elif node.op in [op.LOAD_GLOBAL, op.LOAD_NAME, op.LOAD_FAST]:
+        elif node.op == op.LOAD_GLOBAL or node.op == op.LOAD_NAME or node.op == op.LOAD_FAST:
             if node.op == op.LOAD_GLOBAL:
                 self.context.global_vars.add(node.arg.value)
             else:
                 self.context.local_vars.add(node.arg.value)
             return self.assign(Ident(node.arg.value))
-        elif node.op in [op.STORE_GLOBAL, op.STORE_NAME, op.STORE_FAST]:
+        elif node.op == op.STORE_GLOBAL or node.op == op.STORE_NAME or node.op == op.STORE_FAST:
             if node.op == op.STORE_GLOBAL:
                 self.context.global_vars.add(node.arg.value)
             else:
                 self.context.local_vars.add(node.arg.value)
             return Assign(Ident(node.arg.value), Ident(self.stack.pop()))
-        elif node.op.startswith('BINARY_') or node.op.startswith('INPLACE_'):
+        elif node.op in _binary_operators:
             b = self.stack.pop()
             a = self.stack.pop()
-            o = opcode_to_binary[node.op.replace('INPLACE_', 'BINARY_')]
+            o = _binary_operators[node.op]
             return self.assign(Binary(o, Ident(a), Ident(b)))
         elif node.op == op.COMPARE_OP:
             b = self.stack.pop()
@@ -399,7 +478,9 @@ class StackBasedOpcodeRemover(CloneVisitor):
             # stack depth cannot change across an if statement
             assert len(old_stack) == len(true_stack)
 
-        return If(cond, true, false)
+        result = If(cond, true, false)
+        result.span = node.span
+        return result
 
 # find the number of times every identifier is read from and written to
 class FindUses(DefaultVisitor):
@@ -459,6 +540,8 @@ class EvaluationOrder(DefaultVisitor):
 
 # combine "print x,; print y,; print" to "print x, y"
 class CombinePrintStatements(CloneVisitor):
+    changed = False
+
     def visit_Block(self, node):
         node = CloneVisitor.visit_Block(self, node)
         i = 0
@@ -466,7 +549,9 @@ class CombinePrintStatements(CloneVisitor):
             a, b = node.nodes[i:i + 2]
             if isinstance(a, PrintNoNewline) and (isinstance(b, Print) or isinstance(b, PrintNoNewline)):
                 b.nodes = a.nodes + b.nodes
+                b.span = merge_spans(a.span, b.span)
                 del node.nodes[i]
+                self.changed = True
             else:
                 i += 1
         return node
@@ -477,6 +562,7 @@ class CombinePrintStatements(CloneVisitor):
 class ReconstructDictLiterals(CloneVisitor):
     def __init__(self, context, node):
         self.context = context
+        self.changed = False
 
         # find all generated variables with exactly one read and one write
         self.one_read_one_write = set()
@@ -491,6 +577,7 @@ class ReconstructDictLiterals(CloneVisitor):
     def visit_Block(self, node):
         nodes = [n.accept(self) for n in node.nodes]
         block = Block()
+        block.code = node.code
         i = 0
         while i < len(nodes):
             n = nodes[i]
@@ -519,6 +606,8 @@ class ReconstructDictLiterals(CloneVisitor):
                         ):
                         break
                     n.right.nodes.append(DictItem(key.right, value.right))
+                    n.span = merge_spans(n.span, value.span, key.span, store.span)
+                    self.changed = True
                     i += 3
 
         return block
@@ -539,6 +628,7 @@ class MakeIdentifiersValid(CloneVisitor):
         self.context = context
         self.name_iter = iter(gen_name())
         self.name_map = {}
+        self.changed = False
 
     def visit_Ident(self, node):
         old_name = node.name
@@ -559,6 +649,9 @@ class MakeIdentifiersValid(CloneVisitor):
             self.context.generated_vars.add(new_name)
             self.name_map[old_name] = new_name
 
+        if not is_valid:
+            self.changed = True
+
         return Ident(self.name_map[old_name])
 
 # inline variables that are only used and defined once (most often generated variables)
@@ -578,6 +671,7 @@ class InlineVariables(CloneVisitor):
     def __init__(self, context, node):
         # find all reads and writes of all variables within node
         self.context = context
+        self.changed = False
         self.uses = FindUses()
         node.accept(self.uses)
 
@@ -590,12 +684,27 @@ class InlineVariables(CloneVisitor):
                 self.inline_candidates.add(v)
 
     def visit_Block(self, node):
+        result = _within_budget(self.context.meter, node, self._visit_Block)
+        if isinstance(result, Asm):
+            self.changed = True
+        return result
+
+    def _visit_Block(self, node):
+        code = node.code
+        meter = self.context.meter
+        rounds = 0
         while True:
             is_changed = False
+            rounds += 1
+            if meter:
+                meter.check(rounds)
 
             block = Block()
+            block.code = code
             i = 0
             while i < len(node.nodes):
+                if meter:
+                    meter.check()
                 # find a run of writes to names in self.inline_candidates
                 j = i
                 names = []
@@ -629,10 +738,16 @@ class InlineVariables(CloneVisitor):
 
                     # convert to parallel assignment if possible
                     if len(results) >= 2 and all(isinstance(n, Assign) and isinstance(n.left, Ident) for n in results):
+                        span = merge_spans(*[n.span for n in results])
                         results = [Assign(
                             Tuple(*[n.left for n in results]),
                             Tuple(*[n.right for n in results]),
                         )]
+                        results[0].span = span
+
+                    # the inlined assignments are now part of the first statement
+                    if results:
+                        results[0].span = merge_spans(results[0].span, *[n.span for n in node.nodes[i:i + len(names)]])
 
                     # check that the evaluation order didn't change
                     before = EvaluationOrder.get_order(node.nodes[i:j], names)
@@ -640,10 +755,12 @@ class InlineVariables(CloneVisitor):
 
                     # only accept the inline if the evaluation order is the same
                     if before == after:
+                        instrument.count('inlines_accepted')
                         block.nodes += results
                         i = j
                         is_changed = True
                         continue
+                    instrument.count('inlines_rejected')
 
                 # it didn't work, clone the node as usual
                 block.nodes.append(node.nodes[i].accept(self))
@@ -651,6 +768,7 @@ class InlineVariables(CloneVisitor):
 
             # do another inlining pass if we changed things on this pass
             if is_changed:
+                self.changed = True
                 node = block
             else:
                 break
@@ -0,0 +1,253 @@
+'''
+passmanager.Pass(name, create)
+    A single step of a pipeline. create(node, context) returns the pass
+    object, which is run with its run(node) method if it has one and is
+    otherwise applied to node as a visitor. A pass reports whether it
+    changed anything by setting its changed attribute to True or False.
+    Otherwise the trees before and after are compared.
+
+passmanager.Fixpoint(name, passes, max_iterations=10)
+    A group of passes that is repeated until a whole round of the group
+    leaves the tree unchanged (or max_iterations rounds have run). A pass
+    that reported no change is skipped while its input stays the same.
+
+passmanager.PassManager(pipeline, report=None, trace_allocations=False)
+    Runs a declared pipeline of Pass and Fixpoint instances. Every pass
+    that runs (or is skipped) is recorded in self.report, a PassReport.
+    If trace_allocations is True, tracemalloc is used to record how much
+    memory each pass allocates, which slows everything down considerably.
+
+passmanager.PassReport, passmanager.PassRecord
+    The structured report produced by a PassManager. Use as_dict() to get
+    plain lists and dicts suitable for JSON.
+
+passmanager.count_nodes(node)
+    Returns the number of AST nodes in the tree rooted at node.
+'''
+
+import time
+import tracemalloc
+import unwind.instrument as instrument
+from unwind.ast import Node
+
+class Pass:
+    '''
+    A single step of a pipeline.
+
+        self.name = name used in the report
+        self.create = function(node, context) that returns the pass object
+    '''
+
+    def __init__(self, name, create):
+        self.name = name
+        self.create = create
+
+    def run(self, node, context):
+        '''
+        Returns a tuple of the transformed node and whether the pass changed
+        anything (None when that's unknown).
+        '''
+        p = self.create(node, context)
+        result = p.run(node) if hasattr(p, 'run') else node.accept(p)
+        return result, getattr(p, 'changed', None)
+
+class Fixpoint:
+    '''
+    A group of passes that is repeated until the tree stops changing.
+
+        self.name = name used in the report
+        self.passes = list of passmanager.Pass instances
+        self.max_iterations = upper bound on the number of rounds
+    '''
+
+    def __init__(self, name, passes, max_iterations=10):
+        self.name = name
+        self.passes = passes
+        self.max_iterations = max_iterations
+
+class PassRecord:
+    '''
+    What happened when a pass was run.
+
+        self.name = name of the pass
+        self.group = name of the enclosing Fixpoint or None
+        self.iteration = round of the enclosing Fixpoint, starting at 1
+        self.seconds = wall time spent in the pass
+        self.allocated = net bytes allocated, None if not traced
+        self.peak = peak bytes allocated, None if not traced
+        self.nodes_before = number of nodes in the input tree
+        self.nodes_after = number of nodes in the output tree
+        self.changed = True if the tree changed, False if it didn't and
+                       None if the pass works in place so it can't be told
+        self.skipped = True if the pass wasn't run because its input was
+                       the same as last time, or because decomp.decompile()
+                       found the result in its cache
+    '''
+
+    def __init__(self, name, group, iteration):
+        self.name = name
+        self.group = group
+        self.iteration = iteration
+        self.seconds = 0.0
+        self.allocated = None
+        self.peak = None
+        self.nodes_before = None
+        self.nodes_after = None
+        self.changed = None
+        self.skipped = False
+
+    def as_dict(self):
+        return dict((f, getattr(self, f)) for f in [
+            'name', 'group', 'iteration', 'seconds', 'allocated', 'peak',
+            'nodes_before', 'nodes_after', 'changed', 'skipped'])
+
+    def __repr__(self):
+        return 'PassRecord(%s)' % ', '.join('%s = %s' % (k, repr(v)) for k, v in sorted(self.as_dict().items()))
+
+class PassReport:
+    '''
+    The structured report produced by a PassManager.
+
+        self.records = list of passmanager.PassRecord instances in the order
+                       the passes ran
+        self.iterations = map of Fixpoint name to the number of rounds run
+    '''
+
+    def __init__(self):
+        self.records = []
+        self.iterations = {}
+
+    def total_seconds(self):
+        return sum(r.seconds for r in self.records)
+
+    def seconds_by_pass(self):
+        result = {}
+        for r in self.records:
+            result[r.name] = result.get(r.name, 0.0) + r.seconds
+        return result
+
+    def as_dict(self):
+        return {
+            'total_seconds': self.total_seconds(),
+            'iterations': dict(self.iterations),
+            'passes': [r.as_dict() for r in self.records],
+        }
+
+def count_nodes(node):
+    '''
+    Returns the number of AST nodes in the tree rooted at node, or None if
+    node isn't an AST node (the disassembled module before conversion).
+    '''
+    if not isinstance(node, Node):
+        return None
+    count = 0
+    pending = [node]
+    while pending:
+        n = pending.pop()
+        count += 1
+        pending += n.nodes if hasattr(n, 'nodes') else n.children()
+    return count
+
+class PassManager:
+    '''
+    Runs a declared pipeline of passes and records what each one did.
+
+        self.pipeline = list of passmanager.Pass and passmanager.Fixpoint
+        self.report = passmanager.PassReport that records are appended to
+        self.trace_allocations = whether to measure memory with tracemalloc
+    '''
+
+    def __init__(self, pipeline, report=None, trace_allocations=False):
+        self.pipeline = pipeline
+        self.report = report if report is not None else PassReport()
+        self.trace_allocations = trace_allocations
+
+    def run(self, node, context=None):
+        '''
+        Run every step of the pipeline on node and return the result.
+        context is passed through to every pass.
+        '''
+        started_tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self._counted = None
+        try:
+            for step in self.pipeline:
+                if isinstance(step, Fixpoint):
+                    node = self._run_fixpoint(step, node, context)
+                else:
+                    node = self._run_pass(step, node, context, None, 1)[0]
+        finally:
+            self._counted = None
+            if started_tracing:
+                tracemalloc.stop()
+        return node
+
+    def _run_fixpoint(self, group, node, context):
+        # Maps each pass to the tree it returned unchanged the last time it
+        # ran. If a pass would be given that same tree again, it would just
+        # return it again, so it can be skipped.
+        unchanged_output = {}
+        iteration = 0
+        while iteration < group.max_iterations:
+            iteration += 1
+            round_changed = False
+            for p in group.passes:
+                if unchanged_output.get(p) is node:
+                    record = PassRecord(p.name, group.name, iteration)
+                    record.skipped = True
+                    self.report.records.append(record)
+                    continue
+                node, record = self._run_pass(p, node, context, group.name, iteration)
+                if record.changed is False:
+                    unchanged_output[p] = node
+                else:
+                    unchanged_output.pop(p, None)
+                    round_changed = True
+            if not round_changed:
+                break
+        self.report.iterations[group.name] = iteration
+        return node
+
+    # The output of one pass is the input of the next, so remember the last
+    # count to avoid walking every tree twice
+    def _count(self, node):
+        if self._counted is None or self._counted[0] is not node:
+            self._counted = (node, count_nodes(node))
+        return self._counted[1]
+
+    def _run_pass(self, p, node, context, group, iteration):
+        record = PassRecord(p.name, group, iteration)
+        record.nodes_before = self._count(node)
+
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        start = time.time()
+        with instrument.phase(p.name):
+            result, changed = p.run(node, context)
+        record.seconds = time.time() - start
+        if self.trace_allocations:
+            after, peak = tracemalloc.get_traced_memory()
+            record.allocated = after - before
+            record.peak = peak - before
+
+        # Passes that neither report changes nor return a new tree work in
+        # place, so whether they changed anything can't be told
+        if changed is None and result is not node and isinstance(result, Node) and isinstance(node, Node):
+            changed = not (result == node)
+        record.changed = changed
+        if changed is False:
+            result = node
+        else:
+            self._counted = None
+        record.nodes_after = self._count(result)
+
+        # A pass visits every node of its input tree, so that's what the
+        # profile counts rather than hooking every call to accept()
+        profile = instrument.current()
+        if profile is not None and record.nodes_before is not None:
+            profile.visit(p.name, record.nodes_before)
+
+        self.report.records.append(record)
+        return result, record
@@ -0,0 +1,409 @@
+'''
+server.Server(path, workers=None, batch_size=16, batch_delay=0.002)
+    A long-running decompile server listening on a Unix socket at path. The
+    worker processes import unwind once and keep the opcode tables and a
+    decompile cache of their own (see cache.DecompileCache) warm between
+    requests.
+    Requests that arrive within batch_delay seconds of each other are sent
+    to a worker together, up to batch_size at a time, which keeps the cost
+    of handing work to another process low for small files. Also available
+    as "python -m unwind serve --socket PATH". A socket left at path by a
+    server that exited without cleaning up is replaced, but anything else
+    at path, or a socket another server is listening on, raises OSError.
+    If a worker process dies, the requests it was working on fail with
+    BrokenProcessPool and the workers are restarted for the rest.
+
+server.Server.serve_forever(), server.Server.shutdown()
+    Handle requests until shutdown() is called from another thread.
+
+server.Server.latency()
+    Returns a dict with the number of requests handled and the 50th, 90th,
+    99th percentile and maximum time in seconds from receiving a request to
+    sending its response, over the most recent 10000 requests.
+
+server.Client(path)
+    Connects to a server. Client.decompile(path) is a drop-in replacement
+    for unwind.decompile(path) that returns the same source code, and
+    Client.stats() returns the server's latency() dict. A client can be
+    shared between threads.
+
+server.RemoteError
+    Raised by the client for errors other than disasm.DisassemblerException
+    on the server. Apply str() to get the class name and message.
+
+Every message in either direction is a 4-byte big-endian length followed by
+that many bytes of UTF-8 encoded JSON. Requests look like
+{"id": 1, "op": "decompile", "path": "/abs/example.pyc"} where op is
+"decompile", "ping" or "stats", and responses look like {"id": 1, "ok":
+true, "result": "..."} or {"id": 1, "ok": false, "type": "ValueError",
+"error": "..."}. Responses on one connection can arrive out of order.
+'''
+
+import os
+import sys
+import stat
+import json
+import errno
+import time
+import queue
+import signal
+import socket
+import struct
+import threading
+import collections
+import socketserver
+import concurrent.futures
+import concurrent.futures.process
+
+import unwind.disasm as disasm
+
+class RemoteError(Exception):
+    '''
+    Raised by server.Client when a request failed on the server for a
+    reason other than a disasm.DisassemblerException.
+    '''
+
+def _send(sock, message):
+    data = json.dumps(message).encode('utf8')
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+def _receive(sock):
+    header = _receive_exactly(sock, 4)
+    if header is None:
+        return None
+    data = _receive_exactly(sock, struct.unpack('>I', header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf8'))
+
+def _receive_exactly(sock, count):
+    chunks = []
+    while count:
+        chunk = sock.recv(min(count, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        count -= len(chunk)
+    return b''.join(chunks)
+
+# The decompile cache of a worker process, created by _warm_up()
+_worker_cache = None
+
+# Run in a worker process, the import of unwind happens once per worker
+def _run_batch(requests):
+    from unwind.decomp import decompile
+    responses = []
+    for request in requests:
+        try:
+            result = decompile(request['path'], cache=_worker_cache)
+            responses.append({'id': request['id'], 'ok': True, 'result': result})
+        except Exception as e:
+            responses.append({'id': request['id'], 'ok': False, 'type': e.__class__.__name__, 'error': str(e)})
+    return responses
+
+# Workers leave interrupts to the server, which shuts the pool down cleanly
+def _warm_up():
+    global _worker_cache
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import unwind.decomp
+    import unwind.cache
+    _worker_cache = unwind.cache.DecompileCache()
+
+# Handles one client connection, requests are read here and responses are
+# written by whichever thread finishes them
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server.owner
+        lock = threading.Lock()
+        while True:
+            try:
+                request = _receive(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            received = time.time()
+            if not isinstance(request, dict):
+                server._reply(self.request, lock, {'id': None, 'ok': False, 'type': 'ValueError',
+                                                   'error': 'request is not a JSON object'}, None)
+                continue
+            op = request.get('op')
+            if op == 'decompile':
+                server._queue.put((request, self.request, lock, received))
+            elif op == 'ping':
+                server._reply(self.request, lock, {'id': request.get('id'), 'ok': True, 'result': None}, received)
+            elif op == 'stats':
+                server._reply(self.request, lock, {'id': request.get('id'), 'ok': True, 'result': server.latency()}, None)
+            else:
+                server._reply(self.request, lock, {'id': request.get('id'), 'ok': False, 'type': 'ValueError',
+                                                   'error': 'unknown op %r' % op}, None)
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Server:
+    '''
+    A decompile server on a Unix socket. See the module documentation.
+
+        self.path = path of the Unix socket
+        self.batch_size = maximum number of requests sent to a worker at once
+        self.batch_delay = seconds to wait for more requests to fill a batch
+    '''
+
+    def __init__(self, path, workers=None, batch_size=16, batch_delay=0.002):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._latencies = collections.deque(maxlen=10000)
+        self._count = 0
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._workers = workers
+        self._pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+
+        _remove_stale_socket(path)
+        self._server = _UnixServer(path, _Handler)
+        self._server.owner = self
+        self._inode = os.lstat(path).st_ino
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+
+    def serve_forever(self):
+        self._dispatcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._queue.put(None)
+            self._dispatcher.join()
+            self._pool.shutdown()
+            self._server.server_close()
+            # Only remove the socket if it's still the one this server made
+            try:
+                if os.lstat(self.path).st_ino == self._inode:
+                    os.remove(self.path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def latency(self):
+        '''
+        Returns a dict of request count and latency percentiles in seconds.
+        '''
+        with self._stats_lock:
+            samples = sorted(self._latencies)
+            count = self._count
+
+        def percentile(p):
+            if not samples:
+                return None
+            return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+        return {
+            'requests': count,
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': samples[-1] if samples else None,
+        }
+
+    # Collect requests into batches and hand them to the worker pool
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            requests = [request for request, sock, lock, received in batch]
+            pool = self._pool
+            try:
+                try:
+                    future = pool.submit(_run_batch, requests)
+                except concurrent.futures.process.BrokenProcessPool:
+                    pool = self._restart_pool(pool)
+                    future = pool.submit(_run_batch, requests)
+            except Exception as e:
+                # Keep the dispatcher alive, the batch fails but later ones may not
+                self._fail(batch, e)
+                continue
+            future.add_done_callback(lambda future, batch=batch, pool=pool: self._finish(batch, pool, future))
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(self._workers, initializer=_warm_up)
+
+    # A worker that dies breaks the whole pool and every later submit() would
+    # fail, so the pool is replaced. Only the first of the batches that were
+    # running in the broken pool replaces it. The broken pool is shut down
+    # from a thread of its own since Python 3.12 runs the callbacks of its
+    # failed futures while holding the lock that shutdown() takes.
+    def _restart_pool(self, broken):
+        with self._pool_lock:
+            if self._pool is broken:
+                self._pool = self._new_pool()
+                cleanup = threading.Thread(target=broken.shutdown, kwargs={'wait': False})
+                cleanup.daemon = True
+                cleanup.start()
+            return self._pool
+
+    def _finish(self, batch, pool, future):
+        try:
+            responses = future.result()
+        except Exception as e:
+            if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                self._restart_pool(pool)
+            self._fail(batch, e)
+            return
+        for (request, sock, lock, received), response in zip(batch, responses):
+            self._reply(sock, lock, response, received)
+
+    def _fail(self, batch, e):
+        for request, sock, lock, received in batch:
+            self._reply(sock, lock, {'id': request['id'], 'ok': False, 'type': e.__class__.__name__,
+                                     'error': str(e)}, received)
+
+    def _reply(self, sock, lock, response, received):
+        try:
+            with lock:
+                _send(sock, response)
+        except OSError:
+            # The client went away
+            return
+        if received is not None:
+            with self._stats_lock:
+                self._latencies.append(time.time() - received)
+                self._count += 1
+
+def serve(path, workers=None, batch_size=16, batch_delay=0.002):
+    '''
+    Run a server.Server on path until interrupted or terminated, then print
+    the latency percentiles to stderr.
+    '''
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    server = Server(path, workers, batch_size, batch_delay)
+    sys.stderr.write('unwind: serving on %s\n' % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.stderr.write('unwind: %s\n' % json.dumps(server.latency(), sort_keys=True))
+
+# Remove the Unix socket at path if it was left behind by a server that's gone.
+# Files that aren't sockets and sockets that accept connections are left alone.
+def _remove_stale_socket(path):
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, 'Not replacing a file that is not a socket', path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+    else:
+        raise OSError(errno.EADDRINUSE, 'Another server is listening on the socket', path)
+    finally:
+        probe.close()
+
+class Client:
+    '''
+    A connection to a server.Server.
+
+        self.path = path of the Unix socket
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._condition = threading.Condition()
+        self._reading = False
+        self._closed = False
+        self._next_id = 0
+        self._responses = {}
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+    def decompile(self, path):
+        '''
+        Returns the same source code as unwind.decompile(path), raising
+        disasm.DisassemblerException or server.RemoteError on failure.
+        '''
+        return self._call('decompile', path=os.path.abspath(path))
+
+    def ping(self):
+        self._call('ping')
+
+    def stats(self):
+        '''
+        Returns the latency percentiles of the server, see Server.latency().
+        '''
+        return self._call('stats')
+
+    # Responses can come back out of order when several threads share the
+    # client. One waiting thread at a time reads from the socket and files the
+    # responses meant for the others, which wait on the condition until theirs
+    # arrives or it's their turn to read.
+    def _call(self, op, **arguments):
+        with self._condition:
+            self._next_id += 1
+            id = self._next_id
+            arguments.update(id=id, op=op)
+            _send(self._socket, arguments)
+            while id not in self._responses and self._reading and not self._closed:
+                self._condition.wait()
+            if id in self._responses:
+                return self._result(self._responses.pop(id))
+            if self._closed:
+                raise RemoteError('ConnectionError: the server closed the connection')
+            self._reading = True
+        try:
+            while True:
+                response = _receive(self._socket)
+                with self._condition:
+                    if response is None:
+                        self._closed = True
+                        raise RemoteError('ConnectionError: the server closed the connection')
+                    if response['id'] == id:
+                        break
+                    self._responses[response['id']] = response
+                    self._condition.notify_all()
+        finally:
+            with self._condition:
+                self._reading = False
+                self._condition.notify_all()
+        return self._result(response)
+
+    def _result(self, response):
+        if response['ok']:
+            return response['result']
+        if response['type'] == 'DisassemblerException':
+            raise disasm.DisassemblerException(response['error'])
+        raise RemoteError('%s: %s' % (response['type'], response['error']))
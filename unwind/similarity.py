@@ -0,0 +1,296 @@
+'''
+similarity.Signature(code, num_perm=64)
+    A compact similarity signature of a disasm.CodeObject, computed from the
+    shingles of its opcode stream (runs of four opcode names, see
+    op.opcodes, without CACHE and EXTENDED_ARG) and the sets of names and
+    constants it uses. Signatures don't depend on the Python version that
+    runs unwind, so they can be stored and compared later. Nested code
+    objects aren't included, they get signatures of their own.
+
+        self.minhash = array of num_perm MinHash values, the fraction of
+                       equal values in two signatures estimates the Jaccard
+                       similarity of their features
+        self.simhash = 64-bit SimHash, similar code has a small Hamming
+                       distance between SimHashes
+        self.size = number of features
+
+similarity.Signature.similarity(other)
+    Returns the estimated Jaccard similarity of two signatures from 0 to 1.
+
+similarity.Signature.distance(other)
+    Returns the Hamming distance of the SimHashes of two signatures.
+
+similarity.LSHIndex(threshold=0.8, num_perm=64)
+    A locality sensitive hashing index that finds signatures whose
+    estimated similarity is at least threshold without comparing against
+    every signature in the index. Signatures are split into bands that are
+    hashed into buckets, and only signatures sharing a bucket are compared.
+
+        index = unwind.similarity.LSHIndex(threshold=0.9)
+        for path in paths:
+            index.add_file(path)
+        for cluster in index.clusters():
+            print(cluster)
+
+similarity.LSHIndex.add(key, signature)
+    Add a signature under key, any hashable value. Adding a key that's
+    already in the index replaces its signature.
+
+similarity.LSHIndex.add_file(path, min_opcodes=8)
+    Disassemble the *.pyc file at path into columnar storage (see
+    disasm.OpcodeColumns) and add a signature for every code object with
+    at least min_opcodes opcodes, not counting CACHE and EXTENDED_ARG, under
+    the key (path, qualname). Tiny code objects like empty methods are too
+    similar to each other to be useful.
+
+similarity.LSHIndex.query(signature)
+    Returns a list of (key, similarity) pairs for the signatures in the
+    index with an estimated similarity of at least the threshold, most
+    similar first.
+
+similarity.LSHIndex.clusters()
+    Returns lists of keys that are connected by pairs of signatures with a
+    similarity of at least the threshold. Like query(), only pairs that
+    share a bucket are compared, so a similar pair can be missed with a
+    small probability. Keys without a near-duplicate aren't included.
+'''
+
+import struct
+import hashlib
+from array import array
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+# Length of the runs of opcodes used as features
+_SHINGLE = 4
+
+# MinHash uses the universal hash functions (a * x + b) mod p, one per
+# permutation, with fixed coefficients so signatures are comparable across
+# processes and runs
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+def _coefficients(count):
+    result = []
+    seed = 0
+    while len(result) < count:
+        digest = hashlib.sha1(('unwind-minhash-%d' % seed).encode('ascii')).digest()
+        a, b = struct.unpack('<QQ', digest[:16])
+        result.append((a % (_PRIME - 1) + 1, b % _PRIME))
+        seed += 1
+    return result
+
+_coefficient_cache = {}
+
+# Hash a feature to a 64-bit integer
+def _hash(feature):
+    return struct.unpack('<Q', hashlib.blake2b(feature, digest_size=8).digest())[0]
+
+# Opcodes left out of the shingles. CACHE entries (Python 3.11 and later)
+# only reserve room after some opcodes and EXTENDED_ARG depends on how large
+# the arguments are.
+_IGNORED = frozenset(op.opcode_ids[name] for name in ['CACHE', 'EXTENDED_ARG'] if name in op.opcode_ids)
+
+# Returns the names of the opcodes of a code object whose opcodes are stored
+# in a disasm.OpcodeColumns (or a list of disasm.Opcode), except _IGNORED
+def _opcode_names(code):
+    opcodes = code.opcodes
+    if isinstance(opcodes, disasm.OpcodeColumns):
+        ids = opcodes.ids
+    else:
+        ids = [o.opcode for o in opcodes]
+    names = op.opcode_names
+    return [names[i] for i in ids if i not in _IGNORED]
+
+# Returns the feature hashes of a code object
+def _feature_hashes(code):
+    names = _opcode_names(code)
+    features = set()
+    for i in range(max(len(names) - _SHINGLE, 0) + 1):
+        features.add(('o' + ' '.join(names[i:i + _SHINGLE])).encode('ascii'))
+    for name in code.co_names or ():
+        features.add(('n' + name).encode('utf8', 'surrogatepass'))
+    for value in code.co_consts or ():
+        if not isinstance(value, disasm.CodeObject):
+            features.add(('c' + repr(value)).encode('utf8', 'surrogatepass'))
+    return [_hash(f) for f in features]
+
+class Signature:
+    '''
+    A MinHash and SimHash signature of one code object. See the module
+    documentation for details.
+    '''
+
+    def __init__(self, code, num_perm=64):
+        hashes = _feature_hashes(code)
+        self.size = len(hashes)
+
+        coefficients = _coefficient_cache.get(num_perm)
+        if coefficients is None:
+            coefficients = _coefficient_cache[num_perm] = _coefficients(num_perm)
+        if hashes:
+            self.minhash = array('Q', [min((a * x + b) % _PRIME for x in hashes) for a, b in coefficients])
+        else:
+            self.minhash = array('Q', [_MASK] * num_perm)
+
+        # Every feature votes for each bit of the SimHash with its own bit
+        votes = [0] * 64
+        for x in hashes:
+            for bit in range(64):
+                votes[bit] += 1 if x >> bit & 1 else -1
+        self.simhash = sum(1 << bit for bit in range(64) if votes[bit] > 0)
+
+    def similarity(self, other):
+        '''
+        Returns the estimated Jaccard similarity of the features of two
+        signatures, from 0 to 1.
+        '''
+        same = sum(1 for x, y in zip(self.minhash, other.minhash) if x == y)
+        return same / float(len(self.minhash))
+
+    def distance(self, other):
+        '''
+        Returns the number of bits that differ between the SimHashes of two
+        signatures.
+        '''
+        return bin(self.simhash ^ other.simhash).count('1')
+
+# Pick the number of rows per band so that the similarity where a pair has a
+# 50% chance of sharing a bucket, (1 / bands) ** (1 / rows), is closest to the
+# threshold without going over it. Thresholds below 1 / num_perm, which every
+# split goes over, get one row per band, the split that finds the most pairs.
+def _bands(threshold, num_perm):
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        point = (1.0 / bands) ** (1.0 / rows)
+        if point <= threshold and (best is None or point > best[0]):
+            best = (point, bands, rows)
+    if best is None:
+        return num_perm, 1
+    return best[1], best[2]
+
+class LSHIndex:
+    '''
+    A locality sensitive hashing index of signatures. See the module
+    documentation for details.
+
+        self.threshold = minimum estimated similarity of query results
+        self.num_perm = number of MinHash values in each signature
+        self.bands = number of bands each signature is split into
+        self.rows = number of MinHash values in each band
+        self.signatures = map of key to similarity.Signature
+    '''
+
+    def __init__(self, threshold=0.8, num_perm=64):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = _bands(threshold, num_perm)
+        self.signatures = {}
+        self._buckets = [{} for i in range(self.bands)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def add(self, key, signature):
+        '''
+        Add signature to the index under key, replacing the signature
+        already stored under key.
+        '''
+        assert len(signature.minhash) == self.num_perm
+        old = self.signatures.get(key)
+        if old is not None:
+            for band, buckets in zip(self._band_keys(old), self._buckets):
+                keys = buckets[band]
+                keys.remove(key)
+                if not keys:
+                    del buckets[band]
+        self.signatures[key] = signature
+        for band, buckets in zip(self._band_keys(signature), self._buckets):
+            buckets.setdefault(band, []).append(key)
+
+    def add_file(self, path, min_opcodes=8):
+        '''
+        Add a signature for every code object in the *.pyc file at path
+        with at least min_opcodes opcodes under the key (path, qualname).
+        Returns the number of signatures added.
+        '''
+        module = disasm.disassemble(path, columnar=True)
+        count = 0
+        for qualname, code in disasm.walk(module.body):
+            if len(_opcode_names(code)) >= min_opcodes:
+                self.add((path, qualname), Signature(code, self.num_perm))
+                count += 1
+        return count
+
+    def candidates(self, signature):
+        '''
+        Returns the set of keys that share at least one bucket with signature.
+        '''
+        result = set()
+        for band, buckets in zip(self._band_keys(signature), self._buckets):
+            result.update(buckets.get(band, ()))
+        return result
+
+    def query(self, signature):
+        '''
+        Returns (key, similarity) pairs for signatures in the index with an
+        estimated similarity of at least self.threshold, most similar first.
+        '''
+        results = []
+        for key in self.candidates(signature):
+            similarity = signature.similarity(self.signatures[key])
+            if similarity >= self.threshold:
+                results.append((key, similarity))
+        results.sort(key=lambda pair: -pair[1])
+        return results
+
+    def clusters(self):
+        '''
+        Returns a list of lists of keys that are connected by pairs with a
+        similarity of at least self.threshold, largest first. Only pairs
+        that share a bucket are compared.
+        '''
+        parent = {}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        # The keys of a bucket are split into groups connected by similar
+        # pairs. A key joins every group that has a member similar to it, so
+        # groups it connects are merged, and members of a group it's already
+        # connected to through other buckets aren't compared again.
+        for buckets in self._buckets:
+            for keys in buckets.values():
+                groups = []
+                for key in keys:
+                    signature = self.signatures[key]
+                    parent.setdefault(key, key)
+                    merged = [key]
+                    rest = []
+                    for members in groups:
+                        if find(members[0]) == find(key) or any(
+                                signature.similarity(self.signatures[m]) >= self.threshold for m in members):
+                            parent[find(members[0])] = find(key)
+                            merged += members
+                        else:
+                            rest.append(members)
+                    groups = rest + [merged]
+
+        groups = {}
+        for key in parent:
+            groups.setdefault(find(key), set()).add(key)
+        result = [sorted(group, key=repr) for group in groups.values() if len(group) > 1]
+        result.sort(key=lambda group: (-len(group), repr(group[0])))
+        return result
+
+    def _band_keys(self, signature):
+        minhash = signature.minhash
+        rows = self.rows
+        return [minhash[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
@@ -0,0 +1,161 @@
+'''
+sourcemap.SourceMap(code=None)
+    Maps lines of decompiled source code back to ranges of bytecode offsets
+    in code, a disasm.CodeObject, and through its line table (see
+    disasm.CodeObject.line_table()) to line numbers in the original source.
+    Pass one to decomp.decompile() or to codegen.SourceCodeGenerator.write()
+    to have it filled in. Output lines and original lines are numbered
+    from 1.
+
+        source_map = unwind.sourcemap.SourceMap()
+        source = unwind.decompile('example.pyc', source_map=source_map)
+        lines = source_map.output_lines(traceback_line)
+        if lines:
+            print(source.splitlines()[lines[0] - 1])
+
+sourcemap.SourceMap.lookup(line)
+    Returns a tuple of (original line, start offset, end offset) for a line
+    of decompiled output, or None if that line doesn't map to any bytecode.
+    The end offset is exclusive.
+
+sourcemap.SourceMap.output_lines(original_line)
+    Returns a sorted list of the lines of decompiled output that were
+    generated from the given line of the original source, which is empty
+    if no output line was.
+
+sourcemap.SourceMap.output_line(offset)
+    Returns the line of decompiled output generated from the opcode at the
+    given bytecode offset, or None.
+
+sourcemap.SourceMap.as_dict()
+    Returns the map as plain lists and dicts suitable for JSON. Runs of
+    consecutive output lines with the same bytecode range are stored once
+    as [output line, original line, start offset, end offset].
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+class SourceMap:
+    '''
+    Maps lines of decompiled output back to bytecode and original lines.
+
+        self.code = disasm.CodeObject the bytecode offsets refer to, filled
+                    in by decomp.decompile() if it's None
+    '''
+
+    def __init__(self, code=None):
+        self.code = code
+        self._entries = []
+        self._index = None
+
+    def add(self, first, last, span):
+        '''
+        Record that output lines first to last (inclusive) were generated
+        from span, a tuple of (start offset, end offset). Statements must be
+        added innermost first, a line keeps the first span it was given.
+        '''
+        self._entries.append((first, last, span))
+        self._index = None
+
+    def lookup(self, line):
+        '''
+        Returns (original line, start offset, end offset) for a line of
+        decompiled output, or None if it doesn't map to any bytecode.
+        '''
+        index = self._build()
+        i = bisect_right(index.output, line) - 1
+        if i < 0 or line > index.last[i]:
+            return None
+        return index.original[i], index.starts[i], index.ends[i]
+
+    def output_lines(self, original_line):
+        '''
+        Returns a sorted list of the output lines generated from the given
+        line of the original source, empty if there are none.
+        '''
+        index = self._build()
+        lo = bisect_left(index.by_original, original_line)
+        hi = bisect_right(index.by_original, original_line)
+        return sorted(index.output[index.by_original_run[i]] for i in range(lo, hi))
+
+    def output_line(self, offset):
+        '''
+        Returns the output line generated from the opcode at offset, or None
+        if no output line covers it.
+        '''
+        index = self._build()
+        i = bisect_right(index.by_start, offset) - 1
+
+        # Statements don't overlap unless one was merged from several others,
+        # so the run that starts closest before offset almost always covers
+        # it and this only looks back further when it doesn't
+        while i >= 0:
+            run = index.by_start_run[i]
+            if offset < index.ends[run]:
+                return index.output[run]
+            i -= 1
+        return None
+
+    def as_dict(self):
+        index = self._build()
+        return {
+            'filename': self.code.co_filename if self.code is not None else None,
+            'mappings': [[index.output[i], index.original[i], index.starts[i], index.ends[i]]
+                         for i in range(len(index.output))],
+        }
+
+    # Compress the recorded statements into runs of output lines sharing a
+    # span and sort them for binary searching. This is done once, on the
+    # first lookup after the map changed.
+    def _build(self):
+        if self._index is not None:
+            return self._index
+
+        # Inner statements are added before the statements enclosing them,
+        # so the first span that claims a line is the most specific one
+        size = max([last for first, last, span in self._entries] or [0])
+        spans = [None] * (size + 1)
+        for first, last, span in self._entries:
+            for line in range(first, last + 1):
+                if spans[line] is None:
+                    spans[line] = span
+
+        table = self.code.line_table() if self.code is not None else None
+        index = _Index()
+        for line in range(1, size + 1):
+            span = spans[line]
+            if span is None:
+                continue
+            if index.output and index.last[-1] == line - 1 and spans[line - 1] == span:
+                index.last[-1] = line
+                continue
+            index.output.append(line)
+            index.last.append(line)
+            index.starts.append(span[0])
+            index.ends.append(span[1])
+            index.original.append(table.line_for_offset(span[0]) if table else 0)
+
+        runs = range(len(index.output))
+        index.by_original_run = sorted(runs, key=lambda i: (index.original[i], index.output[i]))
+        index.by_original = array('I', [index.original[i] for i in index.by_original_run])
+        index.by_start_run = sorted(runs, key=lambda i: (index.starts[i], index.output[i]))
+        index.by_start = array('I', [index.starts[i] for i in index.by_start_run])
+
+        self._index = index
+        return index
+
+# The sorted arrays built by SourceMap._build(). Runs are numbered in order of
+# output line, by_original and by_start are sorted keys that map back to runs
+# through by_original_run and by_start_run.
+class _Index:
+    def __init__(self):
+        self.output = array('I')
+        self.last = array('I')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.original = array('I')
+        self.by_original = None
+        self.by_original_run = None
+        self.by_start = None
+        self.by_start_run = None
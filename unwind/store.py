@@ -0,0 +1,364 @@
+'''
+store.save(module, path), store.dumps(module)
+    Write a disasm.Module to the file at path or return it as bytes, in a
+    compact binary format meant for keeping disassembly around for later
+    analysis. Strings and constants are stored once in a pool no matter how
+    many code objects use them, and the opcodes of each code object are
+    stored as columns like disasm.OpcodeColumns. An index at the end of the
+    file lists every code object by qualified name (see disasm.walk()).
+
+store.Reader(source, columnar=False)
+    Opens the binary format from a path, which is memory mapped, or from a
+    bytes-like object. Code objects are only decoded when they're asked
+    for: code(key) materializes a single code object (and the code objects
+    nested in its constants) and module() materializes all of them.
+    Constants are decoded once and shared, so two code objects that use the
+    same tuple of names get the same tuple. If columnar is True, opcodes are
+    stored in disasm.OpcodeColumns.
+
+        with unwind.store.Reader('app.unwind') as reader:
+            for qualname in reader.qualnames():
+                ...
+            code = reader.code('Parser.parse')
+
+        self.magic = magic number of the original *.pyc file
+        self.timestamp = timestamp of the original *.pyc file
+        self.python_version = interpreter version as a string
+
+store.Reader.qualnames()
+    Returns the qualified names of every code object in the file, in the
+    order of disasm.walk().
+
+store.Reader.code(key)
+    Returns the disasm.CodeObject with the given qualified name or index in
+    qualnames(). Raises KeyError if there's no such code object.
+
+store.Reader.module()
+    Returns the whole disasm.Module.
+
+store.load(path, columnar=False)
+    Shorthand for store.Reader(path, columnar).module().
+
+store.FormatError
+    Raised by store.Reader for data that isn't in the binary format or was
+    written by an incompatible version of it.
+
+The format is little-endian. A fixed header holds the positions of three
+sections: the pool, the code objects and the index. The pool is a list of
+every distinct constant, string and tuple of names in the module, written
+with marshal version 4 so the whole pool is decoded by a single call into
+C. It also holds the names of the opcode ids, so files stay readable when
+the ids change. A code object refers to its fields by their position in
+the pool (constants that are code objects refer to the index instead) and
+is followed by its opcode columns, whose arrays are 16-bit when their
+values fit.
+'''
+
+import sys
+import mmap
+import struct
+import marshal
+from array import array
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+class FormatError(Exception):
+    '''
+    The data isn't in the binary format of store.save().
+    '''
+
+# Increment when the layout changes in a way old readers can't handle
+FORMAT_VERSION = 1
+
+_MAGIC = b'UNWB'
+
+# The pool is readable by every Python 3 since 3.4
+_MARSHAL_VERSION = 4
+
+# Magic, format version, magic number of the *.pyc, whether there's a
+# timestamp, timestamp, pool positions of the Python version and the opcode
+# names, and the positions of the pool, the code objects and the index
+_HEADER = struct.Struct('<4sIIIqIIQQQ')
+
+# Parent index (-1 for the module), pool position of the qualified name,
+# position of the code object
+_INDEX_ENTRY = struct.Struct('<iIQ')
+
+# Fields of a code object in the order their pool positions are stored.
+# co_consts is stored separately since it can hold code objects.
+_CODE_FIELDS = ('co_argcount', 'co_posonlyargcount', 'co_kwonlyargcount', 'co_nlocals', 'co_stacksize',
+                'co_flags', 'co_code', 'co_names', 'co_varnames', 'co_freevars', 'co_cellvars',
+                'co_filename', 'co_name', 'co_qualname', 'co_firstlineno', 'co_lnotab',
+                'co_linetable', 'co_exceptiontable')
+
+# Pool positions of the fields, the number of constants, the number of
+# opcodes and whether the offsets and arguments need 32 bits
+_CODE_HEADER = struct.Struct('<%dIIIBB' % len(_CODE_FIELDS))
+
+# Marks constants that are code objects, whose index is in the lower bits
+_CODE_REF = 0x80000000
+
+# Arrays are written in little-endian order
+def _array_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _array_from(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+# Returns values as a little-endian array of 16-bit integers if they all fit,
+# otherwise of 32-bit integers, and whether they needed 32 bits
+def _narrow(values):
+    if not values or max(values) < 0x10000:
+        return _array_bytes(array('H', values)), False
+    return _array_bytes(array('I', values)), True
+
+class _Pool:
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    # Equal values share a position. They're compared by their marshal
+    # encoding, which tells 1, 1.0 and True as well as 0.0 and -0.0 apart.
+    def add(self, value):
+        try:
+            key = marshal.dumps(value, _MARSHAL_VERSION)
+        except ValueError:
+            raise TypeError('Cannot store constant %r' % (value,))
+        index = self.ids.get(key)
+        if index is None:
+            index = self.ids[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+# Returns the raw arguments of the opcodes of code, which are looked up again
+# when reading. Opcodes that were disassembled into a list have the resolved
+# argument, which is turned back into an index.
+def _raw_arguments(code):
+    opcodes = code.opcodes
+    if isinstance(opcodes, disasm.OpcodeColumns):
+        return opcodes.arguments
+    consts = dict((id(value), i) for i, value in reversed(list(enumerate(code.co_consts or ()))))
+    names = dict((name, i) for i, name in reversed(list(enumerate(code.co_names or ()))))
+    varnames = dict((name, i) for i, name in reversed(list(enumerate(code.co_varnames or ()))))
+    result = array('I')
+    for o in opcodes:
+        flags = op.opcode_flags[o.opcode]
+        if not flags & op.HAS_ARGUMENT:
+            result.append(0)
+        elif o.opcode == op.LOAD_CONST:
+            result.append(consts[id(o.argument)])
+        elif flags & op.USES_NAMES:
+            result.append(names[o.argument])
+        elif flags & op.USES_VARNAMES:
+            result.append(varnames[o.argument])
+        else:
+            result.append(o.argument)
+    return result
+
+def _write_code(pool, code_ids, code):
+    fields = [pool.add(getattr(code, field)) for field in _CODE_FIELDS]
+    consts = array('I')
+    for value in code.co_consts or ():
+        if isinstance(value, disasm.CodeObject):
+            consts.append(_CODE_REF | code_ids[id(value)])
+        else:
+            consts.append(pool.add(value))
+
+    opcodes = code.opcodes
+    if isinstance(opcodes, disasm.OpcodeColumns):
+        offsets, sizes, ids = opcodes.offsets, opcodes.sizes, opcodes.ids
+    else:
+        offsets = [o.offset for o in opcodes]
+        sizes = array('B', [o.size for o in opcodes])
+        ids = array('B', [o.opcode for o in opcodes])
+    offsets, wide_offsets = _narrow(offsets)
+    arguments, wide_arguments = _narrow(_raw_arguments(code))
+    header = _CODE_HEADER.pack(*fields + [len(consts), len(opcodes), wide_offsets, wide_arguments])
+    return b''.join([header, _array_bytes(consts), offsets, arguments, sizes.tobytes(), ids.tobytes()])
+
+def dumps(module):
+    '''
+    Returns module, a disasm.Module, in the binary format as bytes.
+    '''
+    pool = _Pool()
+    codes = list(disasm.walk(module.body))
+    code_ids = {}
+    parents = {}
+    for index, (qualname, code) in enumerate(codes):
+        code_ids[id(code)] = index
+        for value in code.co_consts or ():
+            if isinstance(value, disasm.CodeObject):
+                parents[id(value)] = index
+
+    records = [_write_code(pool, code_ids, code) for qualname, code in codes]
+    version = pool.add(module.python_version)
+    names = pool.add(op.opcode_names)
+    qualnames = [pool.add(qualname) for qualname, code in codes]
+    pool_data = marshal.dumps(pool.values, _MARSHAL_VERSION)
+
+    position = _HEADER.size + len(pool_data)
+    code_position = position
+    index = [struct.pack('<I', len(codes))]
+    for i, (qualname, code) in enumerate(codes):
+        index.append(_INDEX_ENTRY.pack(parents.get(id(code), -1), qualnames[i], position))
+        position += len(records[i])
+
+    has_timestamp = module.timestamp is not None
+    header = _HEADER.pack(_MAGIC, FORMAT_VERSION, module.magic, has_timestamp, module.timestamp or 0,
+                          version, names, _HEADER.size, code_position, position)
+    return b''.join([header, pool_data] + records + index)
+
+def save(module, path):
+    '''
+    Write module, a disasm.Module, to the file at path in the binary format.
+    '''
+    with open(path, 'wb') as f:
+        f.write(dumps(module))
+
+class Reader:
+    '''
+    Lazily decodes a module in the binary format. See the module
+    documentation.
+    '''
+
+    def __init__(self, source, columnar=False):
+        self.columnar = columnar
+        self._file = None
+        self._mmap = None
+        if isinstance(source, str):
+            self._file = open(source, 'rb')
+            try:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._file.close()
+                raise FormatError('%s is empty' % source)
+            data = memoryview(self._mmap)
+        else:
+            data = memoryview(source).cast('B')
+        self._data = data
+
+        if len(data) < _HEADER.size:
+            self.close()
+            raise FormatError('Data is too short for the header')
+        (magic, version, self.magic, has_timestamp, timestamp, version_string, names,
+         pool_position, code_position, index_position) = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            self.close()
+            raise FormatError('Data is not in the unwind binary format')
+        if version != FORMAT_VERSION:
+            self.close()
+            raise FormatError('Unsupported format version %d, expected %d' % (version, FORMAT_VERSION))
+        self.timestamp = timestamp if has_timestamp else None
+
+        self._pool = marshal.loads(data[pool_position:code_position])
+        self.python_version = self._pool[version_string]
+
+        # Opcode ids are translated to the ones of this version of unwind if
+        # they differ
+        names = self._pool[names]
+        if names == op.opcode_names:
+            self._translate = None
+        else:
+            ids = [op.opcode_ids.get(name, op.INVALID_ID) for name in names]
+            self._translate = bytes(ids + [op.INVALID_ID] * (256 - len(ids)))
+
+        count = struct.unpack_from('<I', data, index_position)[0]
+        self._index = [_INDEX_ENTRY.unpack_from(data, index_position + 4 + i * _INDEX_ENTRY.size)
+                       for i in range(count)]
+        self._qualnames = [self._pool[entry[1]] for entry in self._index]
+        self._by_qualname = {}
+        for i, qualname in enumerate(self._qualnames):
+            self._by_qualname.setdefault(qualname, i)
+        self._codes = {}
+
+    def close(self):
+        self._data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+    def qualnames(self):
+        '''
+        Returns the qualified names of every code object in the file.
+        '''
+        return list(self._qualnames)
+
+    def code(self, key):
+        '''
+        Returns the disasm.CodeObject with the qualified name or index key.
+        '''
+        index = self._by_qualname[key] if isinstance(key, str) else key
+        code = self._codes.get(index)
+        if code is None:
+            if not 0 <= index < len(self._index):
+                raise KeyError(key)
+            code = self._codes[index] = self._read_code(index)
+        return code
+
+    def module(self):
+        '''
+        Returns the whole disasm.Module.
+        '''
+        return disasm.Module(self.magic, self.timestamp, self.python_version, self.code(0))
+
+    def _read_code(self, index):
+        data = self._data
+        pool = self._pool
+        position = self._index[index][2]
+        header = _CODE_HEADER.unpack_from(data, position)
+        code = disasm.CodeObject(**dict(zip(_CODE_FIELDS, [pool[i] for i in header[:len(_CODE_FIELDS)]])))
+        consts_count, count, wide_offsets, wide_arguments = header[len(_CODE_FIELDS):]
+
+        start = position + _CODE_HEADER.size
+        end = start + 4 * consts_count
+        code.co_consts = tuple([self.code(i & ~_CODE_REF) if i & _CODE_REF else pool[i]
+                                for i in _array_from('I', data[start:end])])
+        start, end = end, end + (4 if wide_offsets else 2) * count
+        offsets = _array_from('I' if wide_offsets else 'H', data[start:end])
+        start, end = end, end + (4 if wide_arguments else 2) * count
+        arguments = _array_from('I' if wide_arguments else 'H', data[start:end])
+        sizes = bytes(data[end:end + count])
+        ids = bytes(data[end + count:end + 2 * count])
+        if self._translate is not None:
+            ids = ids.translate(self._translate)
+            if op.INVALID_ID in ids:
+                raise FormatError('Unknown opcode in %s' % self._qualnames[index])
+
+        # The columns keep the 16-bit arrays, which read the same as the
+        # 32-bit ones of the disassembler
+        if self.columnar:
+            columns = code.opcodes = disasm.OpcodeColumns(code)
+            columns.offsets = offsets
+            columns.sizes.frombytes(sizes)
+            columns.ids.frombytes(ids)
+            columns.arguments = arguments
+        else:
+            flags = op.opcode_flags
+            resolve = disasm.resolve_argument
+            code.opcodes = [disasm.Opcode(offset, size, opcode, resolve(code, opcode, argument)
+                                          if flags[opcode] & op.HAS_ARGUMENT else None)
+                            for offset, size, opcode, argument in zip(offsets, sizes, ids, arguments)]
+        return code
+
+def load(path, columnar=False):
+    '''
+    Returns the disasm.Module stored in the file at path.
+    '''
+    with Reader(path, columnar) as reader:
+        return reader.module()
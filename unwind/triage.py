@@ -0,0 +1,257 @@
+'''
+triage.scan(root, workers=8, batch_size=256)
+    Iterates over a triage.Record for every *.pyc and *.pyo file under root
+    (a directory or a single file), reading only the header of each file
+    instead of unmarshalling its body. Directories are listed with
+    os.scandir() and headers are read by a pool of workers threads in
+    batches of batch_size files. Only a few batches per thread are in
+    flight at once, so memory use doesn't grow with the size of the tree.
+    Records come out in the same order every time the same tree is scanned
+    and symbolic links to directories aren't followed. Also
+    available as unwind.scan() and "python -m unwind scan ROOT".
+
+        summary = unwind.triage.Summary()
+        for record in unwind.scan('/srv/app'):
+            summary.add(record)
+        print(summary.format())
+
+triage.Record
+    The header of one file.
+
+        self.path = path of the file
+        self.size = size of the file in bytes
+        self.magic = 32-bit magic number, None if the file is too short
+        self.python_version = interpreter version from
+                              op.python_version_from_magic(), None for an
+                              unknown magic number
+        self.header_size = 8, 12 or 16, see op.header_size()
+        self.flags = PEP 552 flags, None before Python 3.7
+        self.timestamp = unix timestamp of the source when the file was
+                         compiled, None for hash-based files
+        self.source_size = size of the source, None before Python 3.3 and
+                           for hash-based files
+        self.source_hash = hex digest of the source for hash-based files
+        self.error = description of the problem if the file couldn't be
+                     read or is too short, otherwise None
+
+triage.Record.to_dict()
+    Returns the record as a dict of JSON-compatible values.
+
+triage.Summary()
+    Histograms over many records, filled in with add(record).
+
+        self.files = number of records
+        self.bytes = total size of the files
+        self.errors = number of records with an error
+        self.versions = collections.Counter of Python versions, "unknown"
+                        for magic numbers that aren't known
+        self.magics = collections.Counter of magic numbers
+        self.headers = collections.Counter of header layouts, "8", "12",
+                       "16" or "16-hash"
+        self.years = collections.Counter of the UTC year of timestamps
+        self.sizes = collections.Counter of file sizes rounded up to a
+                     power of two
+
+triage.Summary.to_dict(), triage.Summary.format()
+    Returns the histograms as a dict of JSON-compatible values or as
+    readable text.
+'''
+
+import os
+import time
+import struct
+import collections
+import concurrent.futures
+
+import unwind.op as op
+import unwind.disasm as disasm
+
+class Record:
+    '''
+    The header of one *.pyc file. See the module documentation.
+    '''
+
+    def __init__(self, path, size=None, error=None):
+        self.path = path
+        self.size = size
+        self.magic = None
+        self.python_version = None
+        self.header_size = None
+        self.flags = None
+        self.timestamp = None
+        self.source_size = None
+        self.source_hash = None
+        self.error = error
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'size': self.size,
+            'magic': self.magic,
+            'python_version': self.python_version,
+            'header_size': self.header_size,
+            'flags': self.flags,
+            'timestamp': self.timestamp,
+            'source_size': self.source_size,
+            'source_hash': self.source_hash,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return 'Record(%r, %s, %s)' % (self.path, self.python_version, self.error or self.size)
+
+# Read the header of the file at path into a record. os.open() and os.read()
+# skip the buffering of open(), which matters when there's nothing to buffer.
+def _read_record(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            data = os.read(fd, 16)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        return Record(path, error='%s: %s' % (e.__class__.__name__, e.strerror))
+
+    record = Record(path, size)
+    if len(data) >= 4:
+        record.magic = struct.unpack('=I', data[:4])[0]
+        record.header_size = op.header_size(record.magic)
+    try:
+        magic, record.flags, record.timestamp, record.source_size, source_hash = disasm.unpack_header(data)
+    except disasm.DisassemblerException as e:
+        record.error = str(e)
+        return record
+    record.python_version = op.python_version_from_magic(magic)
+    if source_hash is not None:
+        record.source_hash = source_hash.hex()
+    return record
+
+# Both kinds of work done by the threads return (records, paths of compiled
+# files, paths of directories)
+def _read_batch(paths):
+    return [_read_record(path) for path in paths], [], []
+
+def _list_directory(path):
+    files = []
+    directories = []
+    try:
+        entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+    except OSError as e:
+        return [Record(path, error='%s: %s' % (e.__class__.__name__, e.strerror))], [], []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif disasm.is_compiled(entry.name) and entry.is_file():
+                files.append(entry.path)
+        except OSError:
+            continue
+    return [], files, directories
+
+def scan(root, workers=8, batch_size=256):
+    '''
+    Iterates over a triage.Record for every compiled file under root,
+    reading only the headers.
+    '''
+    if not os.path.isdir(root):
+        yield _read_record(root)
+        return
+
+    # Batches of headers to read go before directories to list, which keeps
+    # the number of paths waiting to be read small
+    directories = [root]
+    batches = collections.deque()
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        try:
+            while directories or batches or pending:
+                while len(pending) < workers * 2 and (batches or directories):
+                    if batches:
+                        pending.append(pool.submit(_read_batch, batches.popleft()))
+                    else:
+                        pending.append(pool.submit(_list_directory, directories.pop()))
+                records, files, subdirectories = pending.popleft().result()
+                for record in records:
+                    yield record
+                for i in range(0, len(files), batch_size):
+                    batches.append(files[i:i + batch_size])
+                directories.extend(reversed(subdirectories))
+        finally:
+            for future in pending:
+                future.cancel()
+
+# Names of the header layouts in Summary.headers
+_HEADER_NAMES = {8: '8', 12: '12', 16: '16'}
+
+class Summary:
+    '''
+    Histograms over many triage.Record instances. See the module
+    documentation.
+    '''
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.versions = collections.Counter()
+        self.magics = collections.Counter()
+        self.headers = collections.Counter()
+        self.years = collections.Counter()
+        self.sizes = collections.Counter()
+        self._years_by_day = {}
+
+    def add(self, record):
+        self.files += 1
+        size = record.size
+        if size is not None:
+            self.bytes += size
+            self.sizes[1 << (size - 1).bit_length() if size else 1] += 1
+        if record.error:
+            self.errors += 1
+            return
+        self.versions[record.python_version or 'unknown'] += 1
+        self.magics[record.magic] += 1
+        self.headers['16-hash' if record.source_hash else _HEADER_NAMES[record.header_size]] += 1
+        if record.timestamp is not None:
+            self.years[self._year(record.timestamp)] += 1
+
+    # Year of a timestamp, remembered by day since files tend to be compiled
+    # on a small number of days. Each summary has its own, so summaries
+    # filled in by different threads don't share it.
+    def _year(self, timestamp):
+        day = timestamp // 86400
+        year = self._years_by_day.get(day)
+        if year is None:
+            year = self._years_by_day[day] = time.gmtime(day * 86400).tm_year
+        return year
+
+    def to_dict(self):
+        '''
+        Returns the summary as a dict of JSON-compatible values.
+        '''
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'versions': dict(self.versions),
+            'magics': dict((str(magic), count) for magic, count in self.magics.items()),
+            'headers': dict(self.headers),
+            'years': dict((str(year), count) for year, count in self.years.items()),
+            'sizes': dict((str(size), count) for size, count in self.sizes.items()),
+        }
+
+    def format(self):
+        '''
+        Returns the histograms as readable text.
+        '''
+        lines = ['%d files, %d bytes, %d errors' % (self.files, self.bytes, self.errors)]
+        for title, counter, key in [('versions', self.versions, lambda item: -item[1]),
+                                    ('headers', self.headers, lambda item: item[0]),
+                                    ('years', self.years, lambda item: item[0]),
+                                    ('sizes', self.sizes, lambda item: item[0])]:
+            if counter:
+                lines.append('%s:' % title)
+                for value, count in sorted(counter.items(), key=key):
+                    lines.append('    %-20s %d' % ('<= %d' % value if counter is self.sizes else value, count))
+        return '\n'.join(lines)